@@ -9,6 +9,7 @@ from snapshot import Snapshot as RestSnapshot
 from utility.utility import logging
 from utility.utility import get_longhorn_client
 from utility.utility import get_retry_count_and_interval
+from utility.utility import get_retry_policy
 import utility.constant as constant
 
 from volume import Rest as RestVolume
@@ -149,7 +150,7 @@ class Rest(Base):
 
     def wait_for_backup_completed(self, volume_name, snapshot_name):
         completed = False
-        for i in range(self.retry_count):
+        for i in get_retry_policy("backup").attempts():
             logging(f"Waiting for backup from volume {volume_name} snapshot {snapshot_name} completed ... ({i})")
             volume = self.volume.get(volume_name)
             for backup in volume.backupStatus:
@@ -161,7 +162,6 @@ class Rest(Base):
                     break
             if completed:
                 break
-            time.sleep(self.retry_interval)
         assert completed, f"Expected backup from volume {volume_name} snapshot {snapshot_name} completed, but it's {volume}"
 
     def wait_for_backup_in_progress(self, volume_name):
@@ -1,3 +1,5 @@
 from backupstore.nfs import Nfs
 from backupstore.s3 import S3
 from backupstore.cifs import Cifs
+from backupstore.local import LocalNfs
+from backupstore.local import LocalS3
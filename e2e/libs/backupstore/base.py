@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import os
 import re
@@ -14,6 +15,14 @@ from utility.utility import subprocess_exec_cmd
 from utility.constant import DEFAULT_BACKUPSTORE
 from utility import constant
 
+from backupstore.inventory import Inventory
+from backupstore.inventory import LIST_PARALLELISM
+from backupstore.inventory import get_backup_name
+from backupstore.inventory import get_block_checksum
+from backupstore.inventory import get_cached_inventory
+from backupstore.inventory import set_cached_inventory
+from backupstore.inventory import map_block_prefixes
+
 SECOND = 1
 MINUTE = 60 * SECOND
 HOUR = 60 * MINUTE
@@ -79,6 +88,77 @@ class Base(ABC):
 
         return backupstore_bv_path
 
+    def list_block_files(self, blocks_dir, prefix, with_size=False):
+        # yield the (file name, size) of the block files under a first level
+        # prefix of the blocks dir of a mounted backupstore, the size is only
+        # stat'ed if asked for
+        for root, _, files in os.walk(os.path.join(blocks_dir, prefix)):
+            for file_name in files:
+                size = os.stat(os.path.join(root, file_name)).st_size if with_size else None
+                yield file_name, size
+
+    def read_backup_cfg_files(self, volume_name):
+        # return the (backup name, content) of the backup cfg files of a
+        # mounted backupstore
+        backups_dir = os.path.join(self.get_backup_volume_prefix(volume_name), "backups")
+        if not os.path.isdir(backups_dir):
+            return []
+
+        def read(file_name):
+            with open(os.path.join(backups_dir, file_name), 'r') as f:
+                return get_backup_name(file_name), f.read()
+
+        file_names = [name for name in os.listdir(backups_dir) if get_backup_name(name)]
+        with ThreadPoolExecutor(max_workers=LIST_PARALLELISM) as executor:
+            return list(executor.map(read, file_names))
+
+    def count_backup_block_files(self, volume_name):
+        # count the block files prefix by prefix in parallel, without keeping
+        # the listing around
+        backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
+        counts = map_block_prefixes(
+            lambda prefix: sum(1 for _ in self.list_block_files(backup_blocks_dir, prefix)))
+        return sum(counts)
+
+    def get_backup_volume_inventory(self, volume_name, refresh=False):
+        """
+        Return the index of the block files and of the blocks referred by the
+        backups of a backup volume. The index is built once and reused until
+        refresh is set, so dedup ratio, block reuse or orphaned blocks can be
+        queried without listing the backupstore again.
+        """
+        inventory = None if refresh else get_cached_inventory(self.backup_target, volume_name)
+        if inventory:
+            return inventory
+
+        backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
+        blocks = {}
+        for block_files in map_block_prefixes(
+                lambda prefix: list(self.list_block_files(backup_blocks_dir, prefix, with_size=True))):
+            for file_name, size in block_files:
+                checksum = get_block_checksum(file_name)
+                if checksum:
+                    blocks[checksum] = size
+
+        backups = {}
+        for backup_name, content in self.read_backup_cfg_files(volume_name):
+            try:
+                backup_cfg = json.loads(content)
+            except ValueError:
+                logging(f"Skipped invalid backup cfg file of {volume_name}/{backup_name}")
+                continue
+            backups[backup_name] = {block["BlockChecksum"] for block in backup_cfg.get("Blocks") or []}
+
+        inventory = Inventory(blocks, backups)
+        set_cached_inventory(self.backup_target, volume_name, inventory)
+        logging(f"Indexed {len(blocks)} blocks and {len(backups)} backups of backup volume {volume_name}")
+        return inventory
+
+    def remove_block_from_inventory(self, volume_name, block_file_path):
+        inventory = get_cached_inventory(self.backup_target, volume_name)
+        if inventory:
+            inventory.remove_block(get_block_checksum(os.path.basename(block_file_path)))
+
     def get_backupstore_url(self):
         return get_longhorn_client().by_id_backupTarget(
                             self.DEFAULT_BACKUPTARGET).backupTargetURL
@@ -223,10 +303,6 @@ class Base(ABC):
     def delete_random_backup_block(self):
         return NotImplemented
 
-    @abstractmethod
-    def count_backup_block_files(self):
-        return NotImplemented
-
     def extract_dummy_backup(self, filename):
         filepath = f"./templates/backup/{filename}"
         subprocess_exec_cmd(["tar", "-xzvf", filepath])
@@ -0,0 +1,145 @@
+"""
+Exercise the backupstore helpers against the local stand-ins, without a
+cluster: backup cfg file rewrite, block deletion, block counting and the
+backup volume inventory, on LocalNfs and on LocalS3.
+
+Run from e2e/libs:
+
+    python -m backupstore.check_local [--blocks N] [--backups N] [--stores local-nfs,local-s3]
+
+The block count can be raised to profile the helpers at scale.
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from backupstore.local import LocalNfs
+from backupstore.local import LocalS3
+
+CHECK_VOLUME_NAME = "check-local-volume"
+
+
+def get_block_file_path(backupstore, checksum):
+    blocks_dir = backupstore.get_backup_blocks_dir(CHECK_VOLUME_NAME)
+    return f"{blocks_dir}/{checksum[0:2]}/{checksum[2:4]}/{checksum}.blk"
+
+
+def create_parent_dir(backupstore, file_path):
+    # the NFS helpers write into existing directories, S3 has none
+    if isinstance(backupstore, LocalNfs):
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+
+def create_block_file(backupstore, checksum):
+    file_path = get_block_file_path(backupstore, checksum)
+    create_parent_dir(backupstore, file_path)
+    backupstore.create_file_in_backupstore(file_path, {"checksum": checksum})
+
+
+def create_backup_volume(backupstore, block_count, backup_count):
+    # every backup refers to the blocks up to its own, so each backup reuses
+    # the blocks of the previous ones, and the last block is orphaned
+    checksums = [hashlib.sha256(str(i).encode()).hexdigest() for i in range(block_count)]
+    for checksum in checksums:
+        create_block_file(backupstore, checksum)
+
+    backups = {}
+    for i in range(backup_count):
+        backup_name = f"backup-{i}"
+        create_parent_dir(backupstore, backupstore.get_backup_cfg_file_path(CHECK_VOLUME_NAME, backup_name))
+        referenced = checksums[:(i + 1) * (block_count - 1) // backup_count]
+        backup_cfg = {"Name": backup_name,
+                      "VolumeName": CHECK_VOLUME_NAME,
+                      "Blocks": [{"BlockChecksum": checksum} for checksum in referenced]}
+        backupstore.write_backup_cfg_file(CHECK_VOLUME_NAME, backup_name, json.dumps(backup_cfg))
+        backups[backup_name] = set(referenced)
+    return checksums, backups
+
+
+def check_backupstore(backupstore, block_count, backup_count):
+    try:
+        backupstore.set_backupstore()
+    except AssertionError:
+        pass
+    else:
+        assert False, f"Local backupstore {backupstore.backup_target} was set as the backup target"
+
+    start = time.time()
+    checksums, backups = create_backup_volume(backupstore, block_count, backup_count)
+    print(f"Created {block_count} blocks and {backup_count} backups in {time.time() - start:.2f}s")
+
+    start = time.time()
+    count = backupstore.count_backup_block_files(CHECK_VOLUME_NAME)
+    assert count == block_count, f"Counted {count} block files, expected {block_count}"
+    print(f"Counted {count} block files in {time.time() - start:.2f}s")
+
+    start = time.time()
+    inventory = backupstore.get_backup_volume_inventory(CHECK_VOLUME_NAME, refresh=True)
+    assert set(inventory.blocks) == set(checksums), \
+        f"Indexed {len(inventory.blocks)} blocks, expected {block_count}"
+    assert inventory.backups == backups, \
+        f"Indexed backups {sorted(inventory.backups)}, expected {sorted(backups)}"
+    assert inventory.get_orphaned_blocks() == {checksums[-1]}, \
+        f"Orphaned blocks {inventory.get_orphaned_blocks()}, expected {checksums[-1]}"
+    assert not inventory.get_missing_blocks(), f"Missing blocks {inventory.get_missing_blocks()}"
+    reused = inventory.get_reused_blocks("backup-0", f"backup-{backup_count - 1}")
+    assert reused == backups["backup-0"], f"Reused blocks {reused}, expected {backups['backup-0']}"
+    print(f"Indexed the backup volume in {time.time() - start:.2f}s, "
+          f"dedup ratio {inventory.get_dedup_ratio():.2f}")
+
+    # an unreadable backup cfg file is skipped by the inventory, and gone
+    # once deleted
+    backupstore.write_backup_cfg_file(CHECK_VOLUME_NAME, "backup-0", "{corrupt: definitely")
+    inventory = backupstore.get_backup_volume_inventory(CHECK_VOLUME_NAME, refresh=True)
+    assert "backup-0" not in inventory.backups, "Corrupted backup cfg file backup-0 was indexed"
+    backupstore.delete_backup_cfg_file(CHECK_VOLUME_NAME, f"backup-{backup_count - 1}")
+    inventory = backupstore.get_backup_volume_inventory(CHECK_VOLUME_NAME, refresh=True)
+    assert f"backup-{backup_count - 1}" not in inventory.backups, \
+        f"Deleted backup cfg file backup-{backup_count - 1} was indexed"
+    print("Rewrote and deleted backup cfg files")
+
+    # the deleted block is dropped from the cached inventory as well
+    backupstore.delete_random_backup_block(CHECK_VOLUME_NAME)
+    count = backupstore.count_backup_block_files(CHECK_VOLUME_NAME)
+    assert count == block_count - 1, f"Counted {count} block files after deleting one, expected {block_count - 1}"
+    cached = backupstore.get_backup_volume_inventory(CHECK_VOLUME_NAME)
+    assert cached is inventory and len(cached.blocks) == block_count - 1, \
+        f"Cached inventory has {len(cached.blocks)} blocks after deleting one, expected {block_count - 1}"
+    print("Deleted a random block")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the backupstore helpers against the local stand-ins")
+    parser.add_argument("--blocks", type=int, default=100)
+    parser.add_argument("--backups", type=int, default=3)
+    parser.add_argument("--stores", default="local-nfs,local-s3")
+    args = parser.parse_args()
+    assert args.blocks > 1 and args.backups > 1, "Need at least 2 blocks and 2 backups"
+
+    for store in args.stores.split(","):
+        print(f"Checking {store}")
+        if store == "local-nfs":
+            # a directory of its own, removed on umount
+            backupstore = LocalNfs(os.path.join(tempfile.mkdtemp(dir="/dev/shm"), "local-nfs"))
+            try:
+                check_backupstore(backupstore, args.blocks, args.backups)
+            finally:
+                backupstore.cleanup_backup_volumes()
+            assert not os.path.exists(backupstore.mount_point), \
+                f"Local backupstore {backupstore.mount_point} was not removed"
+            os.rmdir(os.path.dirname(backupstore.mount_point))
+        elif store == "local-s3":
+            backupstore = LocalS3()
+            try:
+                check_backupstore(backupstore, args.blocks, args.backups)
+            finally:
+                backupstore.stop()
+        else:
+            assert False, f"Unknown local backupstore {store}"
+
+
+if __name__ == "__main__":
+    main()
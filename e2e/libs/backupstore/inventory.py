@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+# Block files of a backup volume are spread under blocks/<c[0:2]>/<c[2:4]>/
+# by their checksum c, so the 256 first level prefixes can be listed in
+# parallel.
+BLOCK_PREFIXES = [f"{i:02x}" for i in range(256)]
+BLOCK_FILE_SUFFIX = ".blk"
+BACKUP_CFG_FILE_PREFIX = "backup_"
+BACKUP_CFG_FILE_SUFFIX = ".cfg"
+
+LIST_PARALLELISM = 8
+
+
+def map_block_prefixes(func):
+    with ThreadPoolExecutor(max_workers=LIST_PARALLELISM) as executor:
+        return list(executor.map(func, BLOCK_PREFIXES))
+
+
+def get_block_checksum(file_name):
+    if not file_name.endswith(BLOCK_FILE_SUFFIX):
+        return None
+    return file_name[:-len(BLOCK_FILE_SUFFIX)]
+
+
+def get_backup_name(cfg_file_name):
+    if not cfg_file_name.startswith(BACKUP_CFG_FILE_PREFIX) or \
+            not cfg_file_name.endswith(BACKUP_CFG_FILE_SUFFIX):
+        return None
+    return cfg_file_name[len(BACKUP_CFG_FILE_PREFIX):-len(BACKUP_CFG_FILE_SUFFIX)]
+
+
+class Inventory:
+    """
+    Index of the blocks of a backup volume: the checksum and size of every
+    block file in the backupstore, and the checksums every backup refers to.
+    """
+
+    def __init__(self, blocks, backups):
+        self.blocks = blocks  # checksum -> size
+        self.backups = backups  # backup name -> set of checksums
+
+    def get_referenced_blocks(self):
+        referenced = set()
+        for checksums in self.backups.values():
+            referenced |= checksums
+        return referenced
+
+    def get_dedup_ratio(self):
+        # block references of all the backups over the blocks actually stored
+        references = sum(len(checksums) for checksums in self.backups.values())
+        referenced = self.get_referenced_blocks()
+        if not referenced:
+            return 0
+        return references / len(referenced)
+
+    def get_reused_blocks(self, backup_name, other_backup_name):
+        return self.backups[backup_name] & self.backups[other_backup_name]
+
+    def get_orphaned_blocks(self):
+        return set(self.blocks) - self.get_referenced_blocks()
+
+    def get_missing_blocks(self):
+        return self.get_referenced_blocks() - set(self.blocks)
+
+    def get_size(self):
+        return sum(self.blocks.values())
+
+    def remove_block(self, checksum):
+        self.blocks.pop(checksum, None)
+
+
+# inventories by backup target and volume name, kept until refreshed
+_inventories = {}
+_inventories_lock = threading.Lock()
+
+
+def get_cached_inventory(backup_target, volume_name):
+    with _inventories_lock:
+        return _inventories.get((backup_target, volume_name))
+
+
+def set_cached_inventory(backup_target, volume_name, inventory):
+    with _inventories_lock:
+        _inventories[(backup_target, volume_name)] = inventory
+
+
+def forget_cached_inventory(backup_target, volume_name):
+    with _inventories_lock:
+        _inventories.pop((backup_target, volume_name), None)
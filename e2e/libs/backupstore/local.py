@@ -0,0 +1,161 @@
+import os
+import shutil
+
+from minio import Minio
+
+from backupstore.nfs import Nfs
+from backupstore.s3 import S3
+
+from utility.utility import logging
+
+try:
+    from moto.server import ThreadedMotoServer
+except ImportError:
+    ThreadedMotoServer = None
+
+# tmpfs on Linux, so the backupstore helpers can be profiled without disk I/O
+LOCAL_BACKUPSTORE_DIR = "/dev/shm/longhorn-test-backupstore"
+LOCAL_S3_BUCKET = "backupbucket"
+LOCAL_S3_REGION = "us-east-1"
+LOCAL_S3_ACCESS_KEY = "longhorn-test-access-key"
+LOCAL_S3_SECRET_KEY = "longhorn-test-secret-key"
+LOCAL_S3_PORT = 39001
+
+# the stand-ins don't run in Robot, so they can't read ${RETRY_COUNT} and
+# ${RETRY_INTERVAL}
+LOCAL_RETRY_COUNT = 10
+LOCAL_RETRY_INTERVAL = 1
+
+
+class LocalBackupstore:
+    """
+    The stand-ins only exist on the test runner, so a Longhorn cluster can't
+    use them as its backup target. Setting, resetting or waiting for the
+    backup target is rejected instead of pointing the cluster at them.
+    """
+
+    def reject_backup_target(self, *args, **kwargs):
+        assert False, \
+            f"Local backupstore {self.backup_target} can't be the backup target of a Longhorn cluster, " \
+            f"set LONGHORN_BACKUPSTORE to an s3, nfs or cifs backupstore"
+
+    get_backupstore_url = reject_backup_target
+    get_backupstore_secret = reject_backup_target
+    get_backupstore_poll_interval = reject_backup_target
+    set_backupstore = reject_backup_target
+    set_default_backuptarget = reject_backup_target
+    set_backupstore_url = reject_backup_target
+    set_backupstore_secret = reject_backup_target
+    set_backupstore_poll_interval = reject_backup_target
+    wait_for_backupstore_available = reject_backup_target
+    reset_backupstore = reject_backup_target
+
+
+class LocalNfs(LocalBackupstore, Nfs):
+    """
+    NFS backupstore stand-in backed by a local directory instead of a mount
+    of the in-cluster NFS server. The backupstore file helpers (cfg file
+    rewrite, block deletion, inventory) work as with Nfs, the Longhorn
+    backup target settings don't apply. The directory is only removed on
+    umount if it was created here.
+    """
+
+    def __init__(self, path=None):
+        # Base.__init__ would need Robot and LONGHORN_BACKUPSTORE
+        self.retry_count, self.retry_interval = LOCAL_RETRY_COUNT, LOCAL_RETRY_INTERVAL
+        self.core_api = None
+        self.mount_point = path or os.environ.get("LOCAL_BACKUPSTORE_DIR", LOCAL_BACKUPSTORE_DIR)
+        self.created_mount_point = False
+        self.mount_nfs_backupstore()
+        self.backup_target = f"nfs://localhost:{self.mount_point}"
+        self.secret = ""
+
+    def mount_nfs_backupstore(self, mount_path=None):
+        if not os.path.isdir(self.mount_point):
+            os.makedirs(self.mount_point)
+            self.created_mount_point = True
+
+    def umount_nfs_backupstore(self, mount_path=None):
+        if not self.created_mount_point:
+            logging(f"Keeping local backupstore {self.mount_point}, it wasn't created by the test")
+            return
+        shutil.rmtree(self.mount_point, ignore_errors=True)
+        self.created_mount_point = False
+
+    def get_nfs_mount_point(self):
+        return self.mount_point
+
+    def cleanup_backup_volumes(self):
+        # only the backup volumes, the directory may not be ours
+        shutil.rmtree(os.path.join(self.mount_point, "backupstore", "volumes"), ignore_errors=True)
+        self.umount_nfs_backupstore()
+
+    def create_dummy_backup(self, filename):
+        logging(f"Creating dummy backup from file {filename}")
+        self.extract_dummy_backup(filename)
+        shutil.copytree("./backupstore", os.path.join(self.mount_point, "backupstore"), dirs_exist_ok=True)
+        shutil.rmtree("./backupstore")
+        logging(f"Created dummy backup from file {filename}")
+
+
+class LocalS3(LocalBackupstore, S3):
+    """
+    S3 backupstore stand-in served by an in-process moto server, or by any
+    S3 compatible server (e.g. a local `minio server`) at the endpoint given
+    by LOCAL_S3_ENDPOINT, instead of the in-cluster MinIO behind a port
+    forward.
+    """
+
+    def __init__(self, endpoint=None, bucket_name=LOCAL_S3_BUCKET):
+        # Base.__init__ would need Robot and LONGHORN_BACKUPSTORE
+        self.retry_count, self.retry_interval = LOCAL_RETRY_COUNT, LOCAL_RETRY_INTERVAL
+        self.core_api = None
+        self.server = None
+
+        endpoint = endpoint or os.environ.get("LOCAL_S3_ENDPOINT")
+        if not endpoint:
+            assert ThreadedMotoServer is not None, \
+                "Install moto[server] or set LOCAL_S3_ENDPOINT for the local S3 backupstore"
+            self.server = ThreadedMotoServer(ip_address="127.0.0.1", port=LOCAL_S3_PORT)
+            self.server.start()
+            endpoint = f"127.0.0.1:{LOCAL_S3_PORT}"
+        logging(f"Using local S3 backupstore at {endpoint}")
+
+        self.minio_api = Minio(endpoint,
+                               access_key=os.environ.get("LOCAL_S3_ACCESS_KEY", LOCAL_S3_ACCESS_KEY),
+                               secret_key=os.environ.get("LOCAL_S3_SECRET_KEY", LOCAL_S3_SECRET_KEY),
+                               region=LOCAL_S3_REGION,
+                               secure=False)
+        if not self.minio_api.bucket_exists(bucket_name):
+            self.minio_api.make_bucket(bucket_name, location=LOCAL_S3_REGION)
+
+        self.backup_target = f"s3://{bucket_name}@{LOCAL_S3_REGION}/backupstore"
+        # only used as the name of the client, there is no secret to read
+        self.secret = "local"
+
+    def port_forward(self):
+        return None
+
+    def call(self, func):
+        return func(self.minio_api)
+
+    def get_api_client(self, minio_secret_name):
+        return self.minio_api
+
+    def stop(self):
+        if self.server:
+            self.server.stop()
+            self.server = None
+
+    def create_dummy_backup(self, filename):
+        logging(f"Creating dummy backup from file {filename}")
+        self.extract_dummy_backup(filename)
+        bucket_name = self.get_backupstore_bucket_name()
+        backupstore_path = self.get_backupstore_path()
+        for root, _, files in os.walk("./backupstore"):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                object_name = backupstore_path + "/" + os.path.relpath(file_path, ".")
+                self.minio_api.fput_object(bucket_name, object_name, file_path)
+        shutil.rmtree("./backupstore")
+        logging(f"Created dummy backup from file {filename}")
@@ -112,21 +112,13 @@ class Nfs(Base):
 
         try:
             os.remove(backup_block_file_path)
+            self.remove_block_from_inventory(volume_name, backup_block_file_path)
             logging(f"Removed backup block file {backup_block_file_path} in backupstore")
         except Exception as ex:
             logging("error while deleting backup block file:",
                   backup_block_file_path)
             logging(ex)
 
-    def count_backup_block_files(self, volume_name):
-        backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
-        cmd = ["find", backup_blocks_dir, "-type", "f"]
-        find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-        wc_cmd = subprocess.check_output(["/usr/bin/wc", "-l"], stdin=find_cmd.stdout)
-        backup_blocks_count = int(wc_cmd.decode().strip())
-
-        return backup_blocks_count
-
     def cleanup_backup_volumes(self):
         super().cleanup_backup_volumes()
         self.umount_nfs_backupstore()
@@ -1,32 +1,127 @@
+import atexit
 import os
+from concurrent.futures import ThreadPoolExecutor
 import base64
 import json
+import socket
 import tempfile
 import subprocess
+import threading
 import time
 
+import urllib3
 from minio import Minio
 from minio.error import ResponseError
 
 from workload.workload import get_workload_pod_names
 
 from backupstore.base import Base
+from backupstore.inventory import LIST_PARALLELISM
+from backupstore.inventory import get_backup_name
 
 from urllib.parse import urlparse
 from utility.utility import logging
 from utility.utility import subprocess_exec_cmd
 import utility.constant as constant
 
+MINIO_SERVER_PORT = 9000
+PORT_FORWARD = 39000
+PORT_FORWARD_READY_TIMEOUT = 10
+
+
+class PortForward:
+    """
+    A kubectl port-forward kept running across the backupstore calls,
+    restarted when the process exited or the local port stopped accepting
+    connections.
+    """
+
+    def __init__(self, service, local_port, remote_port):
+        self.service = service
+        self.local_port = local_port
+        self.remote_port = remote_port
+        self.process = None
+        self.lock = threading.Lock()
+
+    def is_healthy(self):
+        if self.process is None or self.process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("localhost", self.local_port), timeout=1):
+                return True
+        except OSError:
+            return False
+
+    def start(self):
+        with self.lock:
+            if self.is_healthy():
+                return
+            self._stop()
+            logging(f"Port forwarding {self.service} to localhost:{self.local_port}")
+            self.process = subprocess.Popen(
+                ["/usr/local/bin/kubectl", "port-forward", self.service, f"{self.local_port}:{self.remote_port}"],
+                stdout=subprocess.DEVNULL)
+            deadline = time.time() + PORT_FORWARD_READY_TIMEOUT
+            while not self.is_healthy():
+                assert time.time() < deadline, f"Failed to port forward {self.service} to localhost:{self.local_port}"
+                time.sleep(0.1)
+
+    def restart(self):
+        with self.lock:
+            self._stop()
+        self.start()
+
+    def stop(self):
+        with self.lock:
+            self._stop()
+
+    def _stop(self):
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        self.process = None
+
+
+_port_forward = PortForward("service/minio-service", PORT_FORWARD, MINIO_SERVER_PORT)
+atexit.register(_port_forward.stop)
+
+# MinIO clients by secret name, each keeps its own pool of connections
+_api_clients = {}
+_api_clients_lock = threading.Lock()
+
+
 class S3(Base):
 
-    MINIO_SERVER_PORT = 9000
-    PORT_FORWARD = 39000
+    MINIO_SERVER_PORT = MINIO_SERVER_PORT
+    PORT_FORWARD = PORT_FORWARD
 
     def port_forward(self):
-        return subprocess.Popen(
-            ["/usr/local/bin/kubectl", "port-forward", "service/minio-service", f"{self.PORT_FORWARD}:{self.MINIO_SERVER_PORT}"])
+        _port_forward.start()
+        return _port_forward
+
+    def call(self, func):
+        # run func with the MinIO client of the backupstore secret, once more
+        # over a new port forward if the connection broke
+        for attempt in range(2):
+            self.port_forward()
+            try:
+                return func(self.get_api_client(self.secret))
+            except urllib3.exceptions.HTTPError as e:
+                if attempt > 0:
+                    raise
+                logging(f"Failed to connect to MinIO: {e}, restarting port forward")
+                _port_forward.restart()
 
     def get_api_client(self, minio_secret_name):
+        with _api_clients_lock:
+            minio_api = _api_clients.get(minio_secret_name)
+            if minio_api is None:
+                minio_api = self.new_api_client(minio_secret_name)
+                _api_clients[minio_secret_name] = minio_api
+            return minio_api
+
+    def new_api_client(self, minio_secret_name):
         secret = self.core_api.read_namespaced_secret(name=minio_secret_name,
                                                       namespace=constant.LONGHORN_NAMESPACE)
 
@@ -44,6 +139,8 @@ class S3(Base):
             base64.b64decode(base64_minio_endpoint_url).decode("utf-8")
         minio_endpoint_url = f"localhost:{self.PORT_FORWARD}"
 
+        # the client loads the CA cert when it is created, and there is one
+        # client per secret, so the cert is written once per secret
         minio_cert_file_path = os.path.join(os.getcwd(), "minio_cert.crt")
         with open(minio_cert_file_path, 'w') as minio_cert_file:
             base64_minio_cert = \
@@ -88,11 +185,6 @@ class S3(Base):
 
     def create_file_in_backupstore(self, file_path, data={}): # NOQA
 
-        process = self.port_forward()
-
-        secret_name = self.secret
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
 
         if len(data) == 0:
@@ -101,7 +193,8 @@ class S3(Base):
         with tempfile.NamedTemporaryFile('w') as fp:
             json.dump(data, fp)
             fp.flush()
-            try:
+
+            def create(minio_api):
                 with open(fp.name, mode='rb') as f:
                     temp_file_stat = os.stat(fp.name)
                     minio_api.put_object(bucket_name,
@@ -112,19 +205,17 @@ class S3(Base):
                                                      file_path)
                     assert read_back.data.decode("utf-8") == json.dumps(data), f"{read_back.data.decode('utf-8')}, {json.dumps(data)}"
                     logging(f"Created file {file_path} in backupstore")
+
+            try:
+                self.call(create)
             except ResponseError as err:
                 logging(err)
 
-        process.kill()
-
     def write_backup_cfg_file(self, volume_name, backup_name, backup_cfg_data): # NOQA
 
-        process = self.port_forward()
-
         secret_name = self.secret
         assert secret_name != '', f"Secret name is empty for writing backup config file"
 
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_backup_cfg_file_path = self.get_backup_cfg_file_path(volume_name,
                                                                    backup_name)
@@ -132,47 +223,41 @@ class S3(Base):
         with tempfile.NamedTemporaryFile(delete_on_close=False, mode='w') as fp:
             fp.write(str(backup_cfg_data))
             fp.close()
-            try:
+
+            def write(minio_api):
                 with open(fp.name, mode='rb') as f:
                     tmp_bkp_cfg_file_stat = os.stat(fp.name)
                     minio_api.put_object(bucket_name,
                                          minio_backup_cfg_file_path,
                                          f,
                                          tmp_bkp_cfg_file_stat.st_size)
+
+            try:
+                self.call(write)
                 logging(f"Overwrote file {volume_name}/{backup_name} cfg file to {backup_cfg_data}")
             except ResponseError as err:
                 logging(err)
 
-        process.kill()
-
     def delete_file_in_backupstore(self, file_path):
 
-        process = self.port_forward()
-
-        secret_name = self.secret
-
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
 
         try:
-            minio_api.remove_object(bucket_name, file_path)
+            self.call(lambda minio_api: minio_api.remove_object(bucket_name, file_path))
         except ResponseError as err:
             logging(err)
         logging(f"Deleted file {file_path} in backupstore")
 
-        process.kill()
-
     def delete_backup_cfg_file(self, volume_name, backup_name):
         secret_name = self.secret
         assert secret_name != '', f"Secret name is empty for deleting backup config file"
 
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_backup_cfg_file_path = self.get_backup_cfg_file_path(volume_name,
                                                                    backup_name)
 
         try:
-            minio_api.remove_object(bucket_name, minio_backup_cfg_file_path)
+            self.call(lambda minio_api: minio_api.remove_object(bucket_name, minio_backup_cfg_file_path))
         except ResponseError as err:
             logging(err)
 
@@ -180,56 +265,66 @@ class S3(Base):
         secret_name = self.secret
         assert secret_name != '', f"Secret name is empty for deleting volume config file"
 
-        minio_api = self.get_api_client(secret_name)
         bucket_name = self.get_backupstore_bucket_name()
         minio_volume_cfg_file_path = self.get_volume_cfg_file_path(volume_name)
 
         try:
-            minio_api.remove_object(bucket_name, minio_volume_cfg_file_path)
+            self.call(lambda minio_api: minio_api.remove_object(bucket_name, minio_volume_cfg_file_path))
         except ResponseError as err:
             logging(err)
 
     def delete_random_backup_block(self, volume_name):
 
-        process = self.port_forward()
-
         secret_name = self.secret
         assert secret_name != '', f"Secret name is empty for deleting random backup block"
 
-        minio_api = self.get_api_client(secret_name)
-
         bucket_name = self.get_backupstore_bucket_name()
         backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
 
-        block_object_files = minio_api.list_objects(bucket_name,
-                                                    prefix=backup_blocks_dir,
-                                                    recursive=True)
+        def get_first_block(minio_api):
+            block_object_files = minio_api.list_objects(bucket_name,
+                                                        prefix=backup_blocks_dir,
+                                                        recursive=True)
+            return block_object_files.__next__().object_name
 
-        object_file = block_object_files.__next__().object_name
+        object_file = self.call(get_first_block)
 
         try:
-            minio_api.remove_object(bucket_name, object_file)
+            self.call(lambda minio_api: minio_api.remove_object(bucket_name, object_file))
+            self.remove_block_from_inventory(volume_name, object_file)
             logging(f"Removed backup block file {object_file} in backupstore")
         except ResponseError as err:
             logging(err)
 
-        process.kill()
+    def list_block_files(self, blocks_dir, prefix, with_size=False):
+        # list a first level prefix of the blocks dir in one call, so a
+        # listing broken by the port forward is retried from the start
+        bucket_name = self.get_backupstore_bucket_name()
 
-    def count_backup_block_files(self, volume_name):
-        secret_name = self.secret
-        assert secret_name != '', f"Secret name is empty for counting backup block files"
+        def list_blocks(minio_api):
+            return [(os.path.basename(block_object.object_name), block_object.size)
+                    for block_object in minio_api.list_objects(bucket_name,
+                                                               prefix=f"{blocks_dir}/{prefix}/",
+                                                               recursive=True)]
 
-        minio_api = self.get_api_client(secret_name)
+        return self.call(list_blocks)
+
+    def read_backup_cfg_files(self, volume_name):
         bucket_name = self.get_backupstore_bucket_name()
-        backup_blocks_dir = self.get_backup_blocks_dir(volume_name)
+        backups_dir = self.get_backup_volume_prefix(volume_name) + "/backups/"
 
-        block_object_files = minio_api.list_objects(bucket_name,
-                                                    prefix=backup_blocks_dir,
-                                                    recursive=True)
+        def list_cfg_files(minio_api):
+            return [cfg_object.object_name for cfg_object in
+                    minio_api.list_objects(bucket_name, prefix=backups_dir)
+                    if get_backup_name(os.path.basename(cfg_object.object_name))]
 
-        block_object_files_list = list(block_object_files)
+        def read(object_name):
+            data = self.call(lambda minio_api: minio_api.get_object(bucket_name, object_name).data)
+            return get_backup_name(os.path.basename(object_name)), data.decode("utf-8")
 
-        return len(block_object_files_list)
+        object_names = self.call(list_cfg_files)
+        with ThreadPoolExecutor(max_workers=LIST_PARALLELISM) as executor:
+            return list(executor.map(read, object_names))
 
     def create_dummy_backup(self, filename):
         logging(f"Creating dummy backup from file {filename}")
@@ -17,6 +17,7 @@ from utility.constant import LONGHORN_UNINSTALL_TIMEOUT
 import utility.constant as constant
 
 from node import Node
+from node_exec.node_exec import cleanup_node_exec_pods
 
 from workload.constant import IMAGE_UBUNTU
 from workload.pod import create_pod
@@ -90,10 +91,12 @@ def set_k8s_node_zone(node_name, zone_name=""):
         res = subprocess_exec_cmd(exec_cmd)
 
 def drain_node(node_name):
+    cleanup_node_exec_pods(node_name)
     exec_cmd = ["kubectl", "drain", node_name, "--ignore-daemonsets", "--delete-emptydir-data"]
     res = subprocess_exec_cmd(exec_cmd)
 
 def force_drain_node(node_name):
+    cleanup_node_exec_pods(node_name)
     retry_count, _ = get_retry_count_and_interval()
     exec_cmd = ["kubectl", "drain", node_name, "--force", "--ignore-daemonsets", "--delete-emptydir-data"]
     res = subprocess_exec_cmd(exec_cmd, timeout=retry_count)
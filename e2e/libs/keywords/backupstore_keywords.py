@@ -1,4 +1,5 @@
 from backupstore import Nfs, S3, Cifs
+from backupstore import LocalNfs, LocalS3
 
 import os
 
@@ -9,7 +10,12 @@ class backupstore_keywords:
 
     def __init__(self):
         backupstore = get_backupstore()
-        if backupstore.startswith("s3"):
+        # local stand-ins of the backupstores for offline runs
+        if backupstore.startswith("local-s3"):
+            self.backupstore = LocalS3()
+        elif backupstore.startswith("local-nfs"):
+            self.backupstore = LocalNfs()
+        elif backupstore.startswith("s3"):
             self.backupstore = S3()
         elif backupstore.startswith("nfs"):
             self.backupstore = Nfs()
@@ -41,6 +47,23 @@ class backupstore_keywords:
     def delete_random_backup_block(self, volume_name):
         self.backupstore.delete_random_backup_block(volume_name)
 
+    def count_backup_block_files(self, volume_name):
+        return self.backupstore.count_backup_block_files(volume_name)
+
+    def index_backup_volume(self, volume_name):
+        self.backupstore.get_backup_volume_inventory(volume_name, refresh=True)
+
+    def get_backup_volume_dedup_ratio(self, volume_name):
+        return self.backupstore.get_backup_volume_inventory(volume_name).get_dedup_ratio()
+
+    def count_reused_backup_blocks(self, volume_name, backup_name, other_backup_name):
+        inventory = self.backupstore.get_backup_volume_inventory(volume_name)
+        return len(inventory.get_reused_blocks(backup_name, other_backup_name))
+
+    def count_orphaned_backup_blocks(self, volume_name):
+        inventory = self.backupstore.get_backup_volume_inventory(volume_name)
+        return len(inventory.get_orphaned_blocks())
+
     def create_file_in_backups_folder(self, volume_name, file_name):
         prefix = self.backupstore.get_backup_volume_prefix(volume_name)
         file_path = os.path.join(prefix, "backups" ,file_name)
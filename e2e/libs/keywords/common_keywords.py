@@ -2,7 +2,7 @@ import time
 import re
 
 from node import Node
-from node_exec import NodeExec
+from node_exec.node_exec import cleanup_node_exec_pods
 
 from utility.utility import convert_size_to_bytes
 from utility.utility import init_k8s_api_client
@@ -43,8 +43,7 @@ class common_keywords:
         return Node().get_node_by_index(node_id)
 
     def cleanup_node_exec(self):
-        for node_name in Node().list_node_names_by_role("all"):
-            NodeExec(node_name).cleanup()
+        cleanup_node_exec_pods()
 
     def convert_size_to_bytes(self, size, to_str=False):
         if to_str:
@@ -76,6 +76,10 @@ class host_keywords:
     def execute_command_on_node(self, cmd, node_name):
         return NodeExec(node_name).issue_cmd(cmd)
 
+    def execute_command_on_nodes(self, cmd, node_names):
+        results = NodeExec.issue_cmd_on_nodes(node_names, cmd)
+        return {node_name: res["output"] for node_name, res in results.items()}
+
     def execute_command_on_node_and_not_expect_output(self, cmd, node_name, output):
         retry_count, _ = get_retry_count_and_interval()
         res = NodeExec(node_name).issue_cmd(cmd)
@@ -83,7 +87,6 @@ class host_keywords:
             logging(f"Unexpected {output} in {cmd} result on node {node_name}: {res}")
             time.sleep(retry_count)  # Long sleep for debugging
             assert False, f"Unexpected {output} in {cmd} result on node {node_name}: {res}"
-        NodeExec(node_name).cleanup()
 
     def execute_command_on_node_and_wait_for_output(self, cmd, node_name, expected_output):
         retry_count, retry_interval = get_retry_count_and_interval()
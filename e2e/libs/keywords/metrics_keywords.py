@@ -55,7 +55,8 @@ class metrics_keywords:
     def wait_for_longhorn_metric_absent(self, metric_name, node_name=None):
         for i in range(self.retry_count):
             logging(f"Waiting for longhorn metric {metric_name} absent on node {node_name} ... ({i})")
-            if not find_longhorn_metric_samples(metric_name, node_name):
+            # always scrape again, a cached scrape would still have the metric
+            if not find_longhorn_metric_samples(metric_name, node_name, max_age=0):
                 logging(f"Longhorn metric {metric_name} is absent on node {node_name}")
                 return
             time.sleep(self.retry_interval)
@@ -1,5 +1,7 @@
 from support_bundle.support_bundle import generate_support_bundle
 from support_bundle.support_bundle import check_bundle_contains_host_logs
+from support_bundle.support_bundle import list_support_bundle_node_files
+from support_bundle.support_bundle import grep_support_bundle
 
 
 class support_bundle_keywords:
@@ -9,3 +11,9 @@ class support_bundle_keywords:
 
     def check_bundle_contains_host_logs(self, host_log_files, node_name, bundle_zip_path="./lh-support-bundle.zip"):
         check_bundle_contains_host_logs(host_log_files, node_name, bundle_zip_path)
+
+    def list_support_bundle_node_files(self, node_name, bundle_zip_path="./lh-support-bundle.zip"):
+        return list_support_bundle_node_files(node_name, bundle_zip_path)
+
+    def grep_support_bundle(self, pattern, file_pattern="*", node_name=None, bundle_zip_path="./lh-support-bundle.zip"):
+        return grep_support_bundle(pattern, bundle_zip_path, file_pattern=file_pattern, node_name=node_name)
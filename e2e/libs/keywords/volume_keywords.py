@@ -360,6 +360,14 @@ class volume_keywords:
         logging(f'Waiting for volume {volume_name} to be healthy')
         self.volume.wait_for_volume_healthy(volume_name)
 
+    def wait_for_volumes_healthy(self, volume_names):
+        logging(f'Waiting for volumes {volume_names} to be healthy')
+        return self.volume.wait_for_volumes_healthy(volume_names)
+
+    def wait_for_volumes_detached(self, volume_names):
+        logging(f'Waiting for volumes {volume_names} to be detached')
+        return self.volume.wait_for_volumes_detached(volume_names)
+
     def wait_for_volume_attaching(self, volume_name):
         logging(f'Waiting for volume {volume_name} to be in attaching')
         self.volume.wait_for_volume_attaching(volume_name)
@@ -233,6 +233,12 @@ class workload_keywords:
         logging(f'Waiting for workload {workload_name} volume {volume_name} to be healthy')
         self.volume.wait_for_volume_healthy(volume_name)
 
+    def wait_for_workloads_volume_healthy(self, workload_names):
+        volume_names = [get_workload_volume_name(workload_name) for workload_name in workload_names]
+
+        logging(f'Waiting for workloads {workload_names} volumes {volume_names} to be healthy')
+        return self.volume.wait_for_volumes_healthy(volume_names)
+
     def wait_for_workload_volume_attached(self, workload_name):
         volume_name = get_workload_volume_name(workload_name)
 
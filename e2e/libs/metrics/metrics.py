@@ -1,9 +1,11 @@
 import json
 import time
+import threading
 import ipaddress
 import requests
 import re
 
+from concurrent.futures import ThreadPoolExecutor
 from kubernetes import client
 from kubernetes.client.rest import ApiException
 from prometheus_client.parser import text_string_to_metric_families
@@ -34,13 +36,54 @@ def get_node_metrics(node_name, metrics_name):
     assert False, f"Failed to get node {node_name} metrics {metrics_name}"
 
 
-def get_longhorn_metrics(node_name):
-    core_api = client.CoreV1Api()
-    pods = core_api.list_namespaced_pod(namespace=constant.LONGHORN_NAMESPACE, label_selector="app=longhorn-manager")
-    for pod in pods.items:
-        if pod.spec.node_name == node_name:
-            manager_ip = pod.status.pod_ip
-            break
+LONGHORN_MANAGER_METRICS_PORT = 9500
+METRICS_SCRAPE_TIMEOUT = 10
+METRICS_SCRAPE_MAX_WORKERS = 8
+# repeated checks within this many seconds share one scrape
+METRICS_CACHE_TTL = 3
+
+
+class MetricsSnapshot:
+    """
+    The samples scraped from a longhorn-manager at once, indexed by metric
+    name and label set, so many lookups share one scrape and one parse.
+    """
+
+    def __init__(self, families):
+        self.scraped_at = time.time()
+        self.samples = {}  # name -> {label set -> sample}
+        for family in families:
+            for sample in family.samples:
+                labels = frozenset(sample.labels.items())
+                self.samples.setdefault(sample.name, {})[labels] = sample
+
+    def get_samples(self, metric_name, labels=None):
+        samples = self.samples.get(metric_name, {})
+        if not labels:
+            return list(samples.values())
+        label_set = frozenset(labels.items())
+        sample = samples.get(label_set)
+        if sample is not None:
+            return [sample]
+        # labels is only a part of the label set
+        return [sample for key, sample in samples.items() if label_set <= key]
+
+
+_manager_ips = {}  # node name -> longhorn-manager pod IP
+_snapshots = {}  # node name -> MetricsSnapshot
+_metrics_lock = threading.Lock()
+
+
+def get_longhorn_manager_ip(node_name, refresh=False):
+    with _metrics_lock:
+        if refresh or node_name not in _manager_ips:
+            core_api = client.CoreV1Api()
+            pods = core_api.list_namespaced_pod(namespace=constant.LONGHORN_NAMESPACE, label_selector="app=longhorn-manager")
+            _manager_ips.clear()
+            for pod in pods.items:
+                if pod.status.pod_ip:
+                    _manager_ips[pod.spec.node_name] = pod.status.pod_ip
+        manager_ip = _manager_ips.get(node_name)
 
     assert manager_ip, f"No Longhorn manager pod found on node {node_name}"
 
@@ -48,53 +91,87 @@ def get_longhorn_metrics(node_name):
     ip_obj = ipaddress.ip_address(manager_ip)
     if ip_obj.version == 6:
         manager_ip = f"[{manager_ip}]"
+    return manager_ip
+
+
+def get_longhorn_metrics(node_name):
+    # Return the metric families, and the error of the first scrape if it
+    # had to be retried. Scrapes run in worker threads, whose logs Robot
+    # drops, so the caller logs it.
+    retried_error = None
+    # the manager pod may have been recreated with another IP since cached
+    for refresh in [False, True]:
+        manager_ip = get_longhorn_manager_ip(node_name, refresh=refresh)
+        try:
+            resp = requests.get(f"http://{manager_ip}:{LONGHORN_MANAGER_METRICS_PORT}/metrics",
+                                timeout=METRICS_SCRAPE_TIMEOUT)
+            break
+        except requests.exceptions.ConnectionError as e:
+            if refresh:
+                raise
+            retried_error = e
 
-    metrics = requests.get(f"http://{manager_ip}:9500/metrics").content
-    string_data = metrics.decode('utf-8')
+    string_data = resp.content.decode('utf-8')
     result = list(text_string_to_metric_families(string_data))
-    return result
+    return result, retried_error
 
 
-def find_longhorn_metric_samples(metric_name, node_name=None):
+def get_longhorn_metrics_snapshots(node_names, max_age=METRICS_CACHE_TTL):
+    # scrape the managers of the nodes without a fresh enough snapshot
+    # concurrently
+    now = time.time()
+    with _metrics_lock:
+        snapshots = {node_name: _snapshots.get(node_name) for node_name in node_names}
+    stale_node_names = [node_name for node_name, snapshot in snapshots.items()
+                        if snapshot is None or now - snapshot.scraped_at > max_age]
+
+    if stale_node_names:
+        with ThreadPoolExecutor(max_workers=METRICS_SCRAPE_MAX_WORKERS) as executor:
+            scraped = list(executor.map(get_longhorn_metrics, stale_node_names))
+        for node_name, (families, retried_error) in zip(stale_node_names, scraped):
+            if retried_error is not None:
+                logging(f"Failed to scrape longhorn metrics on node {node_name}: {retried_error}, refreshed manager IP")
+            snapshots[node_name] = MetricsSnapshot(families)
+        with _metrics_lock:
+            for node_name in stale_node_names:
+                _snapshots[node_name] = snapshots[node_name]
+
+    return snapshots
+
+
+def find_longhorn_metric_samples(metric_name, node_name=None, labels=None, max_age=METRICS_CACHE_TTL):
     samples = []
     if not node_name:
         node_names = Node().list_node_names_by_role("worker")
+        snapshots = get_longhorn_metrics_snapshots(node_names, max_age=max_age)
         for node_name in node_names:
-            metrics_data = get_longhorn_metrics(node_name)
-            for family in metrics_data:
-                for sample in family.samples:
-                    if sample.name == metric_name:
-                        samples.append(sample)
-                        logging(f"Got metric sample {metric_name}={sample} on node {node_name}")
+            for sample in snapshots[node_name].get_samples(metric_name, labels):
+                samples.append(sample)
+                logging(f"Got metric sample {metric_name}={sample} on node {node_name}")
         logging(f"Got metric samples {metric_name}={samples} on all worker nodes")
     else:
-        metrics_data = get_longhorn_metrics(node_name)
-        for family in metrics_data:
-            for sample in family.samples:
-                if sample.name == metric_name:
-                    samples.append(sample)
+        snapshots = get_longhorn_metrics_snapshots([node_name], max_age=max_age)
+        samples = snapshots[node_name].get_samples(metric_name, labels)
         logging(f"Got metric samples {metric_name}={samples} on node {node_name}")
     return samples
 
 
 def check_longhorn_metric(metric_name, node_name=None, metric_label=None, expected_value=None):
     logging(f"Checking longhorn metric {locals()}")
-    samples = find_longhorn_metric_samples(metric_name, node_name)
-    expected_value = float(convert_size_to_bytes(expected_value))
-    retry_count, retry_interval = get_retry_count_and_interval()
-
     label_filter = None
     if metric_label is not None:
         label_filter = json.loads(metric_label)
 
+    # consecutive checks share one scrape, see METRICS_CACHE_TTL
+    samples = find_longhorn_metric_samples(metric_name, node_name, labels=label_filter)
+    expected_value = float(convert_size_to_bytes(expected_value))
+    retry_count, retry_interval = get_retry_count_and_interval()
+
     if not len(samples):
         logging(f"Failed to get longhorn metric {locals()}")
         time.sleep(retry_count)
         assert False, f"Failed to get longhorn metric {locals()}"
     for sample in samples:
-        if label_filter:
-            if not all(sample.labels.get(k) == v for k, v in label_filter.items()):
-                continue
         if expected_value and sample.value != expected_value:
             logging(f"Expected metric {metric_name}:{metric_label} has value {expected_value}, but it's {sample.value}: {samples}")
             time.sleep(retry_count)
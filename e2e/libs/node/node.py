@@ -397,18 +397,25 @@ class Node:
 
     def cleanup_node_labels(self):
         nodes = self.list_node_names_by_role("worker")
-        for node_name in nodes:
-            logging(f"Cleaning up node {node_name} labels")
-            # we can't blindly clean up all labels since there are some k8s default labels
-            exec_cmd = ["kubectl", "label", "node", node_name, "node.longhorn.io/disable-v2-data-engine-"]
-            res = subprocess_exec_cmd(exec_cmd)
+        if not nodes:
+            return
+        logging(f"Cleaning up nodes {nodes} labels")
+        # we can't blindly clean up all labels since there are some k8s default labels
+        # one call for all the nodes, a node without the label is left as is
+        exec_cmd = ["kubectl", "label", "node", *nodes, "node.longhorn.io/disable-v2-data-engine-"]
+        res = subprocess_exec_cmd(exec_cmd)
 
     def cleanup_node_taints(self):
         nodes = self.list_node_names_by_role("worker")
         for node_name in nodes:
             logging(f"Cleaning up node {node_name} taints")
+            # kubectl taint stops at the first node without the taint, one
+            # call per node
             exec_cmd = f"kubectl taint nodes {node_name} node-role.kubernetes.io/worker=true:NoExecute- || true"
             subprocess_exec_cmd(exec_cmd)
+        # the nodes become schedulable concurrently, wait for them once all
+        # the taints are removed
+        for node_name in nodes:
             self.check_node_schedulable(node_name, "True")
 
     def check_node_schedulable(self, node_name, schedulable):
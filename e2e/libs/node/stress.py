@@ -17,6 +17,7 @@ from workload.pod import create_pod
 from workload.pod import delete_pod
 from workload.pod import get_pod
 from workload.pod import new_pod_manifest
+from workload.pod import wait_for_pod_status
 from workload.workload import get_workload_pods
 
 
@@ -31,71 +32,30 @@ class Stress:
             delete_pod(pod.metadata.name, pod.metadata.namespace)
 
     def cpu(self, node_names):
-        for node_name in node_names:
-            pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
-
-            # If the helper pod creation is called inside of a test case loop,
-            # we need to check if the pod already running.
-            try:
-                pod = get_pod(pod_name)
-                if pod and pod.status.phase != "Running":
-                    logging(f"Deleting stress pod {pod_name} in phase {pod.status.phase}")
-                    delete_pod(pod_name)
-                elif pod:
-                    logging(f"Stress pod {pod_name} already running")
-                    continue
-            except ApiException as e:
-                assert e.status == 404
-
-            manifest = new_pod_manifest(
-                pod_name=pod_name,
-                image=IMAGE_LITMUX,
-                command=["stress-ng"],
-                args=['--cpu', str(self.node.get_node_cpu_cores(node_name)),
-                      '--cpu-load', str(NODE_STRESS_CPU_LOAD_PERCENTAGE),
-                      '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)],
-                node_name=node_name,
-                labels={'app': STRESS_HELPER_LABEL}
-            )
-
-            pod_name = manifest['metadata']['name']
-            logging(f"Creating cpu stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+        self._create_stress_pods(node_names, "cpu", lambda node_name: [
+            '--cpu', str(self.node.get_node_cpu_cores(node_name)),
+            '--cpu-load', str(NODE_STRESS_CPU_LOAD_PERCENTAGE),
+            '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)])
 
     def memory(self, node_names):
-        for node_name in node_names:
-            pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
-
-            # If the helper pod creation is called inside of a test case loop,
-            # we need to check if the pod already running.
-            try:
-                pod = get_pod(pod_name)
-                if pod and pod.status.phase != "Running":
-                    logging(f"Deleting stress pod {pod_name} in phase {pod.status.phase}")
-                    delete_pod(pod_name)
-                elif pod:
-                    logging(f"Stress pod {pod_name} already running")
-                    continue
-            except ApiException as e:
-                assert e.status == 404
-
-            manifest = new_pod_manifest(
-                pod_name=pod_name,
-                image=IMAGE_LITMUX,
-                command=["stress-ng"],
-                args=['--vm', str(NODE_STRESS_MEM_VM_WORKERS),
-					  '--vm-bytes', f"{NODE_STRESS_MEM_LOAD_PERCENTAGE}%",
-					  '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)],
-                node_name=node_name,
-                labels={'app': STRESS_HELPER_LABEL}
-            )
-
-            pod_name = manifest['metadata']['name']
-            logging(f"Creating memory stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+        self._create_stress_pods(node_names, "memory", lambda node_name: [
+            '--vm', str(NODE_STRESS_MEM_VM_WORKERS),
+            '--vm-bytes', f"{NODE_STRESS_MEM_LOAD_PERCENTAGE}%",
+            '--timeout', str(NODE_STRESS_TIMEOUT_SECOND)])
 
     def filesystem(self, node_names):
-        for node_name in node_names:
+        self._create_stress_pods(node_names, "filesystem", lambda node_name: [
+            '--hdd', str(NODE_STRESS_FILESYSTEM_HDD_WORKERS),
+            '--hdd-bytes', f"{NODE_STRESS_FILESYSTEM_LOAD_PERCENTAGE}%"])
+
+    def _create_stress_pods(self, node_names, kind, get_args):
+        # Create the stress pods of all the nodes before waiting for any of
+        # them, so the nodes are stressed at once and the wait takes as long
+        # as the slowest node instead of the sum over the nodes.
+        pod_names = []
+        # a pod just created on a node listed twice isn't running yet, it
+        # would be deleted as a failed one
+        for node_name in dict.fromkeys(node_names):
             pod_name = f"{STRESS_HELPER_POD_NAME_PREFIX}{node_name}"
 
             # If the helper pod creation is called inside of a test case loop,
@@ -115,12 +75,15 @@ class Stress:
                 pod_name=pod_name,
                 image=IMAGE_LITMUX,
                 command=["stress-ng"],
-                args=['--hdd', str(NODE_STRESS_FILESYSTEM_HDD_WORKERS),
-					  '--hdd-bytes', f"{NODE_STRESS_FILESYSTEM_LOAD_PERCENTAGE}%"],
+                args=get_args(node_name),
                 node_name=node_name,
                 labels={'app': STRESS_HELPER_LABEL}
             )
 
             pod_name = manifest['metadata']['name']
-            logging(f"Creating filesystem stress pod {pod_name} on {node_name}")
-            create_pod(manifest, is_wait_for_pod_running=True)
+            logging(f"Creating {kind} stress pod {pod_name} on {node_name}")
+            create_pod(manifest)
+            pod_names.append(pod_name)
+
+        for pod_name in pod_names:
+            wait_for_pod_status(pod_name, 'Running')
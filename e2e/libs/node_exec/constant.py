@@ -5,3 +5,8 @@ HOST_ROOTFS = "/rootfs"
 
 DEFAULT_IMAGE = "ubuntu:22.04"
 FIO_IMAGE = "openeuler/fio:3.41-oe2403sp2"
+
+# node exec pods are kept and reused across commands, see NodeExec.get_pod()
+NODE_EXEC_LABEL = "longhorn-test-node-exec"
+NODE_EXEC_HEALTH_CHECK_INTERVAL = 10
+NODE_EXEC_MAX_WORKERS = 16
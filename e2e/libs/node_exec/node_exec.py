@@ -1,5 +1,8 @@
+import atexit
 import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from kubernetes import client
 from kubernetes.stream import stream
@@ -8,12 +11,41 @@ from node_exec.constant import DEFAULT_POD_INTERVAL
 from node_exec.constant import DEFAULT_POD_TIMEOUT
 from node_exec.constant import HOST_ROOTFS
 from node_exec.constant import FIO_IMAGE, DEFAULT_IMAGE
+from node_exec.constant import NODE_EXEC_LABEL
+from node_exec.constant import NODE_EXEC_HEALTH_CHECK_INTERVAL
+from node_exec.constant import NODE_EXEC_MAX_WORKERS
 
+from utility.constant import STREAM_EXEC_TIMEOUT
 from utility.utility import logging
 from utility.utility import delete_pod, get_pod
 from utility.utility import get_retry_count_and_interval
 
 
+# (node name, image) -> (pod, time of the last successful health check)
+# Node exec pods are launched lazily and reused by every NodeExec instance
+# until cleanup() or the end of the test run.
+_pods = {}
+# (node name, image) -> lock held while checking and launching its pod, so
+# concurrent callers don't launch two pods under the same name
+_launch_locks = {}
+_pods_lock = threading.Lock()
+
+
+def _get_cached_pod(key):
+    # the pooled pod of key, or None if it has to be checked again
+    with _pods_lock:
+        pod, checked_at = _pods.get(key, (None, 0))
+    if pod is not None and \
+            time.time() - checked_at < NODE_EXEC_HEALTH_CHECK_INTERVAL:
+        return pod
+    return None
+
+
+def _get_launch_lock(key):
+    with _pods_lock:
+        return _launch_locks.setdefault(key, threading.Lock())
+
+
 class NodeExec:
 
     def __init__(self, node_name):
@@ -21,36 +53,99 @@ class NodeExec:
         self.core_api = client.CoreV1Api()
         self.retry_count, self.retry_interval = get_retry_count_and_interval()
 
+    def get_pod_name(self, image_name):
+        if image_name == FIO_IMAGE:
+            return f"{self.node_name}-fio"
+        return self.node_name
+
     def cleanup(self):
-        if get_pod(self.node_name):
-            logging(f"Cleaning up pod {self.node_name}")
-            delete_pod(self.node_name)
+        for image_name in [DEFAULT_IMAGE, FIO_IMAGE]:
+            pod_name = self.get_pod_name(image_name)
+            with _pods_lock:
+                _pods.pop((self.node_name, image_name), None)
+            if get_pod(pod_name):
+                logging(f"Cleaning up pod {pod_name}")
+                delete_pod(pod_name)
+
+    def is_pod_healthy(self, pod, image_name):
+        if pod is None or pod.metadata.deletion_timestamp is not None:
+            return False
+        # not launched by the pool, e.g. left over by an older test run
+        if NODE_EXEC_LABEL not in (pod.metadata.labels or {}):
+            return False
+        if pod.status.phase != 'Running':
+            return False
+        if pod.spec.containers[0].image != image_name:
+            return False
+        for status in pod.status.container_statuses or []:
+            if not status.ready:
+                return False
+        return True
+
+    def get_pod(self, image_name=DEFAULT_IMAGE):
+        key = (self.node_name, image_name)
+        pod_name = self.get_pod_name(image_name)
+        pod = _get_cached_pod(key)
+        if pod is not None:
+            return pod
+
+        with _get_launch_lock(key):
+            # checked or launched by another caller in the meantime
+            pod = _get_cached_pod(key)
+            if pod is not None:
+                return pod
+
+            # the pod can be gone or broken after a node reboot or a network
+            # disconnection, or be left over by a previous run
+            pod = get_pod(pod_name)
+            if not self.is_pod_healthy(pod, image_name):
+                if pod is not None:
+                    logging(f"Replacing unhealthy pod {pod_name}")
+                    delete_pod(pod_name)
+                pod = self.launch_pod(image_name)
+
+            with _pods_lock:
+                _pods[key] = (pod, time.time())
+        return pod
+
+    def invalidate_pod(self, image_name):
+        with _pods_lock:
+            _pods.pop((self.node_name, image_name), None)
 
     def issue_cmd(self, cmd):
+        return self._exec(cmd)
 
-        self.cleanup()
+    def run_cmd(self, cmd):
+        """
+        Issue the command like issue_cmd, but keep stdout and stderr apart
+        and return the exit code instead of ignoring it.
+        Return a dict with output, error and returncode.
+        """
+        return self._exec(cmd, separate_stderr=True)
 
-        if self._needs_fio(cmd):
-            self.pod = self.launch_pod(FIO_IMAGE)
-        else:
-            self.pod = self.launch_pod()
+    def _get_exec_command(self, cmd):
+        if isinstance(cmd, list):
+            return cmd
+        ns_mnt = os.path.join(HOST_ROOTFS, "proc/1/ns/mnt")
+        ns_net = os.path.join(HOST_ROOTFS, "proc/1/ns/net")
+        return [
+            'nsenter',
+            f'--mount={ns_mnt}',
+            f'--net={ns_net}',
+            '--', 'sh', '-c', cmd
+        ]
+
+    def _exec(self, cmd, separate_stderr=False):
+
+        image_name = FIO_IMAGE if self._needs_fio(cmd) else DEFAULT_IMAGE
 
         logging(f"Issuing command on {self.node_name}: {cmd}")
 
-        if isinstance(cmd, list):
-            exec_command = cmd
-        else:
-            ns_mnt = os.path.join(HOST_ROOTFS, "proc/1/ns/mnt")
-            ns_net = os.path.join(HOST_ROOTFS, "proc/1/ns/net")
-            exec_command = [
-                'nsenter',
-                f'--mount={ns_mnt}',
-                f'--net={ns_net}',
-                '--', 'sh', '-c', cmd
-            ]
+        exec_command = self._get_exec_command(cmd)
         for i in range(self.retry_count):
             try:
-                res = stream(
+                self.pod = self.get_pod(image_name)
+                resp = stream(
                     self.core_api.connect_get_namespaced_pod_exec,
                     self.pod.metadata.name,
                     'default',
@@ -58,26 +153,89 @@ class NodeExec:
                     stderr=True,
                     stdin=False,
                     stdout=True,
-                    tty=False
+                    tty=False,
+                    _preload_content=not separate_stderr
                 )
+                if separate_stderr:
+                    resp.run_forever(timeout=STREAM_EXEC_TIMEOUT)
+                    res = {
+                        "output": resp.read_stdout(),
+                        "error": resp.read_stderr(),
+                        "returncode": resp.returncode
+                    }
+                    resp.close()
+                else:
+                    res = resp
                 logging(f"Issued command: {cmd} on {self.node_name} with result:\n{res}")
                 return res
             except Exception as e:
                 logging(f"Failed to issue command: {cmd} on {self.node_name} with error: {e}")
+                # health check the pod again before the next attempt
+                self.invalidate_pod(image_name)
                 time.sleep(self.retry_interval)
         assert False, f"Failed to issue command: {cmd} on {self.node_name}"
 
+    @staticmethod
+    def issue_cmd_on_nodes(node_names, cmd, check=True):
+        """
+        Run a command on many nodes at once and wait for all of them.
+        :param cmd: The command to run on every node, or a dict of node name
+                    to the command to run on that node.
+        :param check: Assert every command succeeded with exit code 0.
+        Return a dict of node name to a dict with output, error, returncode,
+        the exception if the command could not be issued at all, and latency
+        in seconds.
+        """
+        if isinstance(cmd, dict):
+            cmds = {node_name: cmd[node_name] for node_name in node_names}
+        else:
+            cmds = {node_name: cmd for node_name in node_names}
+        if not cmds:
+            return {}
+
+        # NodeExec reads the robot variables, create them from this thread
+        node_execs = {node_name: NodeExec(node_name) for node_name in cmds}
+
+        def run(node_name):
+            start = time.time()
+            try:
+                res = node_execs[node_name].run_cmd(cmds[node_name])
+                res["exception"] = None
+            except Exception as e:
+                res = {"output": "", "error": "", "returncode": None,
+                       "exception": str(e)}
+            res["latency"] = time.time() - start
+            return res
+
+        workers = min(len(cmds), NODE_EXEC_MAX_WORKERS)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(cmds, executor.map(run, cmds)))
+
+        for node_name, res in results.items():
+            logging(f"Command on {node_name} exited with {res['returncode']} in {res['latency']:.1f}s")
+
+        if check:
+            failed = {node_name: res for node_name, res in results.items()
+                      if res["returncode"] != 0}
+            assert not failed, f"Failed to issue command on nodes {list(failed)}: {failed}"
+        return results
+
     def _needs_fio(self, cmd):
         if isinstance(cmd, list):
             return any('fio' in str(part) for part in cmd)
         return 'fio' in str(cmd)
 
     def launch_pod(self, image_name=None):
+        image_name = image_name if image_name else DEFAULT_IMAGE
+        pod_name = self.get_pod_name(image_name)
         pod_manifest = {
             'apiVersion': 'v1',
             'kind': 'Pod',
             'metadata': {
-                'name': self.node_name
+                'name': pod_name,
+                'labels': {
+                    NODE_EXEC_LABEL: self.node_name
+                }
             },
             'spec': {
                 'affinity': {
@@ -125,7 +283,7 @@ class NodeExec:
                     "effect": "NoSchedule"
                 }],
                 'containers': [{
-                    'image': image_name if image_name else DEFAULT_IMAGE,
+                    'image': image_name,
                     'imagePullPolicy': 'IfNotPresent',
                     'securityContext': {
                         'privileged': True
@@ -168,10 +326,45 @@ class NodeExec:
         )
         for i in range(DEFAULT_POD_TIMEOUT):
             pod = self.core_api.read_namespaced_pod(
-                    name=self.node_name,
+                    name=pod_name,
                     namespace='default'
                   )
             if pod is not None and pod.status.phase == 'Running':
                 break
             time.sleep(DEFAULT_POD_INTERVAL)
         return pod
+
+
+def cleanup_node_exec_pods(node_name=None):
+    """
+    Delete the pooled node exec pods, only those on node_name if given.
+    They have no controller, so they block kubectl drain without --force.
+    """
+    with _pods_lock:
+        for key in list(_pods):
+            if node_name is None or key[0] == node_name:
+                _pods.pop(key)
+    field_selector = f"spec.nodeName={node_name}" if node_name else ""
+    pods = client.CoreV1Api().list_namespaced_pod(
+        namespace='default', label_selector=NODE_EXEC_LABEL,
+        field_selector=field_selector)
+    for pod in pods.items:
+        logging(f"Cleaning up pod {pod.metadata.name}")
+        delete_pod(pod.metadata.name)
+
+
+def _cleanup_node_exec_pods_at_exit():
+    # robot is not running anymore, so don't wait for the deletion with
+    # the ${RETRY_COUNT} based helpers
+    if not _pods:
+        return
+    try:
+        client.CoreV1Api().delete_collection_namespaced_pod(
+            namespace='default', label_selector=NODE_EXEC_LABEL,
+            grace_period_seconds=0)
+    except Exception as e:
+        print(f"Failed to clean up node exec pods: {e}")
+
+
+# tear the pool down once at the end of the test run
+atexit.register(_cleanup_node_exec_pods_at_exit)
@@ -0,0 +1,117 @@
+import fnmatch
+import io
+import os
+import re
+import threading
+import zipfile
+
+BUNDLE_ROOT_PREFIX = "supportbundle_"
+NODES_DIR = "nodes"
+NODE_ZIP_SUFFIX = ".zip"
+
+
+class SupportBundleReader:
+    """
+    Read a support bundle zip in place. Files are read as streams from the
+    bundle, and the per node zips nested in it are opened as zips on top of
+    those streams, so nothing is extracted to disk.
+
+    Deflated members can only seek by decompressing from their start, so
+    the name list of each node zip is kept once read.
+    """
+
+    def __init__(self, bundle_zip_path):
+        self.path = bundle_zip_path
+        self.zip = zipfile.ZipFile(bundle_zip_path, "r")
+        self.lock = threading.Lock()
+        self.node_files = {}  # node name -> name list of its zip
+
+        self.root = None
+        self.node_zips = {}  # node name -> member name of its zip
+        for name in self.zip.namelist():
+            parts = name.split("/")
+            if self.root is None and parts[0].startswith(BUNDLE_ROOT_PREFIX):
+                self.root = parts[0]
+            if len(parts) == 3 and parts[1] == NODES_DIR and parts[2].endswith(NODE_ZIP_SUFFIX):
+                self.node_zips[parts[2][:-len(NODE_ZIP_SUFFIX)]] = name
+        assert self.root is not None, f"No {BUNDLE_ROOT_PREFIX}* folder found in support bundle {bundle_zip_path}"
+
+    def close(self):
+        self.zip.close()
+
+    def list_files(self, pattern="*"):
+        """
+        List the files of the bundle, relative to its root folder.
+        """
+        prefix = self.root + "/"
+        return [name[len(prefix):] for name in self.zip.namelist()
+                if not name.endswith("/") and fnmatch.fnmatch(name[len(prefix):], pattern)]
+
+    def list_nodes(self):
+        return sorted(self.node_zips)
+
+    def open_node_zip(self, node_name):
+        assert node_name in self.node_zips, f"Node zip {node_name}{NODE_ZIP_SUFFIX} not found in bundle"
+        # ZipExtFile is seekable as the bundle file is, good enough for
+        # ZipFile to read the central directory at the end of the node zip
+        return zipfile.ZipFile(self.zip.open(self.node_zips[node_name]), "r")
+
+    def list_node_files(self, node_name):
+        with self.lock:
+            files = self.node_files.get(node_name)
+        if files is None:
+            with self.open_node_zip(node_name) as node_zip:
+                files = [name for name in node_zip.namelist() if not name.endswith("/")]
+            with self.lock:
+                self.node_files[node_name] = files
+        return list(files)
+
+    def grep(self, pattern, file_pattern="*", node_name=None):
+        """
+        Yield (path, line number, line) of the lines matching the regular
+        expression pattern, in the bundle files matching file_pattern, or in
+        the files of the node zip if node_name is given. Files are read line
+        by line. The node zips are only read as text when file_pattern is
+        their exact path, grep their files with node_name instead.
+        """
+        regex = re.compile(pattern)
+        if node_name is None:
+            node_zips = {name[len(self.root) + 1:] for name in self.node_zips.values()}
+            for path in self.list_files(file_pattern):
+                if path in node_zips and path != file_pattern:
+                    continue
+                with self.zip.open(f"{self.root}/{path}") as f:
+                    yield from self._grep_stream(regex, path, f)
+            return
+
+        with self.open_node_zip(node_name) as node_zip:
+            for path in node_zip.namelist():
+                if path.endswith("/") or not fnmatch.fnmatch(path, file_pattern):
+                    continue
+                with node_zip.open(path) as f:
+                    yield from self._grep_stream(regex, path, f)
+
+    @staticmethod
+    def _grep_stream(regex, path, f):
+        for i, line in enumerate(io.TextIOWrapper(f, encoding="utf-8", errors="replace"), 1):
+            if regex.search(line):
+                yield path, i, line.rstrip("\n")
+
+
+# readers by bundle path, dropped when the file is replaced
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def get_support_bundle_reader(bundle_zip_path):
+    stat = os.stat(bundle_zip_path)
+    key = os.path.abspath(bundle_zip_path)
+    with _readers_lock:
+        cached = _readers.get(key)
+        if cached is not None and cached[0] == (stat.st_mtime, stat.st_size):
+            return cached[1]
+        if cached is not None:
+            cached[1].close()
+        reader = SupportBundleReader(bundle_zip_path)
+        _readers[key] = ((stat.st_mtime, stat.st_size), reader)
+        return reader
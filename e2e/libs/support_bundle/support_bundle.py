@@ -1,11 +1,16 @@
 import time
 import requests
-import os, zipfile, tempfile, shutil
+import os
+
+from support_bundle.reader import get_support_bundle_reader
 
 from utility.utility import logging
 from utility.utility import get_retry_count_and_interval
 from utility.utility import get_longhorn_client
 
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 60
+
 def get_support_bundle_url():
     return get_longhorn_client()._url.replace('schemas', 'supportbundles')
 
@@ -40,61 +45,87 @@ def generate_support_bundle(download=False):
     if download is True:
         download_support_bundle(node_id, name)
 
+def get_download_size(response, offset):
+    # Content-Range: bytes <start>-<end>/<total>
+    content_range = response.headers.get("Content-Range", "")
+    if "/" in content_range and not content_range.endswith("/*"):
+        return int(content_range.rsplit("/", 1)[1])
+    content_length = response.headers.get("Content-Length")
+    if content_length is None:
+        return None
+    return offset + int(content_length)
+
 def download_support_bundle(node_id, name, output_file="lh-support-bundle.zip"):
     url = get_support_bundle_url()
     download_url = f"{url}/{node_id}/{name}/download"
+    part_file = output_file + ".part"
 
     logging(f"Downloading support bundle from {download_url} to {output_file} ...")
 
-    with requests.get(download_url, stream=True) as r:
-        r.raise_for_status()
-        with open(output_file, "wb") as f:
-            for chunk in r.iter_content(chunk_size=8192):
-                if chunk:
-                    f.write(chunk)
+    # a part file left by an earlier download may be another bundle
+    if os.path.exists(part_file):
+        os.remove(part_file)
+
+    # resume from what a dropped connection left in the part file
+    retry_count, retry_interval = get_retry_count_and_interval()
+    for i in range(retry_count):
+        offset = os.path.getsize(part_file) if os.path.exists(part_file) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        try:
+            with requests.get(download_url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+                if r.status_code == 416:
+                    # the part file is complete already
+                    break
+                r.raise_for_status()
+                # without range support the server sends the whole bundle
+                mode = "ab" if r.status_code == 206 else "wb"
+                total = get_download_size(r, offset if r.status_code == 206 else 0)
+                with open(part_file, mode) as f:
+                    for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        if chunk:
+                            f.write(chunk)
+            # a dropped connection can end the body early without an error
+            size = os.path.getsize(part_file)
+            if total is None or size >= total:
+                break
+            logging(f"Downloading support bundle interrupted at {size}/{total} bytes ... ({i})")
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            logging(f"Downloading support bundle interrupted at {offset} bytes: {e} ... ({i})")
+            time.sleep(retry_interval)
+    else:
+        assert False, f"Failed to download support bundle from {download_url}"
 
+    os.replace(part_file, output_file)
     logging(f"Support bundle downloaded to {output_file}")
 
+def list_support_bundle_node_files(node_name, bundle_zip_path):
+    return get_support_bundle_reader(bundle_zip_path).list_node_files(node_name)
+
+def grep_support_bundle(pattern, bundle_zip_path, file_pattern="*", node_name=None):
+    """
+    Return the (path, line number, line) of the lines matching pattern in
+    the support bundle, or in the zip of node_name inside it.
+    """
+    reader = get_support_bundle_reader(bundle_zip_path)
+    return list(reader.grep(pattern, file_pattern=file_pattern, node_name=node_name))
+
 def check_bundle_contains_host_logs(host_log_files, node_name, bundle_zip_path):
     """
     Check if all files in host_log_files exist inside node zip in support bundle.
     """
-    tmp_dir = tempfile.mkdtemp(prefix="sb_extract_")
-    try:
-        # extract lh-support-bundle.zip
-        with zipfile.ZipFile(bundle_zip_path, "r") as zip_ref:
-            zip_ref.extractall(tmp_dir)
-        logging(f"Extracted support bundle to {tmp_dir}")
-
-        supportbundle_dirs = [
-            d for d in os.listdir(tmp_dir)
-            if d.startswith("supportbundle_") and os.path.isdir(os.path.join(tmp_dir, d))
-        ]
-        if not supportbundle_dirs:
-            assert False, "No supportbundle_* folder found in extracted tmp dir"
-        bundle_root = os.path.join(tmp_dir, supportbundle_dirs[0])
-
-        # find nodes/<node_name>.zip
-        node_zip_path = os.path.join(bundle_root, "nodes", f"{node_name}.zip")
-        if not os.path.exists(node_zip_path):
-            assert False, f"Node zip {node_name}.zip not found in bundle"
-
-        # read node zip content
-        with zipfile.ZipFile(node_zip_path, "r") as node_zip:
-            bundle_files = [os.path.basename(f) for f in node_zip.namelist()]
-
-        missing_files = []
-        for filename in host_log_files:
-            if filename not in bundle_files:
-                missing_files.append(filename)
-                logging(f"FAILED: {filename} not found in bundle")
-            else:
-                logging(f"PASSED: {filename} found in bundle")
-
-        if missing_files:
-            assert False, f"The following log files are missing in support bundle: {missing_files}"
-
-        logging("All host log files are present in the support bundle.")
-        return True
-    finally:
-        shutil.rmtree(tmp_dir)
+    # read nodes/<node_name>.zip in place, without extracting the bundle
+    bundle_files = [os.path.basename(f) for f in list_support_bundle_node_files(node_name, bundle_zip_path)]
+
+    missing_files = []
+    for filename in host_log_files:
+        if filename not in bundle_files:
+            missing_files.append(filename)
+            logging(f"FAILED: {filename} not found in bundle")
+        else:
+            logging(f"PASSED: {filename} found in bundle")
+
+    if missing_files:
+        assert False, f"The following log files are missing in support bundle: {missing_files}"
+
+    logging("All host log files are present in the support bundle.")
+    return True
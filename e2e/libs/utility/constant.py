@@ -14,6 +14,13 @@ STORAGECLASS_NAME_PREFIX = 'longhorn-test'
 
 STREAM_EXEC_TIMEOUT = 300
 
+# Slow operation classes are polled at most every RETRY_INTERVAL * factor,
+# see get_retry_policy()
+RETRY_POLICY_MAX_INTERVAL_FACTORS = {
+    "backup": 2,
+    "rebuild": 2,
+}
+
 LONGHORN_NAMESPACE = 'longhorn-system'
 
 DISK_BEING_SYNCING = "being syncing and please retry later"
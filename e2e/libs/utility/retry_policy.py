@@ -0,0 +1,90 @@
+import os
+import random
+import time
+
+
+class RetryPolicy:
+    """
+    Deadline based retry policy with exponential backoff.
+
+    The first probe happens immediately, the next ones are spaced by
+    initial_interval growing by backoff up to max_interval, with optional
+    jitter. Fast operations are then caught within a fraction of a second
+    while slow ones are not polled more often than max_interval.
+
+    Usage:
+        for _ in policy.attempts():
+            if done():
+                break
+    """
+
+    def __init__(self, timeout, max_interval, initial_interval=0.1,
+                 backoff=2.0, jitter=0.1):
+        self.timeout = timeout
+        self.max_interval = max_interval
+        self.initial_interval = min(initial_interval, max_interval)
+        self.backoff = backoff
+        self.jitter = jitter
+        # set when the timeout comes from RETRY_POLICY_<NAME>_TIMEOUT, it
+        # then wins over the timeout of the caller
+        self.timeout_from_env = False
+
+    def __repr__(self):
+        return f"RetryPolicy(timeout={self.timeout}, " \
+            f"initial_interval={self.initial_interval}, " \
+            f"max_interval={self.max_interval}, backoff={self.backoff}, " \
+            f"jitter={self.jitter})"
+
+    def intervals(self):
+        interval = self.initial_interval
+        while True:
+            if self.jitter:
+                yield interval * random.uniform(1 - self.jitter,
+                                                1 + self.jitter)
+            else:
+                yield interval
+            interval = min(interval * self.backoff, self.max_interval)
+
+    def attempts(self, timeout=None):
+        """
+        Yield the attempt number until the deadline expires, sleeping
+        between two attempts. One last attempt is made at the deadline.
+        :param timeout: Override the timeout of the policy in seconds,
+                        unless it was set by the environment.
+        """
+        if timeout is None or self.timeout_from_env:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+
+        attempt = 0
+        for interval in self.intervals():
+            yield attempt
+            attempt += 1
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            time.sleep(min(interval, remaining))
+
+
+def retry_policy_from_env(name, default):
+    """
+    Return the default policy of the operation class name, overridden by
+    the environment variables RETRY_POLICY_<NAME>_TIMEOUT,
+    RETRY_POLICY_<NAME>_INITIAL_INTERVAL and
+    RETRY_POLICY_<NAME>_MAX_INTERVAL if set.
+    A timeout set in the environment also overrides the timeout passed to
+    attempts() by the callers.
+    """
+    prefix = f"RETRY_POLICY_{name.upper()}_"
+
+    def get(key, value):
+        return float(os.environ.get(prefix + key, value))
+
+    policy = RetryPolicy(get("TIMEOUT", default.timeout),
+                         get("MAX_INTERVAL", default.max_interval),
+                         initial_interval=get("INITIAL_INTERVAL",
+                                              default.initial_interval),
+                         backoff=default.backoff, jitter=default.jitter)
+    policy.timeout_from_env = prefix + "TIMEOUT" in os.environ
+    return policy
@@ -26,6 +26,9 @@ from utility.constant import NAME_PREFIX
 from utility.constant import STREAM_EXEC_TIMEOUT
 from utility.constant import STORAGECLASS_NAME_PREFIX
 from utility.constant import DEFAULT_BACKUPSTORE
+from utility.constant import RETRY_POLICY_MAX_INTERVAL_FACTORS
+from utility.retry_policy import RetryPolicy
+from utility.retry_policy import retry_policy_from_env
 
 
 class timeout:
@@ -66,15 +69,30 @@ def get_retry_count_and_interval():
     return retry_count, retry_interval
 
 
+def get_retry_policy(operation="default"):
+    # keep the ${RETRY_COUNT} * ${RETRY_INTERVAL} budget as the deadline,
+    # but probe early and back off up to the interval of the operation class
+    retry_count, retry_interval = get_retry_count_and_interval()
+    factor = RETRY_POLICY_MAX_INTERVAL_FACTORS.get(operation, 1)
+    default = RetryPolicy(retry_count * retry_interval, retry_interval * factor)
+    return retry_policy_from_env(operation, default)
+
+
+# maps the bytes below 252 = 7 * 36 evenly to a lowercase letter or a digit,
+# the bytes above are rejected so that all characters are equally likely
+RANDOM_ID_TABLE = bytes((string.ascii_lowercase + string.digits).encode()[i % 36] for i in range(256))
+RANDOM_ID_REJECTED = bytes(range(252, 256))
+
+
 def generate_random_id(num_bytes):
-    return ''.join(random.choice(string.ascii_lowercase + string.digits)
-                   for _ in range(num_bytes))
+    random_id = b""
+    while len(random_id) < num_bytes:
+        random_id += random.randbytes(num_bytes - len(random_id)).translate(RANDOM_ID_TABLE, RANDOM_ID_REJECTED)
+    return random_id.decode()
 
 
 def generate_name_random(name_prefix="test-"):
-    return name_prefix + \
-        ''.join(random.choice(string.ascii_lowercase + string.digits)
-                for _ in range(6))
+    return name_prefix + generate_random_id(6)
 
 
 def is_valid_iso8601(date_string):
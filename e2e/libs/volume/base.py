@@ -1,9 +1,13 @@
 from abc import ABC, abstractmethod
+import hashlib
 import time
 
+from kubernetes import client
+
 from engine import Engine
 from engine_image import EngineImage
 from enginefrontend import EngineFrontend
+from node_exec import NodeExec
 
 from persistentvolume.persistentvolume import PersistentVolume
 from persistentvolumeclaim.persistentvolumeclaim import PersistentVolumeClaim
@@ -13,6 +17,13 @@ from utility.utility import logging
 from utility.utility import get_retry_count_and_interval
 from utility.utility import convert_size_to_bytes
 import utility.constant as constant
+from volume.constant import CHECKSUM_EXTENT_SIZE_MB
+from volume.constant import CHECKSUM_PARALLELISM
+
+
+# volume checksum -> digests of its extents, to tell where two volume data
+# differ when a checksum check fails
+_extent_checksums = {}
 
 
 class Base(ABC):
@@ -28,6 +39,40 @@ class Base(ABC):
         self.engineimage = EngineImage()
         self.enginefrontend = EngineFrontend()
 
+    def get_extent_checksums(self, node_name, endpoint):
+        """
+        Hash the device on the node in CHECKSUM_EXTENT_SIZE_MB extents, in
+        parallel and with direct I/O so neither a single hashing process nor
+        the page cache of the node is in the way.
+        Return the checksum of the device, derived from the extent digests.
+        """
+        cmd = [
+            "sh", "-c",
+            f"size=$(blockdev --getsize64 {endpoint}); "
+            f"count=$(( (size + {CHECKSUM_EXTENT_SIZE_MB * 1024 * 1024} - 1) / {CHECKSUM_EXTENT_SIZE_MB * 1024 * 1024} )); "
+            f"seq 0 $((count - 1)) | xargs -P {CHECKSUM_PARALLELISM} -I % sh -c "
+            f"'echo % $(dd if={endpoint} bs={CHECKSUM_EXTENT_SIZE_MB}M skip=% count=1 iflag=direct status=none | b2sum -l 128 | cut -c1-32)' "
+            f"| sort -n | cut -d ' ' -f 2"
+        ]
+        extents = NodeExec(node_name).issue_cmd(cmd).split()
+        checksum = hashlib.blake2b("\n".join(extents).encode(), digest_size=16).hexdigest()
+        _extent_checksums[checksum] = extents
+        return checksum
+
+    def get_first_different_extent(self, checksum, other_checksum):
+        """
+        Return the offset in bytes of the first extent that differs between
+        two checksums returned by get_extent_checksums, or None if unknown.
+        """
+        extents = _extent_checksums.get(checksum)
+        other_extents = _extent_checksums.get(other_checksum)
+        if extents is None or other_extents is None:
+            return None
+        for i, (extent, other_extent) in enumerate(zip(extents, other_extents)):
+            if extent != other_extent:
+                return i * CHECKSUM_EXTENT_SIZE_MB * 1024 * 1024
+        return min(len(extents), len(other_extents)) * CHECKSUM_EXTENT_SIZE_MB * 1024 * 1024
+
     def _get_volume_size(self, volume):
         # CRD returns dict-like payloads, REST returns object-like payloads.
         if isinstance(volume, dict):
@@ -88,6 +133,40 @@ class Base(ABC):
             logging(f"Getting volume {volume_name} last data checksum failed: {e}")
             return ""
 
+    def wait_for_volumes(self, volume_names, predicate):
+        # evaluate all the volumes against a single list call per interval
+        # instead of getting them one by one
+        obj_api = client.CustomObjectsApi()
+        start = time.time()
+        pending = set(volume_names)
+        volumes = {}
+        converge_times = {}
+        for i in range(self.retry_count):
+            logging(f"Waiting for volumes {sorted(pending)} ... ({i})")
+            try:
+                items = obj_api.list_namespaced_custom_object(
+                    group="longhorn.io",
+                    version="v1beta2",
+                    namespace=constant.LONGHORN_NAMESPACE,
+                    plural="volumes"
+                )["items"]
+                volumes = {item["metadata"]["name"]: item for item in items}
+                now = time.time()
+                for volume_name in list(pending):
+                    volume = volumes.get(volume_name)
+                    if volume is not None and predicate(volume):
+                        converge_times[volume_name] = round(now - start, 2)
+                        pending.remove(volume_name)
+            except Exception as e:
+                logging(f"Listing volumes error: {e}")
+            if not pending:
+                break
+            time.sleep(self.retry_interval)
+
+        assert not pending, f"Failed to wait for volumes {sorted(pending)}: {[volumes.get(name) for name in sorted(pending)]}"
+        logging(f"Volumes converged after (s): {converge_times}")
+        return converge_times
+
     @abstractmethod
     def attach(self, volume_name, node_name, disable_frontend, wait, retry):
         return NotImplemented
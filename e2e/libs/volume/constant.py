@@ -6,3 +6,8 @@ VOLUME_FRONTEND_BLOCKDEV = "blockdev"
 VOLUME_FRONTEND_ISCSI = "iscsi"
 
 DEV_PATH = "/dev/longhorn/"
+
+# Volume checksums are derived from the digests of fixed size extents,
+# see Base.get_extent_checksums()
+CHECKSUM_EXTENT_SIZE_MB = 4
+CHECKSUM_PARALLELISM = 8
@@ -15,9 +15,11 @@ from utility.utility import convert_size_to_bytes
 from utility.utility import get_longhorn_client
 from utility.utility import subprocess_exec_cmd
 from utility.utility import is_valid_iso8601
+from utility.utility import get_retry_policy
 
 from volume.base import Base
 from volume.constant import GIBIBYTE, MEBIBYTE
+from volume.constant import CHECKSUM_EXTENT_SIZE_MB
 from volume.rest import Rest
 
 from event.event import get_events
@@ -359,7 +361,7 @@ class CRD(Base):
 
     def wait_for_volume_state(self, volume_name, desired_state):
         volume = None
-        for i in range(self.retry_count):
+        for i in get_retry_policy("attach").attempts():
             logging(f"Waiting for {volume_name} {desired_state} ... ({i})")
             try:
                 volume = self.get(volume_name)
@@ -367,7 +369,6 @@ class CRD(Base):
                     break
             except Exception as e:
                 logging(f"Getting volume {volume_name} status error: {e}")
-            time.sleep(self.retry_interval)
         assert volume is not None, f"Failed to wait for {volume_name} {desired_state}: volume not found"
         assert volume["status"]["state"] == desired_state, f"Failed to wait for {volume_name} {desired_state}, currently it's {volume['status']['state']}"
 
@@ -609,10 +610,10 @@ class CRD(Base):
         cmd = [
             "sh", "-c",
             f"dd if=/dev/urandom of={endpoint} bs=1M count={size} status=none; "
-            f"sync {endpoint} 2>/dev/null; "
-            f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"
+            f"sync {endpoint} 2>/dev/null"
         ]
-        checksum = NodeExec(node_name).issue_cmd(cmd)
+        NodeExec(node_name).issue_cmd(cmd)
+        checksum = self.get_extent_checksums(node_name, endpoint)
 
         if data_id:
             logging(f"Storing volume {volume_name} data {data_id} checksum = {checksum}")
@@ -654,11 +655,7 @@ class CRD(Base):
         sync_cmd = ["sh", "-c", f"sync {endpoint} 2>/dev/null"]
         NodeExec(node_name).issue_cmd(sync_cmd)
 
-        cmd = [
-            "sh", "-c",
-            f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"
-        ]
-        checksum = NodeExec(node_name).issue_cmd(cmd)
+        checksum = self.get_extent_checksums(node_name, endpoint)
 
         logging(f"Storing volume {volume_name} data last recorded checksum = {checksum}")
         self.set_last_data_checksum(volume_name, checksum)
@@ -801,6 +798,9 @@ class CRD(Base):
         logging(f"Checked volume {volume_name} data {data_id}. Expected checksum = {expected_checksum}. Actual checksum = {actual_checksum}")
         if actual_checksum != expected_checksum:
             message = f"Checked volume {volume_name} data {data_id} failed. Expected checksum = {expected_checksum}. Actual checksum = {actual_checksum}"
+            offset = self.get_first_different_extent(expected_checksum, actual_checksum)
+            if offset is not None:
+                message += f". First different extent at offset {offset}"
             logging(message)
             time.sleep(self.retry_count)
             assert False, message
@@ -808,16 +808,17 @@ class CRD(Base):
     def get_checksum(self, volume_name):
         node_name = self.get(volume_name)["spec"]["nodeID"]
         endpoint = self.get_endpoint(volume_name)
-        checksum = NodeExec(node_name).issue_cmd(
-            ["sh", "-c", f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"])
+        checksum = self.get_extent_checksums(node_name, endpoint)
         logging(f"Calculated volume {volume_name} checksum {checksum}")
         return checksum
 
     def get_sha512sum(self, volume_name):
         node_name = self.get(volume_name)["spec"]["nodeID"]
         endpoint = self.get_endpoint(volume_name)
+        # compared with the sha512 of backing image files, so it has to hash
+        # the whole device, but at least read it in large direct I/O blocks
         checksum = NodeExec(node_name).issue_cmd(
-            ["sh", "-c", f"sha512sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"])
+            ["sh", "-c", f"dd if={endpoint} bs={CHECKSUM_EXTENT_SIZE_MB}M iflag=direct status=none | sha512sum | awk '{{print $1}}' | tr -d ' \n'"])
         logging(f"Calculated volume {volume_name} checksum {checksum}")
         return checksum
 
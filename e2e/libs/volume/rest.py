@@ -2,7 +2,6 @@ import os
 import time
 import asyncio
 
-from node_exec import NodeExec
 
 from volume.base import Base
 from volume.constant import DEV_PATH
@@ -12,6 +11,7 @@ from volume.constant import VOLUME_FRONTEND_ISCSI
 import utility.constant as constant
 from utility.utility import convert_size_to_bytes
 from utility.utility import get_longhorn_client
+from utility.utility import get_retry_policy
 from utility.utility import logging
 from utility.utility import pod_exec
 
@@ -330,7 +330,7 @@ class Rest(Base):
 
     def wait_for_replica_rebuilding_complete(self, volume_name, node_name=None):
         completed = False
-        for i in range(self.retry_count):
+        for i in get_retry_policy("rebuild").attempts():
             logging(f"wait for {volume_name} replica rebuilding completed on {'all nodes' if not node_name else node_name} ... ({i})")
             try:
                 v = get_longhorn_client().by_id_volume(volume_name)
@@ -367,7 +367,6 @@ class Rest(Base):
                     break
             except Exception as e:
                 logging(f"Failed to get volume {volume_name} with error: {e}")
-            time.sleep(self.retry_interval)
         logging(f"Completed volume {volume_name} replica rebuilding on {'all nodes' if not node_name else node_name}")
         assert completed, f"Expect volume {volume_name} replica rebuilding completed on {'all nodes' if not node_name else node_name}"
 
@@ -377,8 +376,7 @@ class Rest(Base):
     def get_checksum(self, volume_name):
         node_name = self.get(volume_name).controllers[0].hostId
         endpoint = self.get_endpoint(volume_name)
-        checksum = NodeExec(node_name).issue_cmd(
-            ["sh", "-c", f"md5sum {endpoint} | awk '{{print $1}}' | tr -d ' \n'"])
+        checksum = self.get_extent_checksums(node_name, endpoint)
         logging(f"Calculated volume {volume_name} checksum {checksum}")
         return checksum
 
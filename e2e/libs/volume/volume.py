@@ -86,6 +86,19 @@ class Volume(Base):
         self.volume.wait_for_volume_state(volume_name, "attached")
         self.volume.wait_for_volume_robustness(volume_name, "healthy")
 
+    def wait_for_volumes(self, volume_names, predicate):
+        return self.volume.wait_for_volumes(volume_names, predicate)
+
+    def wait_for_volumes_healthy(self, volume_names):
+        return self.volume.wait_for_volumes(
+            volume_names,
+            lambda v: v["status"]["state"] == "attached" and v["status"]["robustness"] == "healthy")
+
+    def wait_for_volumes_detached(self, volume_names):
+        return self.volume.wait_for_volumes(
+            volume_names,
+            lambda v: v["status"]["state"] == "detached")
+
     def wait_for_volume_migration_to_be_ready(self, volume_name):
         self.volume.wait_for_volume_migration_to_be_ready(volume_name)
 
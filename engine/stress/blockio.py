@@ -0,0 +1,137 @@
+# Block device I/O helpers shared by the stress test programs.
+#
+# Direct I/O needs page aligned buffers, so every process keeps one anonymous
+# mmap per buffer size and reuses it instead of allocating one per call.
+# Reads and writes of whole pages go straight to the device, only partial
+# page writes need a read-modify-write.
+#
+
+import datetime
+import mmap
+import os
+import struct
+
+import directio
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Pattern of the 8 bytes header stamped at the start of every block:
+# block offset and pattern, both as little endian uint32
+BLOCK_HEADER = struct.Struct("<II")
+
+_buffers = {}
+
+
+def get_buffer(length):
+    # buffers are not shared across processes, a forked child gets its own
+    # copy of the mapping
+    key = (os.getpid(), length)
+    buf = _buffers.get(key)
+    if buf is None:
+        buf = mmap.mmap(-1, length)
+        _buffers[key] = buf
+    return buf
+
+
+def _pread(f, buf, length, offset):
+    if hasattr(os, "preadv"):
+        return os.preadv(f, [memoryview(buf)[:length]], offset)
+    os.lseek(f, offset, os.SEEK_SET)
+    data = directio.read(f, length)
+    buf.seek(0)
+    buf.write(data)
+    return len(data)
+
+
+def _pwrite(f, buf, length, offset):
+    if hasattr(os, "pwritev"):
+        return os.pwritev(f, [memoryview(buf)[:length]], offset)
+    os.lseek(f, offset, os.SEEK_SET)
+    return directio.write(f, buf)
+
+
+def readat_direct(dev, offset, length, page_size):
+    pg = offset // page_size
+    in_page_offset = offset % page_size
+    # either read less than a page, or whole pages
+    if in_page_offset != 0:
+        assert pg == (offset + length - 1) // page_size
+        to_read = page_size
+    else:
+        assert length % page_size == 0
+        to_read = length
+    pg_offset = pg * page_size
+
+    buf = get_buffer(to_read)
+    f = os.open(dev, os.O_DIRECT | os.O_RDONLY)
+    try:
+        n = _pread(f, buf, to_read, pg_offset)
+    except OSError:
+        print("%s: encounter error in readat_direct for %s"
+              % (datetime.datetime.now(), dev))
+        raise
+    finally:
+        os.close(f)
+    return buf[in_page_offset: min(n, in_page_offset + length)]
+
+
+def writeat_direct(dev, offset, data, page_size):
+    pg = offset // page_size
+    in_page_offset = offset % page_size
+    if in_page_offset == 0 and len(data) % page_size == 0:
+        # whole pages, no need to read the current data first
+        to_write = len(data)
+        buf = get_buffer(to_write)
+        buf[0:to_write] = data
+    else:
+        # don't support across page write
+        assert pg == (offset + len(data) - 1) // page_size
+        to_write = page_size
+        pg_data = readat_direct(dev, pg * page_size, page_size, page_size)
+        buf = get_buffer(to_write)
+        buf[0:to_write] = pg_data
+        buf[in_page_offset: in_page_offset + len(data)] = data
+    pg_offset = pg * page_size
+
+    f = os.open(dev, os.O_DIRECT | os.O_RDWR)
+    try:
+        ret = _pwrite(f, buf, to_write, pg_offset)
+    except OSError:
+        print("%s: encounter error in writeat_direct for %s"
+              % (datetime.datetime.now(), dev))
+        raise
+    finally:
+        os.close(f)
+    return ret
+
+
+def gen_blockdata(blockoffset, nblocks, pattern, block_size):
+    # stamp the header of every block at once instead of byte by byte
+    if numpy is not None:
+        d = numpy.zeros((nblocks, block_size // 4), dtype="<u4")
+        d[:, 0] = numpy.arange(blockoffset, blockoffset + nblocks,
+                               dtype="<u8") & 0xFFFFFFFF
+        d[:, 1] = pattern & 0xFFFFFFFF
+        return bytearray(d.tobytes())
+
+    d = bytearray(nblocks * block_size)
+    for i in range(nblocks):
+        BLOCK_HEADER.pack_into(d, i * block_size,
+                               (blockoffset + i) & 0xFFFFFFFF,
+                               pattern & 0xFFFFFFFF)
+    return d
+
+
+def parse_blockheaders(d, nblocks, block_size):
+    # return the (block offset, pattern) stamped at the start of each block
+    if numpy is not None:
+        headers = numpy.frombuffer(d, dtype="<u4",
+                                   count=nblocks * block_size // 4)
+        headers = headers.reshape(nblocks, block_size // 4)[:, :2]
+        return [(int(o), int(p)) for o, p in headers]
+
+    return [BLOCK_HEADER.unpack_from(d, i * block_size)
+            for i in range(nblocks)]
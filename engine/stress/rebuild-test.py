@@ -5,8 +5,7 @@ import sys
 import threading
 import time
 import os
-import directio
-import mmap
+import blockio
 from os import path
 import stat
 import datetime
@@ -26,53 +25,11 @@ PAGE_SIZE = 256 * 4096
 DATA_LEN = NUM_PAGES * PAGE_SIZE
 
 def readat_direct(dev, offset, length):
-    pg = offset / PAGE_SIZE
-    in_page_offset = offset % PAGE_SIZE
-    # either read less than a page, or whole pages
-    if in_page_offset != 0:
-        assert pg == (offset + length - 1) / PAGE_SIZE
-        to_read = PAGE_SIZE
-    else:
-        assert length % PAGE_SIZE == 0
-        to_read = length
-    pg_offset = pg * PAGE_SIZE
-
-    f = os.open(dev, os.O_DIRECT | os.O_RDONLY)
-    try:
-        os.lseek(f, pg_offset, os.SEEK_SET)
-        ret = directio.read(f, to_read)
-    except OSError as e:
-        print "%s: encounter error in readat_direct for %s" \
-                % (datetime.datetime.now(), dev)
-        raise
-    finally:
-        os.close(f)
-    return ret[in_page_offset: in_page_offset + length]
+    return blockio.readat_direct(dev, offset, length, PAGE_SIZE)
 
 
 def writeat_direct(dev, offset, data):
-    pg = offset / PAGE_SIZE
-    # don't support across page write
-    assert pg == (offset + len(data) - 1) / PAGE_SIZE
-    pg_offset = pg * PAGE_SIZE
-
-    f = os.open(dev, os.O_DIRECT | os.O_RDWR)
-    m = mmap.mmap(-1, PAGE_SIZE)
-    try:
-        os.lseek(f, pg_offset, os.SEEK_SET)
-        pg_data = readat_direct(dev, pg_offset, PAGE_SIZE)
-        m.write(pg_data)
-        m.seek(offset % PAGE_SIZE)
-        m.write(data)
-        ret = directio.write(f, m)
-    except OSError as e:
-        print "%s: encounter error in writeat_direct for %s" \
-                % (datetime.datetime.now(), dev)
-        raise
-    finally:
-        m.close()
-        os.close(f)
-    return ret
+    return blockio.writeat_direct(dev, offset, data, PAGE_SIZE)
 
 def write_data(thread, index, pattern):
     writeat_direct("/dev/longhorn/vol%d" % (thread), index * PAGE_SIZE, str(chr(pattern))*PAGE_SIZE)
@@ -18,6 +18,7 @@ import time
 import datetime
 import os
 import stat
+import blockio
 from multiprocessing import Process, Manager, Array, current_process
 
 SIZE = 20 * 1024 * 1024 * 1024
@@ -47,17 +48,7 @@ def wait_for_dev_ready(i, controller):
   assert False
 
 def gen_blockdata(blockoffset, nblocks, pattern):
-  d = bytearray(nblocks * BLOCK_SIZE)
-  for i in xrange(nblocks):
-    d[i * BLOCK_SIZE + 0] = (blockoffset + i) & 0xFF
-    d[i * BLOCK_SIZE + 1] = ((blockoffset + i) >> 8) & 0xFF
-    d[i * BLOCK_SIZE + 2] = ((blockoffset + i) >> 16) & 0xFF
-    d[i * BLOCK_SIZE + 3] = ((blockoffset + i) >> 24) & 0xFF
-    d[i * BLOCK_SIZE + 4] = pattern & 0xFF
-    d[i * BLOCK_SIZE + 5] = (pattern >> 8) & 0xFF
-    d[i * BLOCK_SIZE + 6] = (pattern >> 16) & 0xFF
-    d[i * BLOCK_SIZE + 7] = (pattern >> 24) & 0xFF
-  return d
+  return blockio.gen_blockdata(blockoffset, nblocks, pattern, BLOCK_SIZE)
 
 def create_testdata():
   return Array('i', MAX_BLOCKS * (MAX_SNAPSHOTS + 1))
@@ -128,9 +119,9 @@ def read_and_check(snapshots, testdata, iterations):
       time.sleep(1)
       subprocess.call(["killall", "python"])
     current_pattern = gen_pattern()
+    headers = blockio.parse_blockheaders(d, nblocks, BLOCK_SIZE)
     for i in xrange(nblocks):
-      stored_blockoffset = ord(d[BLOCK_SIZE * i + 0]) + (ord(d[BLOCK_SIZE * i + 1]) << 8) + (ord(d[BLOCK_SIZE * i + 2]) << 16) + (ord(d[BLOCK_SIZE * i + 3]) << 24)
-      stored_pattern = ord(d[BLOCK_SIZE * i + 4]) + (ord(d[BLOCK_SIZE * i + 5]) << 8) + (ord(d[BLOCK_SIZE * i + 6]) << 16) + (ord(d[BLOCK_SIZE * i + 7]) << 24)
+      stored_blockoffset, stored_pattern = headers[i]
       pattern = testdata[base + blockoffset + i]
       # Skip entries that are too recent
       if current_pattern - pattern < MAX_TIME_SLACK or current_pattern - stored_pattern < MAX_TIME_SLACK:
@@ -7,6 +7,7 @@ import base64
 import hashlib
 import subprocess
 
+from concurrent.futures import ThreadPoolExecutor
 from minio import Minio
 from minio.error import ResponseError
 from urllib.parse import urlparse
@@ -36,6 +37,8 @@ from common import wait_for_backup_volume_delete
 
 BACKUPSTORE_BV_PREFIX = "/backupstore/volumes/"
 BACKUPSTORE_LOCK_DURATION = 150
+BACKUPSTORE_LIST_PARALLELISM = 8
+BACKUP_BLOCK_PREFIXES = [f"{i:02x}" for i in range(256)]
 DEFAULT_BACKUPTARGET = "default"
 object_has_been_modified = "the object has been modified; " + \
     "please apply your changes to the latest version and try again"
@@ -428,7 +431,15 @@ def backupstore_cleanup(client):
         f"backup_backing_images: {backup_backing_images.data}"
 
 
+# MinIO clients by secret name, each keeps its own pool of connections
+minio_api_clients = {}
+
+
 def minio_get_api_client(client, core_api, minio_secret_name):
+    minio_api = minio_api_clients.get(minio_secret_name)
+    if minio_api is not None:
+        return minio_api
+
     secret = core_api.read_namespaced_secret(name=minio_secret_name,
                                              namespace=LONGHORN_NAMESPACE)
 
@@ -446,19 +457,30 @@ def minio_get_api_client(client, core_api, minio_secret_name):
         base64.b64decode(base64_minio_endpoint_url).decode("utf-8")
     minio_endpoint_url = minio_endpoint_url.replace('https://', '')
 
+    # the client loads the CA cert when it is created
+    minio_write_cert_file(base64.b64decode(base64_minio_cert).decode("utf-8"))
+
+    minio_api = Minio(minio_endpoint_url,
+                      access_key=minio_access_key,
+                      secret_key=minio_secret_key,
+                      secure=True)
+    minio_api_clients[minio_secret_name] = minio_api
+    return minio_api
+
+
+def minio_write_cert_file(minio_cert):
     minio_cert_file_path = "/tmp/minio_cert.crt"
+    if os.path.exists(minio_cert_file_path):
+        with open(minio_cert_file_path, 'r') as minio_cert_file:
+            if minio_cert_file.read() == minio_cert:
+                os.environ["SSL_CERT_FILE"] = minio_cert_file_path
+                return
+
     with open(minio_cert_file_path, 'w') as minio_cert_file:
-        base64_minio_cert = \
-            base64.b64decode(base64_minio_cert).decode("utf-8")
-        minio_cert_file.write(base64_minio_cert)
+        minio_cert_file.write(minio_cert)
 
     os.environ["SSL_CERT_FILE"] = minio_cert_file_path
 
-    return Minio(minio_endpoint_url,
-                 access_key=minio_access_key,
-                 secret_key=minio_secret_key,
-                 secure=True)
-
 
 def minio_get_backupstore_bucket_name(client):
     backupstore = backupstore_get_backup_target(client)
@@ -937,14 +959,22 @@ def backupstore_count_backup_block_files(client, core_api, volume_name):
         pytest.skip("Skip test case because the backup store type is not supported") # NOQA
 
 
+def count_backup_block_files_in_parallel(count):
+    # block files are spread under blocks/<c[0:2]>/<c[2:4]>/ by their
+    # checksum c, count the first level prefixes in parallel
+    with ThreadPoolExecutor(max_workers=BACKUPSTORE_LIST_PARALLELISM) as \
+            executor:
+        return sum(executor.map(count, BACKUP_BLOCK_PREFIXES))
+
+
 def nfs_count_backup_block_files(client, volume_name):
     backup_blocks_dir = nfs_get_backup_blocks_dir(client, volume_name)
-    cmd = ["find", backup_blocks_dir, "-type", "f"]
-    find_cmd = subprocess.Popen(cmd, stdout=subprocess.PIPE)
-    wc_cmd = subprocess.check_output(["wc", "-l"], stdin=find_cmd.stdout)
-    backup_blocks_count = int(wc_cmd.decode().strip())
 
-    return backup_blocks_count
+    def count(prefix):
+        return sum(len(files) for _, _, files in
+                   os.walk(os.path.join(backup_blocks_dir, prefix)))
+
+    return count_backup_block_files_in_parallel(count)
 
 
 def minio_count_backup_block_files(client, core_api, volume_name):
@@ -955,13 +985,14 @@ def minio_count_backup_block_files(client, core_api, volume_name):
     bucket_name = minio_get_backupstore_bucket_name(client)
     backup_blocks_dir = minio_get_backup_blocks_dir(volume_name)
 
-    block_object_files = minio_api.list_objects(bucket_name,
-                                                prefix=backup_blocks_dir,
-                                                recursive=True)
-
-    block_object_files_list = list(block_object_files)
+    def count(prefix):
+        block_object_files = \
+            minio_api.list_objects(bucket_name,
+                                   prefix=f"{backup_blocks_dir}/{prefix}/",
+                                   recursive=True)
+        return sum(1 for _ in block_object_files)
 
-    return len(block_object_files_list)
+    return count_backup_block_files_in_parallel(count)
 
 
 def backupstore_wait_for_lock_expiration():
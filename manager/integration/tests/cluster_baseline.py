@@ -0,0 +1,185 @@
+import json
+import os
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from kubernetes import client as k8sclient
+from kubernetes.client.rest import ApiException
+
+LONGHORN_GROUP = "longhorn.io"
+LONGHORN_VERSION = "v1beta2"
+LONGHORN_NAMESPACE = "longhorn-system"
+
+ZONE_LABEL = "topology.kubernetes.io/zone"
+ENGINE_IMAGE_DAEMONSET_PREFIX = "engine-image-"
+CRYPTO_SECRET_NAMES = ["longhorn-crypto"]
+# common.DIRECTORY_PATH, where the tests mount their host disks
+HOST_DISK_DIRECTORY = os.path.join(
+    os.environ.get('DEFAULT_DATA_PATH', '/var/lib/longhorn'), 'longhorn-test')
+
+# updated by the upgrade checker of longhorn-manager, not by the tests
+IGNORED_SETTINGS = ["latest-longhorn-version", "stable-longhorn-versions"]
+
+# What cleanup_client() resets, by kind. Only what can't change on its own
+# is recorded: names, specs and setting values, not statuses, except the
+# instance manager states the cleanup waits for, and the host disks of the
+# node running the tests.
+SNAPSHOT_KINDS = [
+    "volumes", "recurringjobs", "backingimages", "supportbundles",
+    "systemrestores", "settings", "nodes", "engineimages",
+    "instancemanagers", "k8s_nodes", "engine_image_daemonsets",
+    "crypto_secrets", "storage_classes", "host_disks",
+]
+
+
+def is_diff_cleanup_enabled():
+    return os.environ.get("LONGHORN_DIFF_CLEANUP", "true") == "true"
+
+
+def _list_longhorn(plural):
+    api = k8sclient.CustomObjectsApi()
+    try:
+        return api.list_namespaced_custom_object(
+            LONGHORN_GROUP, LONGHORN_VERSION, LONGHORN_NAMESPACE,
+            plural)["items"]
+    except ApiException as e:
+        # the CRD doesn't exist in older Longhorn versions (test_upgrade)
+        if e.status == 404:
+            return []
+        raise
+
+
+def _names(plural):
+    return sorted(obj["metadata"]["name"] for obj in _list_longhorn(plural))
+
+
+def _specs(plural):
+    return {obj["metadata"]["name"]: obj.get("spec")
+            for obj in _list_longhorn(plural)}
+
+
+def _settings():
+    return {s["metadata"]["name"]: s.get("value")
+            for s in _list_longhorn("settings")
+            if s["metadata"]["name"] not in IGNORED_SETTINGS}
+
+
+def _instance_managers():
+    return {im["metadata"]["name"]:
+            (im.get("status") or {}).get("currentState")
+            for im in _list_longhorn("instancemanagers")}
+
+
+def _k8s_nodes():
+    nodes = {}
+    for node in k8sclient.CoreV1Api().list_node().items:
+        taints = [(t.key, t.value, t.effect)
+                  for t in node.spec.taints or []]
+        nodes[node.metadata.name] = {
+            "unschedulable": bool(node.spec.unschedulable),
+            "taints": sorted(taints, key=str),
+            "zone": (node.metadata.labels or {}).get(ZONE_LABEL),
+        }
+    return nodes
+
+
+def _engine_image_daemonsets():
+    ret = k8sclient.AppsV1Api().list_namespaced_daemon_set(LONGHORN_NAMESPACE)
+    return {ds.metadata.name: ds.spec.template.spec.node_selector
+            for ds in ret.items
+            if ds.metadata.name.startswith(ENGINE_IMAGE_DAEMONSET_PREFIX)}
+
+
+def _crypto_secrets():
+    ret = k8sclient.CoreV1Api().list_namespaced_secret(LONGHORN_NAMESPACE)
+    return sorted(s.metadata.name for s in ret.items
+                  if s.metadata.name in CRYPTO_SECRET_NAMES)
+
+
+def _storage_classes():
+    ret = k8sclient.StorageV1Api().list_storage_class()
+    return sorted(sc.metadata.name for sc in ret.items)
+
+
+def _host_disks():
+    # host side, a leaked host disk needs a cleanup even if it was never
+    # added to the node
+    try:
+        return sorted(os.listdir(HOST_DISK_DIRECTORY))
+    except FileNotFoundError:
+        return []
+
+
+_snapshot_funcs = {
+    "volumes": lambda: _names("volumes"),
+    "recurringjobs": lambda: _names("recurringjobs"),
+    "backingimages": lambda: _names("backingimages"),
+    "supportbundles": lambda: _names("supportbundles"),
+    "systemrestores": lambda: _names("systemrestores"),
+    "settings": _settings,
+    "nodes": lambda: _specs("nodes"),
+    "engineimages": lambda: _specs("engineimages"),
+    "instancemanagers": _instance_managers,
+    "k8s_nodes": _k8s_nodes,
+    "engine_image_daemonsets": _engine_image_daemonsets,
+    "crypto_secrets": _crypto_secrets,
+    "storage_classes": _storage_classes,
+    "host_disks": _host_disks,
+}
+
+
+def take_cluster_snapshot():
+    """
+    Record the state cleanup_client() resets, one list per kind, all kinds
+    listed concurrently.
+    Return a dict of kind -> canonical JSON of its state, or None if any
+    list failed.
+    """
+    with ThreadPoolExecutor(max_workers=len(SNAPSHOT_KINDS)) as executor:
+        futures = {kind: executor.submit(_snapshot_funcs[kind])
+                   for kind in SNAPSHOT_KINDS}
+    snapshot = {}
+    for kind, future in futures.items():
+        try:
+            snapshot[kind] = json.dumps(future.result(), sort_keys=True,
+                                        default=str)
+        except Exception as e:
+            print(f"\nFailed to snapshot {kind}: {e}")
+            return None
+    return snapshot
+
+
+def get_snapshot_settings(snapshot):
+    """
+    Return the setting values recorded in a snapshot, or None.
+    """
+    if snapshot is None:
+        return None
+    return json.loads(snapshot["settings"])
+
+
+def diff_cluster_snapshots(baseline, snapshot):
+    """
+    Return the set of kinds that differ between two snapshots, or None if
+    either is missing, meaning everything has to be reset.
+    """
+    if baseline is None or snapshot is None:
+        return None
+    return {kind for kind in SNAPSHOT_KINDS
+            if baseline.get(kind) != snapshot.get(kind)}
+
+
+_baseline = None
+_baseline_lock = threading.Lock()
+
+
+def get_cluster_baseline():
+    with _baseline_lock:
+        return _baseline
+
+
+def set_cluster_baseline(snapshot):
+    global _baseline
+    with _baseline_lock:
+        _baseline = snapshot
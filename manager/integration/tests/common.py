@@ -1,4 +1,5 @@
 import fcntl
+import mmap
 import struct
 import time
 import os
@@ -21,6 +22,19 @@ import longhorn
 import requests
 import warnings
 
+from cluster_baseline import diff_cluster_snapshots
+from cluster_baseline import get_cluster_baseline
+from cluster_baseline import get_snapshot_settings
+from cluster_baseline import IGNORED_SETTINGS
+from cluster_baseline import is_diff_cleanup_enabled
+from cluster_baseline import set_cluster_baseline
+from cluster_baseline import take_cluster_snapshot
+from concurrent.futures import ThreadPoolExecutor
+from crd_watcher import get_crd_watcher
+from crd_watcher import WATCH_RESYNC_INTERVAL
+from retry_policy import RetryPolicy
+from retry_policy import retry_policy_from_env
+
 from kubernetes import client as k8sclient, config as k8sconfig
 from kubernetes.client import Configuration
 from kubernetes.stream import stream
@@ -44,6 +58,19 @@ DEV_PATH = "/dev/longhorn/"
 VOLUME_RWTEST_SIZE = 512
 VOLUME_INVALID_POS = -1
 
+# Device checksums are derived from the digests of extents of this size,
+# see get_device_checksum()
+DEVICE_CHECKSUM_EXTENT_SIZE = 4 * Mi
+
+# Random test data is made of these characters, RANDOM_DATA_TABLE maps the
+# bytes below the largest multiple of their count evenly to them, the bytes
+# above it are rejected so that all characters are equally likely
+RANDOM_DATA_CHARS = (string.ascii_lowercase + string.digits).encode()
+RANDOM_DATA_LIMIT = 256 - 256 % len(RANDOM_DATA_CHARS)
+RANDOM_DATA_TABLE = bytes(RANDOM_DATA_CHARS[i % len(RANDOM_DATA_CHARS)]
+                          for i in range(256))
+RANDOM_DATA_REJECTED = bytes(range(RANDOM_DATA_LIMIT, 256))
+
 VOLUME_HEAD_NAME = "volume-head"
 
 BACKING_IMAGE_NAME = "bi-test"
@@ -64,6 +91,7 @@ BACKING_IMAGE_STATE_FAILED = "failed"
 BACKING_IMAGE_STATE_FAILED_AND_CLEANUP = "failed-and-cleanup"
 
 PORT = ":9500"
+CLIENT_REVALIDATE_INTERVAL = 30
 
 RETRY_COMMAND_COUNT = 5
 RETRY_COUNTS = 150
@@ -364,6 +392,18 @@ if disktype == "hdd":
     DEFAULT_DEPLOYMENT_TIMEOUT *= 32
     DEFAULT_STATEFULSET_TIMEOUT *= 32
 
+# Per operation class retry policies, see retry_policy.py for the
+# environment variables overriding them.
+RETRY_POLICY_ATTACH = retry_policy_from_env(
+    "attach", RetryPolicy(RETRY_COUNTS_LONG * RETRY_INTERVAL, RETRY_INTERVAL))
+RETRY_POLICY_REBUILD = retry_policy_from_env(
+    "rebuild", RetryPolicy(RETRY_COUNTS * RETRY_INTERVAL, RETRY_INTERVAL_LONG,
+                           initial_interval=RETRY_INTERVAL_SHORT))
+RETRY_POLICY_BACKUP = retry_policy_from_env(
+    "backup", RetryPolicy(RETRY_BACKUP_COUNTS * RETRY_BACKUP_INTERVAL,
+                          RETRY_INTERVAL_LONG,
+                          initial_interval=RETRY_INTERVAL_SHORT))
+
 
 def load_k8s_config():
     c = Configuration()
@@ -405,22 +445,9 @@ def get_custom_object_api_client():
 def get_longhorn_api_client():
     for _ in range(RETRY_COUNTS):
         try:
-            k8sconfig.load_incluster_config()
-            ips = get_mgr_ips()
-
-            # check if longhorn manager port is open before calling get_client
-            for ip in ips:
-                # Determine if IP is IPv6
-                family = socket.AF_INET6 if ':' in ip else socket.AF_INET
-                sock = socket.socket(family, socket.SOCK_STREAM)
-                sock.settimeout(RETRY_COUNTS_SHORT)
-
-                try:
-                    if sock.connect_ex((ip, 9500)) == 0:
-                        return get_client(ip + PORT)
-                finally:
-                    sock.close()
+            return client_registry.get_manager_client()
         except Exception:
+            client_registry.invalidate()
             time.sleep(RETRY_INTERVAL)
 
     raise Exception("Failed to get Longhorn API client after retries")
@@ -446,12 +473,13 @@ def cleanup_all_volumes(client):
     :param client: The Longhorn client to use in the request.
     """
 
+    # delete all the volumes first, then wait for them together, so the
+    # deletions proceed in parallel on the manager side
     volumes = client.list_volume()
     for v in volumes:
         # ignore the error when clean up
         try:
             client.delete(v)
-            wait_for_volume_delete(client, v.name)
         except Exception as e:
             print("\nException when cleanup volume ", v)
             print(e)
@@ -476,7 +504,7 @@ def create_volume_and_backup(client, vol_name, vol_size, backup_data_size):
 
     data = {'pos': 0,
             'len': backup_data_size,
-            'content': generate_random_data(backup_data_size)}
+            'seed': generate_random_seed()}
 
     _, backup, _, _ = create_backup(client, vol_name, data)
 
@@ -1761,30 +1789,9 @@ def client(request):
     """
     Return an individual Longhorn API client for testing.
     """
-    k8sconfig.load_incluster_config()
+    api_client = client_registry.get_manager_client()
     # Make sure nodes and managers are all online.
-    ips = get_mgr_ips()
-
-    api_client = None
-
-    # check if longhorn manager port is open before calling get_client
-    for ip in ips:
-        family = socket.AF_INET6 if ':' in ip else socket.AF_INET
-        sock = socket.socket(family, socket.SOCK_STREAM)
-
-        try:
-            if sock.connect_ex((ip, 9500)) == 0:
-                api_client = get_client(ip + PORT)
-                break
-        finally:
-            sock.close()
-
-    if api_client is None:
-        raise RuntimeError(
-            "Failed to connect to any Longhorn manager on ports 9500")
-
-    hosts = api_client.list_node()
-    assert len(hosts) == len(ips)
+    client_registry.check_hosts()
 
     request.addfinalizer(lambda: cleanup_client())
 
@@ -1803,11 +1810,7 @@ def client(request):
 
 @pytest.fixture
 def clients(request):
-    k8sconfig.load_incluster_config()
-    ips = get_mgr_ips()
-    client = get_client(ips[0] + PORT)
-    hosts = client.list_node()
-    assert len(hosts) == len(ips)
+    hosts = client_registry.check_hosts()
     clis = get_clients(hosts)
 
     def finalizer():
@@ -1820,37 +1823,46 @@ def clients(request):
     return clis
 
 
-def cleanup_client():
-    core_api = k8sclient.CoreV1Api()
-    client = get_longhorn_api_client()
-
-    enable_default_disk(client)
-
-    cleanup_all_volumes(client)
-
-    # cleanup test disks
-    cleanup_test_disks(client)
+def run_cleanup_steps(*steps):
+    """
+    Run independent cleanup steps concurrently, skipping the None ones.
+    The first failure is raised after all the steps finished.
+    """
+    steps = [step for step in steps if step is not None]
+    if not steps:
+        return
+    with ThreadPoolExecutor(max_workers=len(steps)) as executor:
+        futures = [executor.submit(step) for step in steps]
+    for future in futures:
+        future.result()
 
-    if recurring_job_feature_supported(client):
-        cleanup_all_recurring_jobs(client)
 
-    if backing_image_feature_supported(client):
-        cleanup_all_backing_images(client)
+def cleanup_client():
+    """
+    Reset the volumes, disks, nodes, settings ... a test may have changed.
 
-    cleanup_crypto_secret()
-    cleanup_storage_class()
-    if system_backup_feature_supported(client):
-        system_restores_cleanup(client)
+    The first cleanup of the session resets everything. The state
+    cleanup_client() resets is then snapshotted as the baseline after each
+    reset, and only the kinds that differ from the latest baseline are reset
+    next time, so a cleanup is close to free when the test didn't touch
+    anything. Set LONGHORN_DIFF_CLEANUP=false to always reset everything.
+    """
+    core_api = k8sclient.CoreV1Api()
+    client = get_longhorn_api_client()
 
-    cleanup_all_support_bundles(client)
+    changed = None
+    snapshot = None
+    if is_diff_cleanup_enabled():
+        snapshot = take_cluster_snapshot()
+        changed = diff_cluster_snapshots(get_cluster_baseline(), snapshot)
 
-    # enable nodes scheduling
-    reset_node(client, core_api)
-    reset_settings(client)
-    reset_disks_for_all_nodes(client)
-    scale_up_engine_image_daemonset(client)
-    reset_engine_image(client)
-    wait_for_all_instance_manager_running(client)
+    if changed is not None and not changed:
+        print("\nCluster unchanged since the last cleanup, skipping reset")
+    else:
+        print(f"\nResetting {sorted(changed) if changed else 'everything'}")
+        reset_cluster(client, core_api, changed, snapshot)
+        if is_diff_cleanup_enabled():
+            set_cluster_baseline(take_cluster_snapshot())
 
     enable_v2 = os.environ.get('RUN_V2_TEST')
     if enable_v2 == "true":
@@ -1862,6 +1874,67 @@ def cleanup_client():
             ["mkdir", "-p", DEFAULT_REPLICA_DIRECTORY])
 
 
+def reset_cluster(client, core_api, changed=None, snapshot=None):
+    """
+    Reset the given kinds of cluster_baseline.SNAPSHOT_KINDS, or everything
+    if changed is None. The settings that differ in snapshot, the one
+    changed was computed from, are restored along with the tracked ones.
+
+    Independent kinds are reset concurrently: the deletions first, then the
+    node, setting and disk resets alongside the backing image deletion,
+    which both need the volumes gone, and the engine images last since
+    their daemonset can only be deployed on nodes without taints.
+    """
+    def touched(*kinds):
+        return changed is None or any(kind in changed for kind in kinds)
+
+    def step(condition, func, *args):
+        return (lambda: func(*args)) if condition else None
+
+    node_changed = touched("nodes", "k8s_nodes")
+    if node_changed:
+        enable_default_disk(client)
+
+    run_cleanup_steps(
+        step(touched("volumes"), cleanup_all_volumes, client),
+        step(touched("recurringjobs") and
+             recurring_job_feature_supported(client),
+             cleanup_all_recurring_jobs, client),
+        step(touched("crypto_secrets"), cleanup_crypto_secret),
+        step(touched("storage_classes"), cleanup_storage_class),
+        step(touched("systemrestores") and
+             system_backup_feature_supported(client),
+             system_restores_cleanup, client),
+        step(touched("supportbundles"), cleanup_all_support_bundles, client),
+    )
+
+    def reset_nodes_and_settings():
+        if node_changed or touched("host_disks"):
+            # cleanup test disks
+            cleanup_test_disks(client)
+        if node_changed:
+            # enable nodes scheduling
+            reset_node(client, core_api)
+        if touched("settings"):
+            values = get_snapshot_settings(snapshot)
+            reset_settings(client, full=changed is None or values is None,
+                           names=get_drifted_settings(values or {}))
+        if node_changed:
+            reset_disks_for_all_nodes(client)
+
+    run_cleanup_steps(
+        step(touched("backingimages") and
+             backing_image_feature_supported(client),
+             cleanup_all_backing_images, client),
+        reset_nodes_and_settings,
+    )
+
+    if touched("engineimages", "engine_image_daemonsets", "k8s_nodes"):
+        scale_up_engine_image_daemonset(client)
+        reset_engine_image(client)
+    wait_for_all_instance_manager_running(client)
+
+
 def reset_nodes_taint(client):
     core_api = get_core_api_client()
     nodes = client.list_node()
@@ -1947,9 +2020,107 @@ def get_client(address_with_port):
 
     url = f'http://{formatted_address}/v1/schemas'
     c = longhorn.from_env(url=url)
+    track_setting_updates(c)
     return c
 
 
+def is_manager_port_open(ip):
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.settimeout(RETRY_COUNTS_SHORT)
+    try:
+        return sock.connect_ex((ip, 9500)) == 0
+    finally:
+        sock.close()
+
+
+class ClientRegistry:
+    """
+    Longhorn API clients shared by all the tests of the session, keyed by
+    address.
+
+    The longhorn-manager pods and the Longhorn nodes are listed again at most
+    every CLIENT_REVALIDATE_INTERVAL seconds, or right away when no cached
+    manager answers anymore. Clients and the cached API schemas are dropped
+    once the manager pods changed, e.g. after a restart or an upgrade, and
+    rebuilt on the next use.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._clients = {}
+        self._managers = {}  # manager pod ip -> (pod uid, restart count)
+        self._hosts = []
+        self._validated_at = 0
+
+    def invalidate(self):
+        with self._lock:
+            self._clients = {}
+            self._managers = {}
+            self._hosts = []
+            self._validated_at = 0
+
+    def revalidate(self, force=False):
+        with self._lock:
+            if not force and self._managers and \
+                    time.time() - self._validated_at < \
+                    CLIENT_REVALIDATE_INTERVAL:
+                return
+            k8sconfig.load_incluster_config()
+            ret = k8sclient.CoreV1Api().list_pod_for_all_namespaces(
+                label_selector="app=longhorn-manager", watch=False)
+            managers = {}
+            for pod in ret.items:
+                restarts = sum(s.restart_count for s in
+                               pod.status.container_statuses or [])
+                managers[pod.status.pod_ip] = (pod.metadata.uid, restarts)
+            if managers != self._managers:
+                # an upgraded manager may serve a different schema at the
+                # same URL
+                self._clients = {}
+                longhorn.clear_schema_cache()
+            self._managers = managers
+            self._hosts = []
+            self._validated_at = time.time()
+
+    def get(self, address_with_port):
+        with self._lock:
+            c = self._clients.get(address_with_port)
+            if c is None:
+                c = get_client(address_with_port)
+                self._clients[address_with_port] = c
+            return c
+
+    def get_manager_ips(self):
+        self.revalidate()
+        with self._lock:
+            return [ip for ip in self._managers if ip]
+
+    def get_manager_client(self):
+        for force in [False, True]:
+            self.revalidate(force=force)
+            # check if longhorn manager port is open before using the client
+            for ip in self.get_manager_ips():
+                if is_manager_port_open(ip):
+                    return self.get(ip + PORT)
+        raise RuntimeError(
+            "Failed to connect to any Longhorn manager on ports 9500")
+
+    def check_hosts(self):
+        """
+        Assert there is a manager per Longhorn node, and return the nodes.
+        """
+        for force in [False, True]:
+            self.revalidate(force=force)
+            with self._lock:
+                if not self._hosts:
+                    self._hosts = self.get_manager_client().list_node()
+                hosts = self._hosts
+            if len(hosts) == len(self.get_manager_ips()):
+                return hosts
+        assert len(hosts) == len(self.get_manager_ips())
+
+
 def get_mgr_ips():
     ret = k8sclient.CoreV1Api().list_pod_for_all_namespaces(
             label_selector="app=longhorn-manager",
@@ -1960,6 +2131,9 @@ def get_mgr_ips():
     return mgr_ips
 
 
+client_registry = ClientRegistry()
+
+
 def get_self_host_id():
     return os.environ.get("NODE_NAME")
 
@@ -1997,7 +2171,7 @@ def get_clients(hosts):
     for host in hosts:
         assert host.name is not None
         assert host.address is not None
-        clients[host.name] = get_client(host.address + PORT)
+        clients[host.name] = client_registry.get(host.address + PORT)
     return clients
 
 
@@ -2052,6 +2226,48 @@ def wait_for_replica_directory():
     assert found
 
 
+def wait_for_longhorn_object(plural, name, get_object, predicate,
+                             retry_count=RETRY_COUNTS,
+                             retry_interval=RETRY_INTERVAL, policy=None):
+    """
+    Wait until predicate(get_object()) is true and return the last object.
+
+    Instead of sleeping retry_interval between two checks, the object is
+    re-fetched as soon as the watcher of the Longhorn CRD plural reports a
+    change on name. When watching is disabled, not synced yet or broke
+    while waiting this falls back to polling with the backoff of policy.
+    :param plural: The Longhorn CRD plural to watch, e.g. "volumes", whose
+                   waiters are also woken up by the events of the replicas
+                   and engines of the volume. None to always poll.
+    :param name: The CR name, or the volume name for replicas and engines.
+    :param get_object: Callable returning the up-to-date object.
+    :param predicate: Callable checking the object returned by get_object.
+    :param retry_count: Give up after retry_count * retry_interval seconds.
+    :param retry_interval: The max polling interval without watch.
+    :param policy: The RetryPolicy overriding retry_count and retry_interval.
+    """
+    if policy is None:
+        policy = RetryPolicy(retry_count * retry_interval, retry_interval)
+    deadline = time.time() + policy.timeout
+    intervals = policy.intervals()
+    while True:
+        watcher = get_crd_watcher(plural)
+        version = watcher.version(name) if watcher else None
+        obj = get_object()
+        if predicate(obj):
+            return obj
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return obj
+
+        if watcher is None or not watcher.is_synced():
+            time.sleep(min(next(intervals), remaining))
+        else:
+            watcher.wait_for_change(name, version,
+                                    min(WATCH_RESYNC_INTERVAL, remaining))
+
+
 def wait_for_volume_creation(client, name):
     for i in range(RETRY_COUNTS):
         volumes = client.list_volume()
@@ -2067,12 +2283,10 @@ def wait_for_volume_creation(client, name):
 
 
 def wait_for_volume_endpoint(client, name):
-    for i in range(RETRY_COUNTS):
-        v = client.by_id_volume(name)
-        engine = get_volume_engine(v)
-        if engine.endpoint != "":
-            break
-        time.sleep(RETRY_INTERVAL)
+    v = wait_for_longhorn_object(
+        "volumes", name,
+        lambda: client.by_id_volume(name),
+        lambda v: get_volume_engine(v).endpoint != "")
     check_volume_endpoint(v)
     return v
 
@@ -2080,13 +2294,15 @@ def wait_for_volume_endpoint(client, name):
 def wait_for_volume_attached(client, name):
     return wait_for_volume_status(client, name,
                                   VOLUME_FIELD_STATE,
-                                  VOLUME_STATE_ATTACHED)
+                                  VOLUME_STATE_ATTACHED,
+                                  policy=RETRY_POLICY_ATTACH)
 
 
 def wait_for_volume_detached(client, name):
     return wait_for_volume_status(client, name,
                                   VOLUME_FIELD_STATE,
-                                  VOLUME_STATE_DETACHED)
+                                  VOLUME_STATE_DETACHED,
+                                  policy=RETRY_POLICY_ATTACH)
 
 
 def wait_for_volume_detached_unknown(client, name):
@@ -2136,18 +2352,100 @@ def wait_for_volume_faulted(client, name):
 
 
 def wait_for_volume_status(client, name, key, value,
-                           retry_count=RETRY_COUNTS_LONG):
+                           retry_count=RETRY_COUNTS_LONG, policy=None):
     wait_for_volume_creation(client, name)
-    for i in range(retry_count):
-        volume = client.by_id_volume(name)
-        if volume[key] == value:
-            break
-        time.sleep(RETRY_INTERVAL)
+    volume = wait_for_longhorn_object(
+        "volumes", name,
+        lambda: client.by_id_volume(name),
+        lambda v: v[key] == value,
+        retry_count=retry_count, policy=policy)
     assert volume[key] == value, f" value={value}\n. \
             volume[key]={volume[key]}\n. volume={volume}"
     return volume
 
 
+def wait_for_volumes(client, names, predicate,
+                     retry_count=RETRY_COUNTS_LONG,
+                     retry_interval=RETRY_INTERVAL):
+    """
+    Wait until predicate(volume) is true for all the volumes in names.
+
+    All volumes are checked against a single list_volume() call per
+    interval, instead of one by_id_volume() call per volume.
+    :param client: The Longhorn client to use in the request.
+    :param names: The names of the volumes to wait for.
+    :param predicate: Callable checking a volume object.
+    :return: A tuple of the last seen volume per name, and the seconds each
+             volume took to converge.
+    """
+    start = time.time()
+    pending = set(names)
+    volumes = {}
+    converge_times = {}
+    for i in range(retry_count):
+        volumes = {v.name: v for v in client.list_volume()}
+        now = time.time()
+        for name in list(pending):
+            v = volumes.get(name)
+            if v is not None and predicate(v):
+                converge_times[name] = now - start
+                pending.remove(name)
+        if not pending:
+            break
+        time.sleep(retry_interval)
+
+    assert not pending, \
+        f"volumes {sorted(pending)} did not converge, " \
+        f"last seen: {[volumes.get(name) for name in sorted(pending)]}"
+    return {name: volumes[name] for name in names}, converge_times
+
+
+def is_volume_healthy(v):
+    return v.state == VOLUME_STATE_ATTACHED and \
+        v.robustness == VOLUME_ROBUSTNESS_HEALTHY and \
+        get_volume_engine(v).endpoint != ""
+
+
+def wait_for_volumes_healthy(client, names, retry_count=RETRY_COUNTS_LONG):
+    volumes, converge_times = wait_for_volumes(client, names,
+                                               is_volume_healthy,
+                                               retry_count=retry_count)
+    print(f"\nVolumes healthy after (s): {converge_times}")
+    for v in volumes.values():
+        check_volume_endpoint(v)
+    return volumes
+
+
+def wait_for_volumes_detached(client, names, retry_count=RETRY_COUNTS_LONG):
+    volumes, converge_times = wait_for_volumes(
+        client, names, lambda v: v.state == VOLUME_STATE_DETACHED,
+        retry_count=retry_count)
+    print(f"\nVolumes detached after (s): {converge_times}")
+    return volumes
+
+
+def wait_for_volumes_deleted(client, names, retry_count=RETRY_COUNTS):
+    """
+    Wait until none of the volumes in names exists anymore, with a single
+    list_volume() call per interval.
+    """
+    start = time.time()
+    pending = set(names)
+    converge_times = {}
+    for i in range(retry_count):
+        existing = {v.name for v in client.list_volume()}
+        now = time.time()
+        for name in pending - existing:
+            converge_times[name] = now - start
+        pending &= existing
+        if not pending:
+            break
+        time.sleep(RETRY_INTERVAL)
+
+    assert not pending, f"volumes {sorted(pending)} are not deleted"
+    print(f"\nVolumes deleted after (s): {converge_times}")
+
+
 def wait_for_volume_delete(client, name):
     for i in range(RETRY_COUNTS):
         try:
@@ -2195,33 +2493,30 @@ def wait_for_backup_backing_image_delete(client, name):
 
 def wait_for_volume_current_image(client, name, image):
     wait_for_volume_creation(client, name)
-    for i in range(RETRY_COUNTS):
-        volume = client.by_id_volume(name)
-        if volume.currentImage == image:
-            break
-        time.sleep(RETRY_INTERVAL)
+    volume = wait_for_longhorn_object(
+        "volumes", name,
+        lambda: client.by_id_volume(name),
+        lambda v: v.currentImage == image)
     assert volume.currentImage == image
     return volume
 
 
 def wait_for_volume_replica_count(client, name, count):
     wait_for_volume_creation(client, name)
-    for i in range(RETRY_COUNTS):
-        volume = client.by_id_volume(name)
-        if len(volume.replicas) == count:
-            break
-        time.sleep(RETRY_INTERVAL)
+    volume = wait_for_longhorn_object(
+        "volumes", name,
+        lambda: client.by_id_volume(name),
+        lambda v: len(v.replicas) == count)
     assert len(volume.replicas) == count
     return volume
 
 
 def wait_for_volume_replica_auto_balance_update(client, volume_name, value):
     wait_for_volume_creation(client, volume_name)
-    for i in range(RETRY_COUNTS):
-        volume = client.by_id_volume(volume_name)
-        if volume.replicaAutoBalance == value:
-            break
-        time.sleep(RETRY_INTERVAL)
+    volume = wait_for_longhorn_object(
+        "volumes", volume_name,
+        lambda: client.by_id_volume(volume_name),
+        lambda v: v.replicaAutoBalance == value)
     assert volume.replicaAutoBalance == value
     return volume
 
@@ -2379,22 +2674,20 @@ def wait_for_engine_image_creation(client, image_name):
 
 def wait_for_engine_image_state(client, image_name, state):
     wait_for_engine_image_creation(client, image_name)
-    for i in range(RETRY_COUNTS):
-        image = client.by_id_engine_image(image_name)
-        if image.state == state:
-            break
-        time.sleep(RETRY_INTERVAL)
+    image = wait_for_longhorn_object(
+        "engineimages", image_name,
+        lambda: client.by_id_engine_image(image_name),
+        lambda i: i.state == state)
     assert image.state == state
     return image
 
 
 def wait_for_engine_image_incompatible(client, image_name):
     wait_for_engine_image_creation(client, image_name)
-    for i in range(RETRY_COUNTS):
-        image = client.by_id_engine_image(image_name)
-        if image.incompatible:
-            break
-        time.sleep(RETRY_INTERVAL)
+    image = wait_for_longhorn_object(
+        "engineimages", image_name,
+        lambda: client.by_id_engine_image(image_name),
+        lambda i: i.incompatible)
     assert image.incompatible
     return image
 
@@ -2427,11 +2720,10 @@ def wait_for_engine_image_condition(client, image_name, state):
 
 def wait_for_engine_image_ref_count(client, image_name, count):
     wait_for_engine_image_creation(client, image_name)
-    for i in range(RETRY_COUNTS):
-        image = client.by_id_engine_image(image_name)
-        if image.refCount == count:
-            break
-        time.sleep(RETRY_INTERVAL)
+    image = wait_for_longhorn_object(
+        "engineimages", image_name,
+        lambda: client.by_id_engine_image(image_name),
+        lambda i: i.refCount == count)
     assert image.refCount == count, f"image = {image}"
     if count == 0:
         assert image.noRefSince != ""
@@ -2659,9 +2951,7 @@ def wait_for_replica_failed(client, volname, replica_name,
 
 
 def wait_for_replica_running(client, volname, replica_name):
-    is_running = False
-    for i in range(RETRY_COUNTS):
-        volume = client.by_id_volume(volname)
+    def is_running(volume):
         for r in volume.replicas:
             if r['name'] != replica_name:
                 continue
@@ -2678,12 +2968,15 @@ def wait_for_replica_running(client, volname, replica_name):
                     instance_dict.update(im['instanceReplicas'])
 
                 if r['name'] in instance_dict:
-                    is_running = True
-                    break
-        if is_running:
-            break
-        time.sleep(RETRY_INTERVAL)
-    assert is_running
+                    return True
+        return False
+
+    # the instance manager state isn't reflected in the volume, poll
+    volume = wait_for_longhorn_object(
+        None, volname,
+        lambda: client.by_id_volume(volname),
+        is_running)
+    assert is_running(volume)
 
 
 def wait_for_replica_scheduled(client, volume_name, to_nodes,
@@ -2803,9 +3096,49 @@ def get_compatibility_test_image(cli_v, cli_minv,
                                      data_v, data_minv)
 
 
+def draw_random_bytes(rand, count):
+    data = b""
+    while len(data) < count:
+        data += rand.randbytes(count - len(data)).translate(
+            RANDOM_DATA_TABLE, RANDOM_DATA_REJECTED)
+    return data
+
+
 def generate_random_data(count):
-    return ''.join(random.choice(string.ascii_lowercase + string.digits)
-                   for _ in range(count))
+    return draw_random_bytes(random, count).decode()
+
+
+def generate_random_seed():
+    return random.getrandbits(64)
+
+
+def generate_random_stream(seed, size, chunk_size=DEVICE_CHECKSUM_EXTENT_SIZE):
+    """
+    Yield size random bytes out of RANDOM_DATA_CHARS in chunks of at most
+    chunk_size. The stream of a seed can be generated again to verify the
+    written data instead of keeping it in memory.
+    """
+    rand = random.Random(seed)
+    while size > 0:
+        count = min(size, chunk_size)
+        yield draw_random_bytes(rand, count)
+        size -= count
+
+
+def write_device_random_stream(dev, start, size, seed):
+    offset = start
+    for chunk in generate_random_stream(seed, size):
+        offset += dev_write(dev, offset, chunk)
+    return offset - start
+
+
+def check_device_random_stream(dev, start, size, seed):
+    offset = start
+    for chunk in generate_random_stream(seed, size):
+        r_data = dev_read(dev, offset, len(chunk))
+        assert r_data == chunk, \
+            f"data of {dev} at offset {offset} doesn't match seed {seed}"
+        offset += len(chunk)
 
 
 def check_volume_data(volume, data, check_checksum=True):
@@ -2819,11 +3152,17 @@ def write_volume_random_data(volume, position={}):
 
 
 def check_device_data(dev, data, check_checksum=True):
-    r_data = dev_read(dev, data['pos'], data['len'])
-    assert r_data == bytes(data['content'], encoding='utf8')
+    if 'seed' in data:
+        check_device_random_stream(dev, data['pos'], data['len'],
+                                   data['seed'])
+    else:
+        r_data = dev_read(dev, data['pos'], data['len'])
+        assert r_data == bytes(data['content'], encoding='utf8')
     if check_checksum:
         r_checksum = get_device_checksum(dev)
-        assert r_checksum == data['checksum']
+        assert r_checksum == data['checksum'], \
+            f"first different extent of {dev} at offset " \
+            f"{get_first_different_extent(data['checksum'], r_checksum)}"
 
 
 def write_device_random_data(dev, position={}):
@@ -2841,27 +3180,89 @@ def write_device_random_data(dev, position={}):
 
 
 def write_volume_data(volume, data):
+    """
+    Write data['content'] at data['pos'], or if data has a 'seed' instead,
+    the data['len'] bytes of its random stream, see generate_random_stream().
+    """
     dev = get_volume_endpoint(volume)
-    data_len = dev_write(dev, data['pos'], data['content'])
+    if 'seed' in data:
+        data_len = write_device_random_stream(dev, data['pos'], data['len'],
+                                              data['seed'])
+        written = {'seed': data['seed']}
+    else:
+        data_len = dev_write(dev, data['pos'], data['content'])
+        written = {'content': data['content']}
     checksum = get_device_checksum(dev)
 
-    return {
-        'content': data['content'],
+    written.update({
         'pos': data['pos'],
         'len': data_len,
         'checksum': checksum
-    }
+    })
+    return written
+
+
+# device checksum -> digests of its extents, to tell where two device data
+# differ when a checksum check fails
+device_extent_digests = {}
+
+
+def get_device_extent_digests(dev, extent_size=DEVICE_CHECKSUM_EXTENT_SIZE):
+    """
+    Return the blake2b digests of every extent_size extent of the device.
+    The device is read with direct I/O into a page aligned buffer, one
+    extent per read, so the data really comes from the volume and not from
+    the page cache of the node.
+    """
+    digests = []
+    buf = mmap.mmap(-1, extent_size)
+    try:
+        fd = os.open(dev, os.O_RDONLY | os.O_DIRECT)
+    except OSError:
+        # e.g. a regular file on tmpfs
+        fd = os.open(dev, os.O_RDONLY)
+    try:
+        offset = 0
+        while True:
+            length = 0
+            while length < extent_size:
+                n = os.preadv(fd, [memoryview(buf)[length:]], offset + length)
+                if n == 0:
+                    break
+                length += n
+            if length == 0:
+                break
+            digests.append(hashlib.blake2b(memoryview(buf)[:length],
+                                           digest_size=16).digest())
+            offset += length
+            if length < extent_size:
+                break
+    finally:
+        os.close(fd)
+        buf.close()
+    return digests
 
 
 def get_device_checksum(dev):
-    hash = hashlib.sha512()
+    digests = get_device_extent_digests(dev)
+    checksum = hashlib.blake2b(b"".join(digests)).hexdigest()
+    device_extent_digests[checksum] = digests
+    return checksum
 
-    with open(dev, 'rb') as fdev:
-        if fdev is not None:
-            for chunk in iter(lambda: fdev.read(4096), b""):
-                hash.update(chunk)
 
-    return hash.hexdigest()
+def get_first_different_extent(checksum, other_checksum):
+    """
+    Return the offset of the first extent that differs between two device
+    checksums returned by get_device_checksum, or None if unknown.
+    """
+    digests = device_extent_digests.get(checksum)
+    other_digests = device_extent_digests.get(other_checksum)
+    if digests is None or other_digests is None:
+        return None
+    for i, (digest, other_digest) in enumerate(zip(digests, other_digests)):
+        if digest != other_digest:
+            return i * DEVICE_CHECKSUM_EXTENT_SIZE
+    return min(len(digests), len(other_digests)) * DEVICE_CHECKSUM_EXTENT_SIZE
 
 
 def volume_read(v, start, count):
@@ -2870,13 +3271,11 @@ def volume_read(v, start, count):
 
 
 def dev_read(dev, start, count):
-    r_data = ""
-    fdev = open(dev, 'rb')
-    if fdev is not None:
-        fdev.seek(start)
-        r_data = fdev.read(count)
-        fdev.close()
-    return r_data
+    fd = os.open(dev, os.O_RDONLY)
+    try:
+        return os.pread(fd, count, start)
+    finally:
+        os.close(fd)
 
 
 def volume_write(v, start, data):
@@ -2885,14 +3284,16 @@ def volume_write(v, start, data):
 
 
 def dev_write(dev, start, data):
-    data = bytes(data, encoding='utf-8')
-    w_length = 0
-    fdev = open(dev, 'rb+')
-    if fdev is not None:
-        fdev.seek(start)
-        fdev.write(data)
-        fdev.close()
-        w_length = len(data)
+    if isinstance(data, str):
+        data = bytes(data, encoding='utf-8')
+    fd = os.open(dev, os.O_RDWR)
+    try:
+        view = memoryview(data)
+        w_length = 0
+        while w_length < len(view):
+            w_length += os.pwrite(fd, view[w_length:], start + w_length)
+    finally:
+        os.close(fd)
     return w_length
 
 
@@ -3465,7 +3866,8 @@ def wait_for_backup_volume_backing_image_synced(
 def wait_for_backup_completion(client, volume_name, snapshot_name=None,
                                retry_count=RETRY_BACKUP_COUNTS):
     completed = False
-    for _ in range(retry_count):
+    for _ in RETRY_POLICY_BACKUP.attempts(
+            retry_count * RETRY_BACKUP_INTERVAL):
         v = client.by_id_volume(volume_name)
         for b in v.backupStatus:
             if snapshot_name is not None and b.snapshot != snapshot_name:
@@ -3475,7 +3877,6 @@ def wait_for_backup_completion(client, volume_name, snapshot_name=None,
                 break
         if completed:
             break
-        time.sleep(RETRY_BACKUP_INTERVAL)
     assert completed is True, f" Backup status = {b.state}," \
                               f" Backup Progress = {b.progress}, Volume = {v}"
     return v
@@ -3484,7 +3885,8 @@ def wait_for_backup_completion(client, volume_name, snapshot_name=None,
 def wait_for_backup_failed(client, volume_name, snapshot_name=None,
                            retry_count=RETRY_BACKUP_COUNTS):
     failed = False
-    for _ in range(retry_count):
+    for _ in RETRY_POLICY_BACKUP.attempts(
+            retry_count * RETRY_BACKUP_INTERVAL):
         v = client.by_id_volume(volume_name)
         for b in v.backupStatus:
             if b.state == "Error":
@@ -3494,7 +3896,6 @@ def wait_for_backup_failed(client, volume_name, snapshot_name=None,
                 break
         if failed:
             break
-        time.sleep(RETRY_BACKUP_INTERVAL)
     assert failed is True
     return v
 
@@ -3531,7 +3932,8 @@ def wait_for_backup_to_start(client, volume_name, snapshot_name=None,
                              retry_count=RETRY_BACKUP_COUNTS,
                              chk_progress=0):
     in_progress = False
-    for _ in range(retry_count):
+    for _ in RETRY_POLICY_BACKUP.attempts(
+            retry_count * RETRY_BACKUP_INTERVAL):
         v = client.by_id_volume(volume_name)
         for b in v.backupStatus:
             if snapshot_name is not None and b.snapshot != snapshot_name:
@@ -3542,7 +3944,6 @@ def wait_for_backup_to_start(client, volume_name, snapshot_name=None,
                 break
         if in_progress:
             break
-        time.sleep(RETRY_BACKUP_INTERVAL)
     assert in_progress is True
     return v
 
@@ -3550,7 +3951,8 @@ def wait_for_backup_to_start(client, volume_name, snapshot_name=None,
 def wait_for_backup_state(client, volume_name, predicate,
                           retry_count=RETRY_BACKUP_COUNTS):
     completed = False
-    for i in range(retry_count):
+    for _ in RETRY_POLICY_BACKUP.attempts(
+            retry_count * RETRY_BACKUP_INTERVAL):
         v = client.by_id_volume(volume_name)
         for b in v.backupStatus:
             if predicate(b):
@@ -3558,7 +3960,6 @@ def wait_for_backup_state(client, volume_name, predicate,
                 break
         if completed:
             break
-        time.sleep(RETRY_BACKUP_INTERVAL)
     assert completed is True
     return v
 
@@ -3940,7 +4341,123 @@ def reset_disks_for_all_nodes(client, add_block_disks=False):  # NOQA
                                  expected_reserved_storage)
 
 
-def reset_settings(client):
+# Setting values right after the first full reset of the session, and the
+# settings updated through a Longhorn client since the last reset.
+setting_initial_values = {}
+dirty_settings = set()
+settings_lock = threading.Lock()
+
+SETTINGS_RESTORE_WORKERS = 8
+
+
+def mark_settings_dirty(names):
+    with settings_lock:
+        dirty_settings.update(names)
+
+
+def track_setting_updates(client):
+    """
+    Record the settings updated through the client, so reset_settings()
+    only needs to restore those.
+    """
+    update = client.update
+    update_by_id = client.update_by_id
+
+    def tracked_update(obj, *args, **kw):
+        if getattr(obj, "type", None) == "setting":
+            mark_settings_dirty([obj.name])
+        return update(obj, *args, **kw)
+
+    def tracked_update_by_id(type, id, *args, **kw):
+        if type == "setting":
+            mark_settings_dirty([id])
+        return update_by_id(type, id, *args, **kw)
+
+    client.update = tracked_update
+    client.update_by_id = tracked_update_by_id
+
+
+def restore_setting(client, name, value):
+    """
+    Update the setting back to value and read it back.
+    Return True if the setting has the value.
+    """
+    try:
+        setting = client.by_id_setting(name)
+        if setting.value != value:
+            client.update(setting, value=value)
+        for _ in range(RETRY_COUNTS_SHORT):
+            if client.by_id_setting(name).value == value:
+                return True
+            time.sleep(RETRY_INTERVAL_SHORT)
+    except Exception as e:
+        print(f"\nException when restoring {name} to value: {value}")
+        print(e)
+    return False
+
+
+def get_drifted_settings(values):
+    """
+    Return the names of the settings whose value in values differs from
+    their value after the first reset of the session.
+    """
+    with settings_lock:
+        initial_values = dict(setting_initial_values)
+    return [name for name, value in values.items()
+            if name in initial_values and name not in IGNORED_SETTINGS and
+            initial_values[name] != value]
+
+
+def reset_settings(client, full=False, names=()):
+    """
+    Restore the settings updated since the last reset, and the given names,
+    to their values after the first reset of the session, concurrently.
+
+    The first call, or a call with full=True, resets every writable setting
+    to its default instead. So does a call after which some setting still
+    differs from its initial value, e.g. one changed behind the client's
+    back.
+    """
+    with settings_lock:
+        initial_values = dict(setting_initial_values)
+        dirty = set(dirty_settings)
+
+    if not full and initial_values:
+        restore_settings(client, initial_values, dirty | set(names))
+        drifted = get_drifted_settings(
+            {s.name: s.value for s in client.list_setting()})
+        if not drifted:
+            return
+        print(f"\nSettings {drifted} still differ, resetting all settings")
+
+    reset_all_settings(client)
+    values = {s.name: s.value for s in client.list_setting()}
+    with settings_lock:
+        setting_initial_values.clear()
+        setting_initial_values.update(values)
+        dirty_settings.clear()
+
+
+def restore_settings(client, initial_values, names):
+    names = sorted(name for name in names if name in initial_values)
+    if not names:
+        return
+
+    with ThreadPoolExecutor(max_workers=SETTINGS_RESTORE_WORKERS) as executor:
+        restored = list(executor.map(
+            lambda name: restore_setting(client, name, initial_values[name]),
+            names))
+
+    # restoring marked them dirty again, keep only the failed ones
+    failed = [name for name, ok in zip(names, restored) if not ok]
+    with settings_lock:
+        dirty_settings.difference_update(names)
+        dirty_settings.update(failed)
+    if failed:
+        print(f"\nFailed to restore settings {failed}")
+
+
+def reset_all_settings(client):
 
     for setting in client.list_setting():
         setting_name = setting.name
@@ -5137,7 +5654,7 @@ def wait_for_expansion_failure(client, volume_name, last_failed_at=""):
 def wait_for_rebuild_complete(client, volume_name, retry_count=RETRY_COUNTS):
     completed = 0
     rebuild_statuses = {}
-    for i in range(retry_count):
+    for _ in RETRY_POLICY_REBUILD.attempts(retry_count * RETRY_INTERVAL):
         completed = 0
         v = client.by_id_volume(volume_name)
         rebuild_statuses = v.rebuildStatus
@@ -5159,7 +5676,6 @@ def wait_for_rebuild_complete(client, volume_name, retry_count=RETRY_COUNTS):
                 assert not status.isRebuilding
         if completed == len(rebuild_statuses):
             break
-        time.sleep(RETRY_INTERVAL)
     assert completed == len(rebuild_statuses)
 
 
@@ -5167,7 +5683,9 @@ def wait_for_rebuild_start(client, volume_name,
                            retry_count=RETRY_COUNTS,
                            retry_interval=RETRY_INTERVAL):
     started = False
-    for i in range(retry_count):
+    # rebuilding can be short, never poll slower than retry_interval
+    policy = RetryPolicy(retry_count * retry_interval, retry_interval)
+    for _ in policy.attempts():
         v = client.by_id_volume(volume_name)
         rebuild_statuses = v.rebuildStatus
         for status in rebuild_statuses:
@@ -5176,7 +5694,6 @@ def wait_for_rebuild_start(client, volume_name,
                 break
         if started:
             break
-        time.sleep(retry_interval)
     assert started
     return status.fromReplicaList, status.replica
 
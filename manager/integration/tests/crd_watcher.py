@@ -0,0 +1,200 @@
+import os
+import threading
+import time
+import warnings
+
+from kubernetes import client as k8sclient, watch as k8swatch
+from kubernetes.client.rest import ApiException
+
+LONGHORN_GROUP = "longhorn.io"
+LONGHORN_VERSION = "v1beta2"
+LONGHORN_NAMESPACE = "longhorn-system"
+
+# Longhorn CRDs the waiters in common.py can be woken up by.
+WATCHED_PLURALS = ["volumes", "replicas", "engines", "engineimages"]
+
+# The volume REST object (robustness, replicas, endpoint ...) is derived
+# from its replicas and engines, so their events also wake up the waiters
+# of the volume they belong to.
+FORWARDED_PLURALS = {"volumes": ["replicas", "engines"]}
+
+WATCH_TIMEOUT_SECONDS = 300
+WATCH_RETRY_INTERVAL = 2
+
+# Without a watch event a waiter still re-checks its object at this interval
+# in case the stream missed something.
+WATCH_RESYNC_INTERVAL = 10
+
+
+def is_crd_watch_enabled():
+    return os.environ.get("LONGHORN_WATCH_WAITERS", "true") == "true"
+
+
+class CRDWatcher:
+    """
+    Stream watch events of a Longhorn CRD in a background thread and
+    wake up the threads waiting for changes on a given object.
+
+    Every event bumps a per-name counter. A waiter reads the counter before
+    checking its object and then blocks in wait_for_change() until the
+    counter moves or the timeout expires, so no event can be missed between
+    the check and the wait.
+    """
+
+    def __init__(self, plural, namespace=LONGHORN_NAMESPACE):
+        self.plural = plural
+        self.namespace = namespace
+        self._cond = threading.Condition()
+        self._versions = {}
+        self._synced = False
+        self._thread = None
+        # watchers also notified of the events of this one
+        self._forward_to = []
+        # watchers forwarding their events to this one
+        self._sources = []
+
+    def forward_to(self, watcher):
+        with self._cond:
+            self._forward_to.append(watcher)
+        with watcher._cond:
+            watcher._sources.append(self)
+
+    def start(self):
+        with self._cond:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, daemon=True,
+                                            name=f"crd-watch-{self.plural}")
+            self._thread.start()
+
+    def is_synced(self):
+        # events of an unsynced source could be missed as well
+        return self._synced and \
+            all(source.is_synced() for source in self._sources)
+
+    def version(self, name):
+        with self._cond:
+            return self._versions.get(name, 0)
+
+    def wait_for_change(self, name, version, timeout):
+        """
+        Block until an event for the object name arrives after version was
+        read, or until timeout seconds elapsed.
+        Return True if the object changed.
+        """
+        deadline = time.time() + timeout
+        with self._cond:
+            while self._versions.get(name, 0) == version:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self.is_synced():
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def _notify(self, names):
+        with self._cond:
+            for name in names:
+                if name:
+                    self._versions[name] = self._versions.get(name, 0) + 1
+            self._cond.notify_all()
+            forward_to = list(self._forward_to)
+        for watcher in forward_to:
+            watcher._notify(names)
+
+    def _set_synced(self, synced):
+        with self._cond:
+            self._synced = synced
+            # wake everyone up so they fall back to polling
+            self._cond.notify_all()
+            forward_to = list(self._forward_to)
+        for watcher in forward_to:
+            with watcher._cond:
+                watcher._cond.notify_all()
+
+    @staticmethod
+    def _event_names(obj):
+        metadata = obj.get("metadata", {})
+        labels = metadata.get("labels") or {}
+        spec = obj.get("spec") or {}
+        return {metadata.get("name"),
+                labels.get("longhornvolume"),
+                spec.get("volumeName")}
+
+    def _run(self):
+        api = k8sclient.CustomObjectsApi()
+        resource_version = None
+        while True:
+            w = k8swatch.Watch()
+            try:
+                if resource_version is None:
+                    resp = api.list_namespaced_custom_object(
+                        LONGHORN_GROUP, LONGHORN_VERSION, self.namespace,
+                        self.plural)
+                    resource_version = resp["metadata"]["resourceVersion"]
+                    names = set()
+                    for item in resp["items"]:
+                        names |= self._event_names(item)
+                    self._notify(names)
+                    self._set_synced(True)
+
+                for event in w.stream(
+                        api.list_namespaced_custom_object,
+                        LONGHORN_GROUP, LONGHORN_VERSION, self.namespace,
+                        self.plural, resource_version=resource_version,
+                        timeout_seconds=WATCH_TIMEOUT_SECONDS):
+                    obj = event["object"]
+                    if event["type"] == "ERROR":
+                        # most likely 410 Gone, relist from scratch
+                        resource_version = None
+                        break
+                    resource_version = \
+                        obj["metadata"].get("resourceVersion",
+                                            resource_version)
+                    self._notify(self._event_names(obj))
+            except ApiException as e:
+                warnings.warn(f"Watching {self.plural} failed: {e.reason}")
+                resource_version = None
+                self._set_synced(False)
+                time.sleep(WATCH_RETRY_INTERVAL)
+            except Exception as e:
+                warnings.warn(f"Watching {self.plural} failed: {e}")
+                resource_version = None
+                self._set_synced(False)
+                time.sleep(WATCH_RETRY_INTERVAL)
+            finally:
+                w.stop()
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def _get_started_watcher(plural):
+    with _watchers_lock:
+        watcher = _watchers.get(plural)
+        if watcher is None:
+            watcher = CRDWatcher(plural)
+            for forwarded in FORWARDED_PLURALS.get(plural, []):
+                source = _watchers.get(forwarded)
+                if source is None:
+                    source = CRDWatcher(forwarded)
+                    _watchers[forwarded] = source
+                source.forward_to(watcher)
+                source.start()
+            watcher.start()
+            _watchers[plural] = watcher
+    return watcher
+
+
+def get_crd_watcher(plural):
+    """
+    Return the started watcher of a Longhorn CRD, or None if the waiters
+    should fall back to plain polling.
+    """
+    if not is_crd_watch_enabled() or plural not in WATCHED_PLURALS:
+        return None
+
+    watcher = _get_started_watcher(plural)
+    if not watcher.is_synced():
+        return None
+    return watcher
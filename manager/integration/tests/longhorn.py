@@ -5,12 +5,14 @@ import six
 import re
 import requests
 import collections
+import copy
 import hashlib
 import os
 import json
+import threading
 import time
 import operator
-from functools import reduce
+from functools import partial, reduce
 
 try:
     import argcomplete
@@ -53,6 +55,34 @@ LIST_METHODS = {'__iter__': True, '__len__': True, '__getitem__': True}
 
 DEFAULT_TIMEOUT = 45
 
+# All clients of the process share one keep-alive connection pool, and the
+# schema of a given manager URL is only downloaded and parsed once.
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 32
+
+_session = None
+_schemas = {}
+_shared_lock = threading.Lock()
+
+
+def get_session():
+    global _session
+    with _shared_lock:
+        if _session is None:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=POOL_CONNECTIONS,
+                pool_maxsize=POOL_MAXSIZE)
+            session = requests.Session()
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _session = session
+        return _session
+
+
+def clear_schema_cache():
+    with _shared_lock:
+        _schemas.clear()
+
 
 def echo(fn):
     def wrapped(*args, **kw):
@@ -76,8 +106,22 @@ def timed_url(fn):
 
 
 class RestObject:
-    def __init__(self):
-        pass
+    # The decoded fields live in __dict__. The owning client is kept in a
+    # slot so it never shows up in vars(), len() or iteration of the object.
+    # Links and actions are not stored either, so unlike the closures once
+    # set on every object they don't count in len(), iteration, keys() or
+    # vars(), only the decoded fields do.
+    __slots__ = ('__dict__', '_client')
+
+    def __init__(self, client=None):
+        self._client = client
+
+    def __deepcopy__(self, memo):
+        # share the client, only the decoded fields are copied
+        result = RestObject(self._client)
+        memo[id(self)] = result
+        result.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return result
 
     @staticmethod
     def _is_public(k, v):
@@ -129,10 +173,54 @@ class RestObject:
         return self.__dict__[key]
 
     def __getattr__(self, k):
+        if k.startswith('_'):
+            return getattr(self.__dict__, k)
         if self._is_list() and k in LIST_METHODS:
             return getattr(self.data, k)
+        bound = self._bind(k)
+        if bound is not None:
+            return bound
         return getattr(self.__dict__, k)
 
+    def _is_taken(self, k):
+        return k in self.__dict__ or hasattr(dict, k)
+
+    def _bind(self, k):
+        # Links, actions and pagination are bound to the client on access
+        # rather than stored as closures on every decoded object. A name
+        # that is already taken by a field is exposed with a '_link' or
+        # '_action' suffix instead.
+        client = self._client
+        if client is None:
+            return None
+
+        values = self.__dict__
+        pagination = values.get('pagination')
+        if k in ('next', 'prev') and isinstance(pagination, RestObject):
+            url = pagination.__dict__.get(k)
+            if url is not None:
+                return partial(client._get, url)
+
+        if not isinstance(values.get('type'), six.string_types):
+            return None
+
+        links = values.get('links')
+        links = links.__dict__ if isinstance(links, RestObject) else {}
+        actions = values.get('actions')
+        actions = actions.__dict__ if isinstance(actions, RestObject) else {}
+
+        if k in links and not self._is_taken(k):
+            return partial(client._get_link, links[k])
+        if k.endswith('_link') and k[:-5] in links and \
+                self._is_taken(k[:-5]):
+            return partial(client._get_link, links[k[:-5]])
+        if k in actions and k not in links and not self._is_taken(k):
+            return partial(client.action, self, k)
+        if k.endswith('_action') and k[:-7] in actions and \
+                (k[:-7] in links or self._is_taken(k[:-7])):
+            return partial(client.action, self, k[:-7])
+        return None
+
     def __iter__(self):
         if self._is_list():
             return iter(self.data)
@@ -206,7 +294,8 @@ class ClientApiError(Exception):
 
 class GdapiClient(object):
     def __init__(self, access_key="", secret_key="", url=None, cache=False,
-                 cache_time=86400, strict=False, headers=HEADERS, **kw):
+                 cache_time=86400, strict=False, headers=HEADERS,
+                 session=None, **kw):
         self._headers = headers
         self._access_key = access_key
         self._secret_key = secret_key
@@ -216,7 +305,7 @@ class GdapiClient(object):
         self._cache_time = cache_time
         self._strict = strict
         self.schema = None
-        self._session = requests.Session()
+        self._session = session if session is not None else get_session()
 
         if not self._cache_time:
             self._cache_time = 60 * 60 * 24  # 24 Hours
@@ -231,41 +320,10 @@ class GdapiClient(object):
             return [self.object_hook(x) for x in obj]
 
         if isinstance(obj, dict):
-            result = RestObject()
-
+            result = RestObject(self)
+            values = result.__dict__
             for k, v in six.iteritems(obj):
-                setattr(result, k, self.object_hook(v))
-
-            for link in ['next', 'prev']:
-                try:
-                    url = getattr(result.pagination, link)
-                    if url is not None:
-                        setattr(result, link, lambda url=url: self._get(url))
-                except AttributeError:
-                    pass
-
-            if hasattr(result, 'type') and isinstance(getattr(result, 'type'),
-                                                      six.string_types):
-                if hasattr(result, 'links'):
-                    for link_name, link in six.iteritems(result.links):
-                        def cb(_link=link, **kw):
-                            return self._get(_link, data=kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_link', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
-                if hasattr(result, 'actions'):
-                    for link_name, link in six.iteritems(result.actions):
-                        def cb(_link_name=link_name,
-                               _result=result, *args, **kw):
-                            return self.action(_result, _link_name,
-                                               *args, **kw)
-                        if hasattr(result, link_name):
-                            setattr(result, link_name + '_action', cb)
-                        else:
-                            setattr(result, link_name, cb)
-
+                values[k] = self.object_hook(v)
             return result
 
         return obj
@@ -279,6 +337,9 @@ class GdapiClient(object):
     def _get(self, url, data=None):
         return self._unmarshall(self._get_raw(url, data=data))
 
+    def _get_link(self, url, **kw):
+        return self._get(url, data=kw)
+
     def _error(self, text, status_code):
         raise ApiError(self._unmarshall(text), status_code)
 
@@ -337,6 +398,23 @@ class GdapiClient(object):
         if self.schema and not force:
             return
 
+        key = (self._url, self._access_key)
+        schema = None
+        if not force:
+            with _shared_lock:
+                schema = _schemas.get(key)
+
+        if schema is None:
+            schema = self._fetch_schema(force)
+            if len(schema.types) > 0:
+                with _shared_lock:
+                    _schemas[key] = schema
+
+        if len(schema.types) > 0:
+            self._bind_methods(schema)
+            self.schema = schema
+
+    def _fetch_schema(self, force=False):
         schema_text = self._get_cached_schema()
 
         if force or not schema_text:
@@ -350,11 +428,7 @@ class GdapiClient(object):
 
         obj = self._unmarshall(schema_text)
 
-        schema = Schema(schema_text, obj)
-
-        if len(schema.types) > 0:
-            self._bind_methods(schema)
-            self.schema = schema
+        return Schema(schema_text, obj)
 
     def reload_schema(self):
         self._load_schemas(force=True)
@@ -1,9 +1,12 @@
 import pytest
 import requests
+import threading
 import time
 import ipaddress
 
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from kubernetes.stream import stream
 from prometheus_client.parser import text_string_to_metric_families
 
@@ -78,13 +81,61 @@ longhorn_volume_robustness = {
 }
 
 
-def get_metrics(core_api, metric_node_id): # NOQA
-    pods = core_api.list_namespaced_pod(namespace=LONGHORN_NAMESPACE,
-                                        label_selector="app=longhorn-manager")
-    for po in pods.items:
-        if po.spec.node_name == metric_node_id:
-            manager_ip = po.status.pod_ip
-            break
+METRICS_SCRAPE_TIMEOUT = 10
+
+# longhorn-manager pod ip by node, refreshed when a scrape can't connect
+manager_ips = {}
+# last scrape of each node, reused by checks that accept it
+metrics_scrapes = {}
+metrics_lock = threading.Lock()
+
+
+class MetricsScrape:
+    """
+    Parsed /metrics of a longhorn-manager. It iterates over the metric
+    families like text_string_to_metric_families(), and indexes the samples
+    by name, and by name and their exact set of labels.
+    """
+
+    def __init__(self, text):
+        self.scraped_at = time.time()
+        self.families = list(text_string_to_metric_families(text))
+        self.samples = defaultdict(list)
+        self.samples_by_labels = {}
+        for family in self.families:
+            for sample in family.samples:
+                self.samples[sample.name].append(sample)
+                key = (sample.name, frozenset(sample.labels.items()))
+                self.samples_by_labels[key] = sample
+
+    def __iter__(self):
+        return iter(self.families)
+
+    def get_sample(self, metric_name, labels):
+        return self.samples_by_labels.get(
+            (metric_name, frozenset(labels.items())))
+
+
+def find_metric_by_labels(metric_data, metric_name, metric_labels):
+    """
+    Return the sample whose labels are exactly metric_labels, or None.
+    """
+    if not isinstance(metric_data, MetricsScrape):
+        return None
+    return metric_data.get_sample(metric_name, metric_labels)
+
+
+def get_manager_ip(core_api, metric_node_id, refresh=False): # NOQA
+    with metrics_lock:
+        # a pod just recreated may have no ip yet, list again until it has
+        if refresh or not manager_ips.get(metric_node_id):
+            pods = core_api.list_namespaced_pod(
+                namespace=LONGHORN_NAMESPACE,
+                label_selector="app=longhorn-manager")
+            manager_ips.clear()
+            for po in pods.items:
+                manager_ips[po.spec.node_name] = po.status.pod_ip
+        manager_ip = manager_ips.get(metric_node_id)
 
     if not manager_ip:
         raise RuntimeError(
@@ -95,11 +146,48 @@ def get_metrics(core_api, metric_node_id): # NOQA
     ip_obj = ipaddress.ip_address(manager_ip)
     if ip_obj.version == 6:
         manager_ip = f"[{manager_ip}]"
+    return manager_ip
+
 
-    metrics = requests.get("http://{}:9500/metrics".format(manager_ip)).content
-    string_data = metrics.decode('utf-8')
-    result = text_string_to_metric_families(string_data)
-    return result
+def get_metrics(core_api, metric_node_id, since=None): # NOQA
+    """
+    Scrape the metrics of the longhorn-manager on the node.
+    If since is given, the last scrape is returned if it is not older.
+    """
+    if since is not None:
+        with metrics_lock:
+            scrape = metrics_scrapes.get(metric_node_id)
+        if scrape is not None and scrape.scraped_at >= since:
+            return scrape
+
+    for refresh in [False, True]:
+        manager_ip = get_manager_ip(core_api, metric_node_id, refresh=refresh)
+        try:
+            metrics = requests.get(
+                "http://{}:9500/metrics".format(manager_ip),
+                timeout=METRICS_SCRAPE_TIMEOUT).content
+            break
+        except requests.exceptions.ConnectionError:
+            # the manager pod may have been recreated with another ip
+            if refresh:
+                raise
+
+    scrape = MetricsScrape(metrics.decode('utf-8'))
+    with metrics_lock:
+        metrics_scrapes[metric_node_id] = scrape
+    return scrape
+
+
+def get_metrics_on_nodes(core_api, metric_node_ids, since=None): # NOQA
+    """
+    Scrape the longhorn-managers on the nodes concurrently.
+    """
+    if not metric_node_ids:
+        return []
+    with ThreadPoolExecutor(max_workers=len(metric_node_ids)) as executor:
+        return list(executor.map(
+            lambda node_id: get_metrics(core_api, node_id, since=since),
+            metric_node_ids))
 
 
 def find_metric(metric_data, metric_name):
@@ -107,6 +195,9 @@ def find_metric(metric_data, metric_name):
 
 
 def find_metrics(metric_data, metric_name):
+    if isinstance(metric_data, MetricsScrape):
+        return list(metric_data.samples.get(metric_name, []))
+
     metrics = []
 
     # Find the metric with the given name in the provided metric data
@@ -118,7 +209,37 @@ def find_metrics(metric_data, metric_name):
     return metrics
 
 
-def check_metric_with_condition(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id()): # NOQA)
+def wait_for_metrics(checks):
+    """
+    Wait until all the checks pass. The checks are check_metric* calls
+    missing their since argument, e.g. with functools.partial, so all the
+    pending ones share one scrape per node and interval.
+    """
+    for _ in range(RETRY_COUNTS):
+        time.sleep(RETRY_INTERVAL)
+        since = time.time()
+
+        pending = []
+        for check in checks:
+            try:
+                check(since=since)
+            except AssertionError:
+                pending.append(check)
+            except (requests.exceptions.RequestException,
+                    RuntimeError) as e:
+                # e.g. a scrape timing out, or a restarted manager pod
+                # without an ip yet, try again on the next interval
+                print(f"\nException when checking metrics: {e}")
+                pending.append(check)
+        checks = pending
+        if not checks:
+            return
+
+    for check in checks:
+        check()
+
+
+def check_metric_with_condition(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id(), since=None): # NOQA)
     """
     Some metric have multiple conditions, for example metric
     longhorn_node_status have condition
@@ -131,12 +252,11 @@ def check_metric_with_condition(core_api, metric_name, metric_labels, expected_v
     - schedulable
     Use this function to get specific condition of a mertic
     """
-    metric_data = get_metrics(core_api, metric_node_id)
+    metric_data = get_metrics(core_api, metric_node_id, since=since)
 
     found_metric = next(
-        (sample for family in metric_data for sample in family.samples
-            if sample.name == metric_name and
-            sample.labels.get("condition") == metric_labels.get("condition")),
+        (sample for sample in find_metrics(metric_data, metric_name)
+            if sample.labels.get("condition") == metric_labels.get("condition")), # NOQA
         None
         )
 
@@ -145,30 +265,30 @@ def check_metric_with_condition(core_api, metric_name, metric_labels, expected_v
     examine_metric_value(found_metric, metric_labels, expected_value)
 
 
-def check_metric(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id()): # NOQA
+def check_metric(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id(), since=None): # NOQA
     if metric_node_id is None:
         # Populate metric data from all nodes.
         client = get_longhorn_api_client()  # NOQA
         nodes = client.list_node()
         metric_data = []
-        for node in nodes:
-            metric_data.extend(get_metrics(core_api, node.id))
+        for scrape in get_metrics_on_nodes(core_api,
+                                           [node.id for node in nodes],
+                                           since=since):
+            metric_data.extend(scrape)
     else:
         # Populate metric data for the specified node.
-        metric_data = get_metrics(core_api, metric_node_id)
+        metric_data = get_metrics(core_api, metric_node_id, since=since)
 
-    found_metric = None
-    for family in metric_data:
-        found_metric = next((sample for sample in family.samples if sample.name == metric_name), None) # NOQA
-        if found_metric:
-            break
+    found_metric = find_metric_by_labels(metric_data, metric_name,
+                                         metric_labels) or \
+        next(iter(find_metrics(metric_data, metric_name)), None)
 
     assert found_metric is not None
 
     examine_metric_value(found_metric, metric_labels, expected_value)
 
 
-def check_metric_with_state(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id()): # NOQA
+def check_metric_with_state(core_api, metric_name, metric_labels, expected_value=None, metric_node_id=get_self_host_id(), since=None): # NOQA
     """
     Some metrics share the same name but have multiple samples with
     different labels.
@@ -178,7 +298,7 @@ def check_metric_with_state(core_api, metric_name, metric_labels, expected_value
     sample by matching the labels (especially `state`), not just take
     the first one.
     """
-    metric_data = get_metrics(core_api, metric_node_id)
+    metric_data = get_metrics(core_api, metric_node_id, since=since)
 
     def labels_match(sample, expected_labels):
         for k, v in expected_labels.items():
@@ -188,16 +308,13 @@ def check_metric_with_state(core_api, metric_name, metric_labels, expected_value
                 return False
         return True
 
-    found_metric = None
-    for family in metric_data:
-        for sample in family.samples:
-            if sample.name != metric_name:
-                continue
-            if labels_match(sample, metric_labels):
-                found_metric = sample
-                break
-        if found_metric:
-            break
+    found_metric = find_metric_by_labels(metric_data, metric_name,
+                                         metric_labels)
+    if found_metric is None:
+        # metric_labels may only be a part of the labels
+        found_metric = next((sample for sample
+                             in find_metrics(metric_data, metric_name)
+                             if labels_match(sample, metric_labels)), None)
 
     assert found_metric is not None, \
         f"Cannot find metric={metric_name} with labels={metric_labels}"
@@ -216,21 +333,11 @@ def examine_metric_value(found_metric, metric_labels, expected_value=None):
 
 
 def wait_for_metric_sum_on_all_nodes(client, core_api, metric_name, metric_labels, expected_value): # NOQA
-    for _ in range(RETRY_COUNTS):
-        time.sleep(RETRY_INTERVAL)
-
-        try:
-            check_metric_sum_on_all_nodes(client, core_api, metric_name,
-                                          metric_labels, expected_value)
-            return
-        except AssertionError:
-            continue
-
-    check_metric_sum_on_all_nodes(client, core_api, metric_name,
-                                  metric_labels, expected_value)
+    wait_for_metrics([partial(check_metric_sum_on_all_nodes, client, core_api,
+                              metric_name, metric_labels, expected_value)])
 
 
-def check_metric_sum_on_all_nodes(client, core_api, metric_name, expected_labels, expected_value=None): # NOQA
+def check_metric_sum_on_all_nodes(client, core_api, metric_name, expected_labels, expected_value=None, since=None): # NOQA
     # Initialize total_metrics to store the sum of the metric values.
     total_metrics = {"labels": defaultdict(None), "value": 0.0}
 
@@ -255,9 +362,8 @@ def check_metric_sum_on_all_nodes(client, core_api, metric_name, expected_labels
 
         raise AssertionError("Cannot find the metric matching the labels")
 
-    for node in client.list_node():
-        metric_data = get_metrics(core_api, node.name)
-
+    node_names = [node.name for node in client.list_node()]
+    for metric_data in get_metrics_on_nodes(core_api, node_names, since=since):
         metrics = find_metrics(metric_data, metric_name)
         if len(metrics) == 0:
             continue
@@ -290,20 +396,9 @@ def check_metric_sum_on_all_nodes(client, core_api, metric_name, expected_labels
 
 
 def wait_for_metric(core_api, metric_name, metric_labels, expected_value, metric_node_id=get_self_host_id()): # NOQA
-    for _ in range(RETRY_COUNTS):
-        time.sleep(RETRY_INTERVAL)
-
-        try:
-            check_metric(core_api, metric_name,
-                         metric_labels, expected_value,
-                         metric_node_id=metric_node_id)
-            return
-        except AssertionError:
-            continue
-
-    check_metric(core_api, metric_name,
-                 metric_labels, expected_value,
-                 metric_node_id=metric_node_id)
+    wait_for_metrics([partial(check_metric, core_api, metric_name,
+                              metric_labels, expected_value,
+                              metric_node_id=metric_node_id)])
 
 
 def wait_for_metric_volume_actual_size(client, core_api, metric_name, metric_labels, volume_name): # NOQA
@@ -324,21 +419,11 @@ def wait_for_metric_volume_actual_size(client, core_api, metric_name, metric_lab
 
 
 def wait_for_metric_count_all_nodes(client, core_api, metric_name, metric_labels, expected_count): # NOQA
-    for _ in range(RETRY_COUNTS):
-        time.sleep(RETRY_INTERVAL)
+    wait_for_metrics([partial(check_metric_count_all_nodes, client, core_api,
+                              metric_name, metric_labels, expected_count)])
 
-        try:
-            check_metric_count_all_nodes(client, core_api, metric_name,
-                                         metric_labels, expected_count)
-            return
-        except AssertionError:
-            continue
-
-    check_metric_count_all_nodes(client, core_api, metric_name,
-                                 metric_labels, expected_count)
 
-
-def check_metric_count_all_nodes(client, core_api, metric_name, metric_labels, expected_count): # NOQA
+def check_metric_count_all_nodes(client, core_api, metric_name, metric_labels, expected_count, since=None): # NOQA
     # Find the metrics based on the given labels.
     def filter_metrics_by_labels(metrics, labels):
         filtered_metrics = []
@@ -359,9 +444,8 @@ def check_metric_count_all_nodes(client, core_api, metric_name, metric_labels, e
         return filtered_metrics
 
     filtered_metrics = []
-    for node in client.list_node():
-        metric_data = get_metrics(core_api, node.name)
-
+    node_names = [node.name for node in client.list_node()]
+    for metric_data in get_metrics_on_nodes(core_api, node_names, since=since):
         metrics = find_metrics(metric_data, metric_name)
         if len(metrics) == 0:
             continue
@@ -418,20 +502,21 @@ def test_volume_metrics(client, core_api, volume_name, pvc_namespace): # NOQA
     wait_for_metric_volume_actual_size(client, core_api,
                                        "longhorn_volume_actual_size_bytes",
                                        metric_labels, volume_name)
+    since = time.time()
     check_metric(core_api, "longhorn_volume_capacity_bytes",
-                 metric_labels, capacity_size)
+                 metric_labels, capacity_size, since=since)
     check_metric(core_api, "longhorn_volume_read_throughput",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_volume_write_throughput",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_volume_read_iops",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_volume_write_iops",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_volume_read_latency",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_volume_write_latency",
-                 metric_labels)
+                 metric_labels, since=since)
 
     # verify longhorn_volume_robustness when volume is healthy,
     # degraded, faulted or unknown
@@ -645,14 +730,14 @@ def test_metric_longhorn_snapshot_actual_size_bytes(client, core_api, volume_nam
     create_snapshot(client, volume_name)
     create_snapshot(client, volume_name)
 
-    wait_for_metric_count_all_nodes(client, core_api,
-                                    "longhorn_snapshot_actual_size_bytes",
-                                    user_snapshot_metric_labels, 4)
-
+    checks = [partial(check_metric_count_all_nodes, client, core_api,
+                      "longhorn_snapshot_actual_size_bytes",
+                      user_snapshot_metric_labels, 4)]
     if DATA_ENGINE == "v1":
-        wait_for_metric_count_all_nodes(client, core_api,
-                                        "longhorn_snapshot_actual_size_bytes",
-                                        system_snapshot_metric_labels, 1)
+        checks.append(partial(check_metric_count_all_nodes, client, core_api,
+                              "longhorn_snapshot_actual_size_bytes",
+                              system_snapshot_metric_labels, 1))
+    wait_for_metrics(checks)
 
 
 def test_node_metrics(client, core_api): # NOQA
@@ -665,27 +750,30 @@ def test_node_metrics(client, core_api): # NOQA
             break
     assert default_disk is not None
 
+    # nothing changes until the node scheduling is disabled, so all the
+    # checks until then share one scrape
+    since = time.time()
     metric_labels = {}
     check_metric(core_api, "longhorn_node_count_total",
-                 metric_labels, expected_value=3.0)
+                 metric_labels, expected_value=3.0, since=since)
 
     metric_labels = {
         "node": lht_hostId,
     }
     check_metric(core_api, "longhorn_node_cpu_capacity_millicpu",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_node_cpu_usage_millicpu",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_node_memory_capacity_bytes",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_node_memory_usage_bytes",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_node_storage_capacity_bytes",
-                 metric_labels, default_disk.storageMaximum)
+                 metric_labels, default_disk.storageMaximum, since=since)
     check_metric(core_api, "longhorn_node_storage_usage_bytes",
-                 metric_labels)
+                 metric_labels, since=since)
     check_metric(core_api, "longhorn_node_storage_reservation_bytes",
-                 metric_labels, default_disk.storageReserved)
+                 metric_labels, default_disk.storageReserved, since=since)
 
     # check longhorn_node_status by 4 different conditions
     metric_labels = {
@@ -694,7 +782,7 @@ def test_node_metrics(client, core_api): # NOQA
         "node": lht_hostId
     }
     check_metric_with_condition(core_api, "longhorn_node_status",
-                                metric_labels, 1.0)
+                                metric_labels, 1.0, since=since)
 
     metric_labels = {
         "condition": "ready",
@@ -702,7 +790,7 @@ def test_node_metrics(client, core_api): # NOQA
         "node": lht_hostId
     }
     check_metric_with_condition(core_api, "longhorn_node_status",
-                                metric_labels, 1.0)
+                                metric_labels, 1.0, since=since)
 
     metric_labels = {
         "condition": "allowScheduling",
@@ -710,7 +798,7 @@ def test_node_metrics(client, core_api): # NOQA
         "node": lht_hostId,
     }
     check_metric_with_condition(core_api, "longhorn_node_status",
-                                metric_labels, 1.0)
+                                metric_labels, 1.0, since=since)
     node = client.by_id_node(lht_hostId)
     set_node_scheduling(client, node, allowScheduling=False, retry=True)
     check_metric_with_condition(core_api, "longhorn_node_status",
@@ -2148,7 +2148,7 @@ def test_replica_scheduler_rebuild_restore_is_too_big(set_random_backupstore, cl
         update_node_disks(client, node.name, disks=update_disks, retry=True)
 
     data = {'len': int(int(SIZE) * 0.9), 'pos': 0}
-    data['content'] = common.generate_random_data(data['len'])
+    data['seed'] = common.generate_random_seed()
     _, b, _, _ = common.create_backup(client, vol_name, data)
 
     # cannot schedule for restore volume
@@ -760,7 +760,8 @@ def test_recurring_jobs_allow_detached_volume(set_random_backupstore, client, co
 
     data = {
         'pos': 0,
-        'content': common.generate_random_data(50 * Mi),
+        'len': 50 * Mi,
+        'seed': common.generate_random_seed(),
     }
     common.write_volume_data(volume, data)
 
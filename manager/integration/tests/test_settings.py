@@ -10,6 +10,7 @@ from common import (  # NOQA
     get_core_api_client, get_apps_api_client,
     create_and_check_volume, cleanup_volume,
     wait_for_volume_healthy, wait_for_volume_detached,
+    wait_for_volumes_healthy,
     write_volume_random_data, check_volume_data,
     get_default_engine_image,
     wait_for_engine_image_state,
@@ -702,8 +703,8 @@ def test_setting_backing_image_auto_cleanup(client, core_api, volume_name):  # N
     for volume_name in volume_names:
         volume = client.by_id_volume(volume_name)
         volume.attach(hostId=lht_host_id)
-    for volume_name in volume_names:
-        volume = wait_for_volume_healthy(client, volume_name)
+    volumes = wait_for_volumes_healthy(client, volume_names)
+    for volume in volumes.values():
         assert volume.backingImage == BACKING_IMAGE_NAME
 
     backing_image = client.by_id_backing_image(BACKING_IMAGE_NAME)
@@ -850,8 +851,7 @@ def test_setting_concurrent_rebuild_limit(client, core_api, volume_name):  # NOQ
     wait_for_rebuild_complete(client, volume2_name)
 
     # Step 1-6
-    wait_for_volume_healthy(client, volume1_name)
-    wait_for_volume_healthy(client, volume2_name)
+    wait_for_volumes_healthy(client, [volume1_name, volume2_name])
 
     # Step 1-7
     delete_replica_on_test_node(client, volume1_name)
@@ -956,8 +956,7 @@ def test_setting_concurrent_rebuild_limit(client, core_api, volume_name):  # NOQ
 
     # Step 2-1
     # Step 2-2
-    wait_for_volume_healthy(client, volume1_name)
-    wait_for_volume_healthy(client, volume2_name)
+    wait_for_volumes_healthy(client, [volume1_name, volume2_name])
 
     volume2 = client.by_id_volume(volume2_name)
     lht_host_id = get_self_host_id()
@@ -9,7 +9,7 @@ from common import DEFAULT_POD_TIMEOUT, VOLUME_RWTEST_SIZE
 from common import delete_and_wait_statefulset, generate_random_data
 from common import get_apps_api_client, get_statefulset_pod_info
 from common import read_volume_data, size_to_string
-from common import wait_for_volume_detached, write_pod_volume_data
+from common import wait_for_volumes_detached, write_pod_volume_data
 from common import check_csi
 from common import create_and_wait_statefulset, wait_statefulset
 from common import update_statefulset_manifests, create_storage_class
@@ -431,7 +431,6 @@ def test_statefulset_restore(set_random_backupstore, client, core_api, storage_c
                                                   'statefulset-restore-test-2')
         pod['pvc_name'] = pod['pvc_name'].replace('statefulset-restore-test',
                                                   'statefulset-restore-test-2')
-        pv['metadata']['name'] = pod['pvc_name']
 
         client.create_volume(
             name=pod['pvc_name'],
@@ -440,8 +439,10 @@ def test_statefulset_restore(set_random_backupstore, client, core_api, storage_c
                 storage_class['parameters']['numberOfReplicas']),
             fromBackup=pod['backup_snapshot']['url'],
             dataEngine=DATA_ENGINE)
-        wait_for_volume_detached(client, pod['pvc_name'])
+    wait_for_volumes_detached(client, [pod['pvc_name'] for pod in pod_info])
 
+    for pod in pod_info:
+        pv['metadata']['name'] = pod['pvc_name']
         pv['spec']['csi']['volumeHandle'] = pod['pvc_name']
 
         core_api.create_persistent_volume(pv)
@@ -43,6 +43,7 @@ from common import wait_for_volume_replica_count
 from common import wait_for_volume_restoration_completed
 from common import write_pod_volume_data
 from common import wait_for_volume_degraded
+from common import wait_for_volumes_deleted
 from common import VOLUME_ROBUSTNESS_HEALTHY
 from kubernetes.stream import stream
 from random import randrange
@@ -682,8 +683,13 @@ def test_reset_env():
                         )
                         delete_and_wait_pv(k8s_api_client, pv.metadata.name)
 
+    # delete all the volumes first, then wait for them with one list per
+    # interval rather than for each volume in turn
+    volume_names = []
     volume_list = \
         longhorn_api_client.list_volume()
     for volume in volume_list.data:
         if STRESS_VOLUME_NAME_PREFIX in volume.name:
-            delete_and_wait_longhorn(longhorn_api_client, volume.name)
+            longhorn_api_client.delete(volume)
+            volume_names.append(volume.name)
+    wait_for_volumes_deleted(longhorn_api_client, volume_names)
@@ -1,66 +1,129 @@
 #!/usr/bin/python
+import json
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
 from datetime import date
+from xml.etree import ElementTree
 import requests
-from bs4 import BeautifulSoup
 
 
-def collect_test_results(test_cases):
+def get_test_result(test_case):
 
-    test_results = []
+    test_result = {
+        "case": "",
+        "case_id": "",
+        "suite": "",
+        "suite_id": "",
+        "skipped": "",
+        "failure": ""
+    }
 
-    for test_case in test_cases:
+    test_suite = test_case.get("classname")
+    test_result['suite'] = test_suite.split(".")[-1]
+
+    test_result['case'] = test_case.get("name").split("[")[0]
+
+    skipped = test_case.find("skipped")
+    if skipped is not None:
+        test_result['skipped'] = skipped.get("message")
+
+    failure = test_case.find("failure")
+    if failure is not None:
+        test_result['failure'] = failure.get("message") or ""
+        test_result['failure'] += '\n\n' + "".join(failure.itertext())
+
+    return test_result
+
+
+def iter_test_results(report_filename, on_test_suite=None):
+    # stream the report instead of loading it, every testcase is dropped
+    # from the tree once converted, so memory use doesn't depend on the
+    # report size even with huge failure logs embedded
+    elements = []
+    for event, elem in ElementTree.iterparse(report_filename, events=("start", "end")):
+        if event == "start":
+            if elem.tag == "testsuite" and on_test_suite:
+                on_test_suite(elem.get("name"))
+                on_test_suite = None
+            elements.append(elem)
+            continue
+
+        elements.pop()
+        if elem.tag != "testcase":
+            continue
+        yield get_test_result(elem)
+        elem.clear()
+        if elements:
+            elements[-1].remove(elem)
+
+
+def iter_batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def get_headers():
+    return {
+        "accept": "application/json",
+        "content-type": "application/json",
+        "Token": qase_token
+    }
 
-        test_result = {
-            "case": "",
-            "case_id": "",
-            "suite": "",
-            "suite_id": "",
-            "skipped": "",
-            "failure": ""
-        }
 
-        test_suite = test_case.get("classname")
-        test_result['suite'] = test_suite.split(".")[-1]
+def get_all_entities(kind):
 
-        test_result['case'] = test_case.get("name").split("[")[0]
+    print(f"getting all {kind}s")
 
-        skipped = test_case.findChildren("skipped", recursive=False)
-        if len(skipped) > 0:
-            test_result['skipped'] = skipped[0].get("message")
+    entities = []
+    while True:
+        query_string = urlencode({ "limit": QASE_PAGE_SIZE, "offset": len(entities) })
+        url = f"{qase_api_url}/{kind}/{qase_project}?{query_string}"
 
-        failure = test_case.findChildren("failure", recursive=False)
-        if len(failure) > 0:
-            test_result['failure'] = failure[0].get("message")
-            test_result['failure'] += '\n\n' + failure[0].get_text()
+        resp = session.get(url, headers=get_headers())
+        res = resp.json()
+        page = res["result"]["entities"]
+        entities.extend(page)
+        if not page or len(entities) >= res["result"]["total"]:
+            break
 
-        test_results.append(test_result)
+    print(f"got {len(entities)} {kind}s")
+    return entities
 
-    return test_results
 
+def get_title_to_id(entities):
+    title_to_id = {}
+    for entity in entities:
+        # the first match wins, like the search used to
+        title_to_id.setdefault(entity["title"], entity["id"])
+    return title_to_id
 
-def get_suite_id(suite_name):
 
-    print(f"getting suite {suite_name}")
+def load_id_cache():
+    # title to id of the suites and cases of the project from previous runs,
+    # so a run only needs to fetch the catalogs when it meets a new name
+    try:
+        with open(qase_cache_file, 'r') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    cache.setdefault("suites", {})
+    cache.setdefault("cases", {})
+    return cache
 
-    query_string = urlencode({ "search": suite_name })
-    headers = {
-        "accept": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/suite/{qase_project}?{query_string}"
 
-    resp = requests.get(url, headers=headers)
-    res = resp.json()
-    if res["result"]["count"] > 0:
-        id = res["result"]["entities"][0]["id"]
-        print(f"got suite {suite_name} with id {id}")
-        return id
-    else:
-        print(f"missed suite {suite_name}")
-        return None
+def save_id_cache(cache):
+    tmp_file = qase_cache_file + ".tmp"
+    with open(tmp_file, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, qase_cache_file)
 
 
 def add_missing_suite(suite_name):
@@ -71,100 +134,100 @@ def add_missing_suite(suite_name):
         "title": suite_name,
         "parent_id": parent_suite_id
     }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/suite/{qase_project}"
+    url = f"{qase_api_url}/suite/{qase_project}"
 
-    resp = requests.post(url, json=payload, headers=headers)
+    resp = session.post(url, json=payload, headers=get_headers())
     res = resp.json()
     print(f"added suite {suite_name} with id {res['result']['id']}")
     return res["result"]["id"]
 
 
-def get_suites_id_and_add_missing_suites(test_results):
-    for result in test_results:
-        result["suite_id"] = get_suite_id(result["suite"])
-        if not result["suite_id"]:
-            result["suite_id"] = add_missing_suite(result["suite"])
-
+def get_suites_id_and_add_missing_suites(test_results, cache, refresh=False):
+    suite_names = {result["suite"] for result in test_results}
 
-def get_case_id(case_name):
+    # the catalog is fetched at most once per run unless refreshed, names
+    # still missing after that are new
+    if refresh or (not suite_names <= cache["suites"].keys() and "suite" not in fetched_catalogs):
+        cache["suites"] = get_title_to_id(get_all_entities("suite"))
+        fetched_catalogs.add("suite")
 
-    print(f"getting case {case_name}")
+    # suites have no bulk endpoint, add them concurrently
+    missing_suites = sorted(suite_names - cache["suites"].keys())
+    with ThreadPoolExecutor(max_workers=QASE_MAX_WORKERS) as executor:
+        for suite_name, suite_id in zip(missing_suites, executor.map(add_missing_suite, missing_suites)):
+            cache["suites"][suite_name] = suite_id
 
-    query_string = urlencode({ "search": case_name })
-    headers = {
-        "accept": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/case/{qase_project}?{query_string}"
+    for result in test_results:
+        result["suite_id"] = cache["suites"][result["suite"]]
 
-    resp = requests.get(url, headers=headers)
-    res = resp.json()
-    if res["result"]["count"] > 0:
-        id = res["result"]["entities"][0]["id"]
-        print(f"got case {case_name} with id {id}")
-        return id
-    else:
-        print(f"missed case {case_name}")
-        return None
 
+def get_case_title(case_name):
+    if len(case_name) > 128:
+        case_name = case_name[:127]
+    return case_name
 
-def add_missing_case(case_name, parent_suite_id):
 
-    print(f"adding missing case {case_name} under parent suite {parent_suite_id}")
+def add_missing_cases(cases):
 
-    if len(case_name) > 128:
-        case_name = case_name[:127]
+    print(f"adding {len(cases)} missing cases")
 
     payload = {
-        "title": case_name,
-        "suite_id": parent_suite_id,
-        "automation": 2
-    }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Token": qase_token
+        "cases": [{
+            "title": case_title,
+            "suite_id": suite_id,
+            "automation": 2
+        } for case_title, suite_id in cases]
     }
-    url = f"https://api.qase.io/v1/case/{qase_project}"
+    url = f"{qase_api_url}/case/{qase_project}/bulk"
 
-    resp = requests.post(url, json=payload, headers=headers)
+    resp = session.post(url, json=payload, headers=get_headers())
     res = resp.json()
-    print(f"added case {case_name} with id {res['result']['id']}")
-    return res["result"]["id"]
+    ids = res["result"]["ids"]
+    for (case_title, suite_id), id in zip(cases, ids):
+        print(f"added case {case_title} with id {id} under parent suite {suite_id}")
+    return ids
 
 
-def get_test_cases_id_and_add_missing_test_cases(test_results):
+def get_test_cases_id_and_add_missing_test_cases(test_results, cache, refresh=False):
     for result in test_results:
-        result["case_id"] = get_case_id(result["case"])
-        if not result["case_id"]:
-            result["case_id"] = add_missing_case(result["case"], result["suite_id"])
+        result["case"] = get_case_title(result["case"])
+    case_names = {result["case"] for result in test_results}
 
+    if refresh or (not case_names <= cache["cases"].keys() and "case" not in fetched_catalogs):
+        cache["cases"] = get_title_to_id(get_all_entities("case"))
+        fetched_catalogs.add("case")
 
-def create_test_run(job_name, test_results, build_url):
+    missing_cases = {}
+    for result in test_results:
+        if result["case"] not in cache["cases"]:
+            missing_cases.setdefault(result["case"], result["suite_id"])
+    missing_cases = sorted(missing_cases.items())
+
+    # add them in bulk, a few bulks at the same time
+    chunks = [missing_cases[i:i + QASE_BULK_SIZE] for i in range(0, len(missing_cases), QASE_BULK_SIZE)]
+    with ThreadPoolExecutor(max_workers=QASE_MAX_WORKERS) as executor:
+        for chunk, ids in zip(chunks, executor.map(add_missing_cases, chunks)):
+            for (case_title, _), id in zip(chunk, ids):
+                cache["cases"][case_title] = id
 
-    test_cases_id = []
     for result in test_results:
-        test_cases_id.append(result["case_id"])
+        result["case_id"] = cache["cases"][result["case"]]
+
+
+def create_test_run(job_name, build_url):
 
+    # the cases are added to the run along with their results
     payload = {
-        "cases": test_cases_id,
         "title": job_name,
         "description": build_url
     }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/run/{qase_project}"
+    url = f"{qase_api_url}/run/{qase_project}"
 
-    resp = requests.post(url, json=payload, headers=headers)
+    resp = session.post(url, json=payload, headers=get_headers())
     res = resp.json()
+    if not res["status"]:
+        print(f"failed to create test run {job_name}: {res}")
+        return None
     return res["result"]["id"]
 
 
@@ -187,32 +250,42 @@ def update_test_run_results(test_run_id, test_results):
         arr.append(obj)
 
     payload = { "results": arr }
-    headers = {
-        "accept": "application/json",
-        "content-type": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/result/{qase_project}/{test_run_id}/bulk"
+    url = f"{qase_api_url}/result/{qase_project}/{test_run_id}/bulk"
 
-    resp = requests.post(url, json=payload, headers=headers)
+    resp = session.post(url, json=payload, headers=get_headers())
     res = resp.json()
     if res["status"] == True:
-        print(f"updating test run {test_run_id} succeeded")
+        print(f"updating test run {test_run_id} with {len(arr)} results succeeded")
+        return True
     else:
         print(f"failed to update test run {test_run_id}: {res}")
+        return False
+
+
+def upload_test_results(test_run_id, test_results, cache):
+
+    # get suites id and add missing suites
+    get_suites_id_and_add_missing_suites(test_results, cache)
+
+    # get test cases id and add missing test cases
+    get_test_cases_id_and_add_missing_test_cases(test_results, cache)
+
+    # update test results to test run
+    if not update_test_run_results(test_run_id, test_results):
+        # the cache may have ids of suites or cases deleted since, refresh it
+        print("retrying with refreshed suites and cases")
+        get_suites_id_and_add_missing_suites(test_results, cache, refresh=True)
+        get_test_cases_id_and_add_missing_test_cases(test_results, cache, refresh=True)
+        update_test_run_results(test_run_id, test_results)
 
 
 def complete_test_run(test_run_id):
 
     print(f"completing test run {test_run_id}")
 
-    headers = {
-        "accept": "application/json",
-        "Token": qase_token
-    }
-    url = f"https://api.qase.io/v1/run/{qase_project}/{test_run_id}/complete"
+    url = f"{qase_api_url}/run/{qase_project}/{test_run_id}/complete"
 
-    resp = requests.post(url, headers=headers)
+    resp = session.post(url, headers=get_headers())
     res = resp.json()
     if res["status"] == True:
         print(f"completing test run {test_run_id} succeeded")
@@ -223,8 +296,24 @@ def complete_test_run(test_run_id):
 # collect required global variables
 qase_token = os.getenv("QASE_TOKEN", "")
 qase_project = os.getenv("QASE_PROJECT", "LH")
+# can point to a local stub server for testing
+qase_api_url = os.getenv("QASE_API_URL", "https://api.qase.io/v1").rstrip("/")
+qase_cache_file = os.getenv("QASE_CACHE_FILE", f".qase_cache_{qase_project}.json")
 parent_suite_id = ""
 
+QASE_PAGE_SIZE = 100
+QASE_BULK_SIZE = 100
+QASE_MAX_WORKERS = 8
+# number of results uploaded at once, and the number of batches parsed
+# ahead of the upload
+QASE_RESULT_BATCH_SIZE = 500
+QASE_MAX_PENDING_BATCHES = 2
+
+fetched_catalogs = set()
+
+# reuse the connections across the calls
+session = requests.Session()
+
 if __name__ == "__main__":
 
     if len(sys.argv) <= 1:
@@ -233,42 +322,43 @@ if __name__ == "__main__":
         report_filename = sys.argv[1]
         build_url = sys.argv[2]
 
-    with open(report_filename, 'r') as f:
-        file = f.read()
-        soup = BeautifulSoup(file, 'lxml-xml')
-
-    # decide it's a pytest or robot report
-    test_suites = soup.find_all("testsuite")
-    if test_suites[0].get("name") == "pytest":
-        test_type = "pytest"
-        # if it's a pytest report, missing suites will be added under
-        # parent suite e2e-pytest (id=58)
-        parent_suite_id = 58 # e2e-pytest
-    else:
-        test_type = "robot"
-        # if it's a robot report, missing suites will be added under
-        # parent suite e2e-robot (id=89)
-        parent_suite_id = 89 # e2e-robot
-    print(f"test_type = {test_type}")
-
-    # collect test results dict from test cases xml
-    test_cases = soup.find_all("testcase")
-    test_results = collect_test_results(test_cases)
-
-    # get suites id and add missing suites
-    get_suites_id_and_add_missing_suites(test_results)
+    def set_test_type(test_suite_name):
+        global parent_suite_id
+        # decide it's a pytest or robot report
+        if test_suite_name == "pytest":
+            test_type = "pytest"
+            # if it's a pytest report, missing suites will be added under
+            # parent suite e2e-pytest (id=58)
+            parent_suite_id = 58 # e2e-pytest
+        else:
+            test_type = "robot"
+            # if it's a robot report, missing suites will be added under
+            # parent suite e2e-robot (id=89)
+            parent_suite_id = 89 # e2e-robot
+        print(f"test_type = {test_type}")
 
-    # get test cases id and add missing test cases
-    get_test_cases_id_and_add_missing_test_cases(test_results)
+    cache = load_id_cache()
 
     # create test run
     today = date.today()
     job_name = f"{os.getenv('JOB_NAME', 'longhorn-regression-test')}-{today}"
-    test_run_id = create_test_run(job_name, test_results, build_url)
+    test_run_id = create_test_run(job_name, build_url)
+    if not test_run_id:
+        raise Exception("Failed to create test run")
     print(f"test_run_id = {test_run_id}")
 
-    # update test results to test run
-    update_test_run_results(test_run_id, test_results)
+    # upload the test results batch by batch while the report is still
+    # being parsed, one batch at a time so they share the id cache
+    test_results = iter_test_results(report_filename, on_test_suite=set_test_type)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = []
+        for batch in iter_batches(test_results, QASE_RESULT_BATCH_SIZE):
+            pending.append(executor.submit(upload_test_results, test_run_id, batch, cache))
+            if len(pending) >= QASE_MAX_PENDING_BATCHES:
+                pending.pop(0).result()
+        for future in pending:
+            future.result()
+    save_id_cache(cache)
 
     # complete test run
     complete_test_run(test_run_id)
@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+from kubernetes import client, watch
+from kubernetes.client.rest import ApiException
+
+STS_PREFIX = "sts-"
+WATCH_TIMEOUT_SECONDS = 300
+WATCH_RETRY_INTERVAL = 2
+REPORT_INTERVAL = 60
+LATENCY_FILE_NAME = "pod_latencies.json"
+LATENCY_PERCENTILES = [50, 90, 99]
+
+# provision: PVC created -> PVC bound
+# attach: PVC bound -> VolumeAttachment attached
+# ready: pod created -> pod ready
+LATENCY_NAMES = ["provision", "attach", "ready"]
+
+
+def to_timestamp(t):
+    return t.timestamp() if t else None
+
+
+class Informer:
+    """
+    Keep an in-memory index of the StatefulSet pods, their PVCs and
+    VolumeAttachments from watch streams, so the monitor doesn't need to
+    list all the pods on every tick.
+
+    The watches list once, then stream from the listed resourceVersion and
+    resume from the last seen one; they only relist when the version is
+    gone. The blocking watch streams of the kubernetes client are drained
+    in executor threads and handed over to an asyncio loop running in a
+    background thread, so no stream can starve the others.
+    """
+
+    def __init__(self, max_pod_starting_time, namespace="default"):
+        self.namespace = namespace
+        self.max_pod_starting_time = max_pod_starting_time
+        self.log = logging.getLogger('informer')
+        self.lock = threading.Lock()
+
+        self.pods = dict()  # pod name -> state of the pod
+        self.pvcs = dict()  # pvc name -> state of the pvc
+        self.volume_attachments = dict()  # pv name -> attached at
+        self.pods_with_valid_starting_time = dict()
+        self.pods_with_invalid_starting_time = dict()
+        self.starting_time_changed = False
+        self.running_pod_count = 0
+        self.pod_with_valid_starting_time_count = 0
+        self.crashing_pod_count = 0
+
+        self.synced = {"pods": threading.Event(), "pvcs": threading.Event(),
+                       "volume_attachments": threading.Event()}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=asyncio.run, args=(self.run(),),
+                                       daemon=True, name="informer")
+        self.thread.start()
+
+    def wait_for_synced(self, timeout=None):
+        for synced in self.synced.values():
+            synced.wait(timeout)
+
+    async def run(self):
+        core_api_v1 = client.CoreV1Api()
+        storage_api_v1 = client.StorageV1Api()
+        await asyncio.gather(
+            self.watch("pods", core_api_v1.list_namespaced_pod,
+                       self.on_pod_event, namespace=self.namespace),
+            self.watch("pvcs", core_api_v1.list_namespaced_persistent_volume_claim,
+                       self.on_pvc_event, namespace=self.namespace),
+            self.watch("volume_attachments", storage_api_v1.list_volume_attachment,
+                       self.on_volume_attachment_event),
+            self.report_periodically())
+
+    async def watch(self, kind, list_func, on_event, **kwargs):
+        loop = asyncio.get_running_loop()
+        resource_version = None
+        while True:
+            try:
+                if resource_version is None:
+                    resp = await loop.run_in_executor(None, lambda: list_func(**kwargs))
+                    # objects deleted while not watching are gone from the list
+                    self.prune(kind, resp.items)
+                    for obj in resp.items:
+                        on_event("ADDED", obj)
+                    resource_version = resp.metadata.resource_version
+                    self.synced[kind].set()
+
+                queue = asyncio.Queue()
+
+                def pump(resource_version=resource_version):
+                    w = watch.Watch()
+                    try:
+                        for event in w.stream(list_func, resource_version=resource_version,
+                                              timeout_seconds=WATCH_TIMEOUT_SECONDS, **kwargs):
+                            loop.call_soon_threadsafe(queue.put_nowait, event)
+                    except Exception as e:
+                        loop.call_soon_threadsafe(queue.put_nowait, e)
+                    finally:
+                        w.stop()
+                        loop.call_soon_threadsafe(queue.put_nowait, None)
+
+                pumping = loop.run_in_executor(None, pump)
+                while True:
+                    event = await queue.get()
+                    if event is None:
+                        break
+                    if isinstance(event, Exception):
+                        raise event
+                    if event['type'] == 'ERROR':
+                        # resource version too old, relist
+                        resource_version = None
+                        continue
+                    resource_version = event['object'].metadata.resource_version
+                    on_event(event['type'], event['object'])
+                await pumping
+            except ApiException as e:
+                if e.status == 410:
+                    resource_version = None
+                self.log.warning("watching %s failed: %s" % (kind, e.reason))
+                await asyncio.sleep(WATCH_RETRY_INTERVAL)
+            except Exception as e:
+                self.log.warning("watching %s failed: %s" % (kind, e))
+                resource_version = None
+                await asyncio.sleep(WATCH_RETRY_INTERVAL)
+
+    def prune(self, kind, items):
+        if kind == "volume_attachments":
+            names = {va.spec.source.persistent_volume_name for va in items}
+        else:
+            names = {obj.metadata.name for obj in items}
+        with self.lock:
+            for name in list(getattr(self, kind)):
+                if name in names:
+                    continue
+                if kind == "pods":
+                    self._remove_pod(name)
+                else:
+                    getattr(self, kind).pop(name)
+
+    def _remove_pod(self, name):
+        old = self.pods.pop(name, None)
+        if old:
+            self.running_pod_count -= old["ready"]
+            self.pod_with_valid_starting_time_count -= old["valid_starting_time"]
+            self.crashing_pod_count -= old["crashing"]
+        return old
+
+    def on_pod_event(self, event_type, pod):
+        name = pod.metadata.name
+        if STS_PREFIX not in name:
+            return
+        with self.lock:
+            old = self._remove_pod(name)
+            if event_type == "DELETED":
+                return
+
+            state = old or {"created_at": to_timestamp(pod.metadata.creation_timestamp),
+                            "ready_at": None, "pvcs": []}
+            state["pvcs"] = [v.persistent_volume_claim.claim_name for v in pod.spec.volumes or []
+                             if v.persistent_volume_claim]
+
+            status = pod.status.container_statuses[0] if pod.status and pod.status.container_statuses else None
+            state["ready"] = bool(status and status.ready)
+            state["crashing"] = bool(status and status.restart_count > 0)
+            if state["ready"] and state["ready_at"] is None:
+                state["ready_at"] = time.time()
+                for condition in pod.status.conditions or []:
+                    if condition.type == "Ready" and condition.status == "True":
+                        state["ready_at"] = to_timestamp(condition.last_transition_time)
+
+            # same starting time check as Monitor.count_pod_numbers
+            if state["ready"] and name not in self.pods_with_valid_starting_time and \
+                    status.state and status.state.running:
+                starting_time = (status.state.running.started_at - pod.metadata.creation_timestamp).total_seconds()
+                if starting_time <= self.max_pod_starting_time:
+                    self.pods_with_valid_starting_time[name] = True
+                else:
+                    self.pods_with_invalid_starting_time[name] = True
+                self.starting_time_changed = True
+            state["valid_starting_time"] = state["ready"] and name in self.pods_with_valid_starting_time
+
+            self.pods[name] = state
+            self.running_pod_count += state["ready"]
+            self.pod_with_valid_starting_time_count += state["valid_starting_time"]
+            self.crashing_pod_count += state["crashing"]
+
+    def on_pvc_event(self, event_type, pvc):
+        name = pvc.metadata.name
+        with self.lock:
+            if event_type == "DELETED":
+                self.pvcs.pop(name, None)
+                return
+            state = self.pvcs.setdefault(name, {"created_at": to_timestamp(pvc.metadata.creation_timestamp),
+                                                "bound_at": None, "volume_name": None})
+            state["volume_name"] = pvc.spec.volume_name
+            if pvc.status and pvc.status.phase == "Bound" and state["bound_at"] is None:
+                state["bound_at"] = time.time()
+
+    def on_volume_attachment_event(self, event_type, va):
+        pv_name = va.spec.source.persistent_volume_name
+        if not pv_name:
+            return
+        with self.lock:
+            if event_type == "DELETED":
+                self.volume_attachments.pop(pv_name, None)
+                return
+            if va.status and va.status.attached and self.volume_attachments.get(pv_name) is None:
+                self.volume_attachments[pv_name] = time.time()
+
+    def get_pod_counts(self):
+        with self.lock:
+            return self.running_pod_count, self.pod_with_valid_starting_time_count, self.crashing_pod_count
+
+    def load_pods_starting_time(self, pods_with_valid_starting_time, pods_with_invalid_starting_time):
+        # resume the bookkeeping of a preloaded monitor
+        with self.lock:
+            self.pods_with_valid_starting_time = dict(pods_with_valid_starting_time)
+            self.pods_with_invalid_starting_time = dict(pods_with_invalid_starting_time)
+
+    def get_pods_starting_time(self):
+        # copies, so the caller can serialize them while the watches go on
+        with self.lock:
+            changed = self.starting_time_changed
+            self.starting_time_changed = False
+            return changed, dict(self.pods_with_valid_starting_time), dict(self.pods_with_invalid_starting_time)
+
+    def get_latencies(self):
+        # pod name -> provision, attach and ready latencies in seconds
+        latencies = dict()
+        with self.lock:
+            for name, pod in self.pods.items():
+                latency = {"provision": None, "attach": None, "ready": None}
+                if pod["ready_at"] is not None:
+                    latency["ready"] = pod["ready_at"] - pod["created_at"]
+                for pvc_name in pod["pvcs"]:
+                    pvc = self.pvcs.get(pvc_name)
+                    if pvc is None or pvc["bound_at"] is None:
+                        continue
+                    latency["provision"] = pvc["bound_at"] - pvc["created_at"]
+                    attached_at = self.volume_attachments.get(pvc["volume_name"])
+                    if attached_at is not None:
+                        latency["attach"] = max(0, attached_at - pvc["bound_at"])
+                latencies[name] = latency
+        return latencies
+
+    def get_latency_percentiles(self):
+        latencies = self.get_latencies().values()
+        percentiles = dict()
+        for name in LATENCY_NAMES:
+            values = [latency[name] for latency in latencies if latency[name] is not None]
+            if not values:
+                continue
+            percentiles[name] = dict(zip(["p%d" % p for p in LATENCY_PERCENTILES],
+                                         np.percentile(values, LATENCY_PERCENTILES).tolist()))
+            percentiles[name]["count"] = len(values)
+        return percentiles
+
+    def report(self, file_name=LATENCY_FILE_NAME):
+        percentiles = self.get_latency_percentiles()
+        for name, values in percentiles.items():
+            self.log.info("%s latency of %d pods: %s" % (
+                name, values["count"],
+                " ".join("%s=%.1fs" % (p, v) for p, v in values.items() if p != "count")))
+        tmp_file_name = file_name + ".tmp"
+        with open(tmp_file_name, 'w') as writer:
+            json.dump({"percentiles": percentiles, "pods": self.get_latencies()}, writer)
+        os.replace(tmp_file_name, file_name)
+
+    async def report_periodically(self):
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            try:
+                self.report()
+            except Exception as e:
+                self.log.warning("reporting latencies failed: %s" % e)
@@ -1,19 +1,42 @@
 from datetime import datetime
+import base64
 import dateutil.parser
+import io
 import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+import matplotlib
 import matplotlib.pyplot as plt
+import numpy as np
 from kubernetes import client
+from monitor_store import MonitorStore
 
 STS_PREFIX = "sts-"
-MONITOR_DATA_FILE_NAME = "monitor_data.txt"
+# directory of the MonitorStore, older runs saved everything into a single
+# JSON file which can still be loaded
+MONITOR_DATA_FILE_NAME = "monitor_data"
+# without a display the graph is exported to this file instead, .png or .html
+MONITOR_EXPORT_FILE_NAME = "monitor.png"
+
+# maximum number of points drawn per series, older history is downsampled
+MAX_POINTS_PER_SERIES = 2000
+# seconds of the latest history drawn, the whole run if None; only the
+# samples of this window are read from the store
+MONITOR_DRAW_WINDOW = None
 
 # annotate the point at which the pod starting time is bigger than the maximum allowed value 
 MAX_POD_STARTING_TIME_POINT = "max_pod_starting_time_point" 
 MAX_POD_CRASHING_POINT = "max_pod_crashing_point" 
 
 class Monitor:
-    def __init__(self, core_api_v1, custom_objects_api, updating_interval, node_capacities, preload, sts_count, max_pod_starting_time, max_pod_crashing_count, file_name = MONITOR_DATA_FILE_NAME):
+    def __init__(self, core_api_v1, custom_objects_api, updating_interval, node_capacities, preload, sts_count, max_pod_starting_time, max_pod_crashing_count, file_name = MONITOR_DATA_FILE_NAME, export_file_name = None, informer = None, draw_window = MONITOR_DRAW_WINDOW, read_only = False):
         self.core_api_v1 = core_api_v1
+        # when set, the pods are counted from the watch driven index of the
+        # informer instead of listing all the pods on every update
+        self.informer = informer
         self.custom_objects_api = custom_objects_api
         self.updating_interval = updating_interval
         self.max_pod_starting_time = max_pod_starting_time
@@ -21,18 +44,40 @@ class Monitor:
         self.sts_count = sts_count
         
         self.node_capacities = node_capacities
+        self.draw_window = draw_window
+        # only draw the data of a previous run, don't write anything
+        self.read_only = read_only
+        self.store = None
+        self.store_dir = None
         
         if preload:
             self.load_data_from_disk(file_name)
         else:
-            self.timestamps = []
-            self.time_diffs = []
-            self.running_pod_metric = []
-            self.cpu_metrics = dict() # node_name to cpu_utilization
-            self.ram_metrics = dict() # node_name to used_ram
+            self.store = MonitorStore(file_name)
+            self.store.reset()
+            # the history is kept in the store only, time diffs are counted
+            # from the first sample
+            self.started_at = None
             self.annotating_points = dict()
             self.pods_with_valid_starting_time = dict()
             self.pods_with_invalid_starting_time = dict()
+        self.meta_changed = True
+        if self.informer:
+            if preload:
+                # resume the bookkeeping of the previous run
+                self.informer.load_pods_starting_time(self.pods_with_valid_starting_time, self.pods_with_invalid_starting_time)
+            else:
+                # the informer may have been tracking the pods since before
+                # the statefulsets were created, keep what it saw
+                _, self.pods_with_valid_starting_time, self.pods_with_invalid_starting_time = self.informer.get_pods_starting_time()
+
+        # samples are collected in a thread while the main thread draws
+        self.lock = threading.Lock()
+        self.lines = {"running": None, "cpu": dict(), "ram": dict()}
+        self.annotations = dict()
+        if export_file_name is None and is_headless():
+            export_file_name = MONITOR_EXPORT_FILE_NAME
+        self.export_file_name = export_file_name
 
         self.fig, self.axes = plt.subplots(3, 1)
         self.fig.set_size_inches(16, 10)
@@ -44,17 +89,20 @@ class Monitor:
         """.format(sts_count=self.sts_count, max_pod_starting_time= self.max_pod_starting_time, max_pod_crashing_count=self.max_pod_crashing_count)
         self.fig.text(0.05, 0, notes, va='bottom', ha='left')
 
-    def update_data(self):
-        # get running pod count
+    def fetch_data(self):
+        # the API calls of an update, made without holding the lock so
+        # draw() doesn't wait for them
+        # return None to skip the update
         pod_list = []
-        node_list = []
-        try:
-            pod_list = self.core_api_v1.list_namespaced_pod("default")
-        # TODO: change to catch any exception and count the number of api exceptions
-        except client.ApiException as e:
-            print("Exception when calling CoreV1Api->list_namespaced_pod: %s\n" % e)
-            print("Skipping this update")
-            return
+        node_list = {"items": []}
+        if not self.informer:
+            try:
+                pod_list = self.core_api_v1.list_namespaced_pod("default")
+            # TODO: change to catch any exception and count the number of api exceptions
+            except client.ApiException as e:
+                print("Exception when calling CoreV1Api->list_namespaced_pod: %s\n" % e)
+                print("Skipping this update")
+                return None
 
         try:
             node_list = self.custom_objects_api.list_cluster_custom_object("metrics.k8s.io", "v1beta1", "nodes")
@@ -62,28 +110,35 @@ class Monitor:
         except client.ApiException as e:
             print("Exception when calling custom_objects_api->list_cluster_custom_object: %s\n" % e)
             print("Will set node metrics to 0")
+        return pod_list, node_list
 
+    def update_data(self, pod_list, node_list):
         now = datetime.now()
-        self.timestamps.append(now)
-        diff = now-self.timestamps[0]
-        self.time_diffs.append(diff.total_seconds())
+        if self.started_at is None:
+            self.started_at = now
+        diff = now-self.started_at
 
         
-        running_pod_count, pod_with_valid_starting_time_count, crashing_pod_count = self.count_pod_numbers(pod_list)
+        if self.informer:
+            running_pod_count, pod_with_valid_starting_time_count, crashing_pod_count = self.count_pod_numbers_from_informer()
+        else:
+            running_pod_count, pod_with_valid_starting_time_count, crashing_pod_count = self.count_pod_numbers(pod_list)
         
-        # update the internal metrics
-        self.running_pod_metric.append(running_pod_count)
         if pod_with_valid_starting_time_count < running_pod_count and MAX_POD_STARTING_TIME_POINT not in self.annotating_points:
+            self.meta_changed = True
             self.annotating_points[MAX_POD_STARTING_TIME_POINT] = {
                 "xy": (diff.total_seconds(), 
                 pod_with_valid_starting_time_count), "description": "(1) "+str(pod_with_valid_starting_time_count)+" pods",
                 "color": "tab:orange"}
         if crashing_pod_count > self.max_pod_crashing_count and MAX_POD_CRASHING_POINT not in self.annotating_points:
+            self.meta_changed = True
             self.annotating_points[MAX_POD_CRASHING_POINT] = {
                 "xy": (diff.total_seconds(), 
                 pod_with_valid_starting_time_count), "description": "(2) "+str(pod_with_valid_starting_time_count)+" pods",
                 "color": "tab:red"}
 
+        sample_cpu_metrics = dict()
+        sample_ram_metrics = dict()
         for node in node_list['items']:
             node_name = node['metadata']['name']
             if node_name not in self.node_capacities:
@@ -93,22 +148,15 @@ class Monitor:
             used_ram_string = node['usage']['memory'] # an example of ram_string: 1889548Ki
             cpu_percent = 100*int(used_cpu_string[:-1])/self.node_capacities[node_name]["cpu"]
             ram_percent = 100*int(used_ram_string[:-2])/self.node_capacities[node_name]["ram"]
+            sample_cpu_metrics[node_name] = cpu_percent
+            sample_ram_metrics[node_name] = ram_percent
 
-            cpu_metric = self.cpu_metrics.get(node_name, [])
-            ram_metric = self.ram_metrics.get(node_name, [])
-            cpu_metric.append(cpu_percent)
-            ram_metric.append(ram_percent)
-            self.cpu_metrics[node_name] = cpu_metric
-            self.ram_metrics[node_name] = ram_metric
-
-        # update node metrics with value 0 if the information is missing in the above update
-        for metric in self.cpu_metrics.values():
-            if len(metric) < len(self.time_diffs):
-                cpu_metric.extend([0]*(len(self.time_diffs)-len(metric)))
-        for metric in self.ram_metrics.values():
-            if len(metric) < len(self.time_diffs):
-                cpu_metric.extend([0]*(len(self.time_diffs)-len(metric)))
-
+        # a node missing in a sample reads as 0 there, see MonitorStore.read()
+        self.store.append({"timestamp": now.timestamp(),
+            "time_diff": diff.total_seconds(),
+            "running_pod_metric": running_pod_count,
+            "cpu_metrics": sample_cpu_metrics,
+            "ram_metrics": sample_ram_metrics})
         self.save_data_to_disk()
 
     def count_pod_numbers(self, pod_list):
@@ -134,6 +182,7 @@ class Monitor:
                         self.pods_with_valid_starting_time[pod.metadata.name] = True
                     else:
                         self.pods_with_invalid_starting_time[pod.metadata.name] = True
+                    self.meta_changed = True
             # TODO: find a more accurate way to detect crashing
             if (pod and pod.status and pod.status.container_statuses and len(pod.status.container_statuses) > 0 and 
                 pod.status.container_statuses[0] and pod.status.container_statuses[0].restart_count > 0):
@@ -141,36 +190,66 @@ class Monitor:
 
         return running_pod_count, pod_with_valid_starting_time_count, crashing_pod_count
 
+    def count_pod_numbers_from_informer(self):
+        changed, pods_with_valid_starting_time, pods_with_invalid_starting_time = self.informer.get_pods_starting_time()
+        if changed:
+            self.pods_with_valid_starting_time = pods_with_valid_starting_time
+            self.pods_with_invalid_starting_time = pods_with_invalid_starting_time
+            self.meta_changed = True
+        return self.informer.get_pod_counts()
+
     def save_data_to_disk(self):
-        # persist the data to disk
-        timestamps_isoformat = []
-        for ts in self.timestamps:
-            timestamps_isoformat.append(ts.isoformat())
-
-        out_str = json.dumps({"timestamps_isoformat": timestamps_isoformat,
-        "time_diffs": self.time_diffs,
-        "running_pod_metric": self.running_pod_metric,
-        "cpu_metrics": self.cpu_metrics,
-        "ram_metrics": self.ram_metrics,
-        "annotating_points": self.annotating_points,
+        # the samples are appended to the store on every update, only persist
+        # the rest when it changed
+        if not self.meta_changed:
+            return
+        self.store.save_meta({"annotating_points": self.annotating_points,
         "sts_count": self.sts_count,
         "max_pod_starting_time": self.max_pod_starting_time,
         "max_pod_crashing_count": self.max_pod_crashing_count,
         "pods_with_valid_starting_time": self.pods_with_valid_starting_time,
         "pods_with_invalid_starting_time": self.pods_with_invalid_starting_time,
         })
-
-        with open(MONITOR_DATA_FILE_NAME, 'w') as writer:
-            writer.write(out_str)
+        self.meta_changed = False
 
     def load_data_from_disk(self, file_name):
+        if os.path.isfile(file_name):
+            self.load_data_from_json_file(file_name)
+            return
+
+        # the samples stay in the store, draw() reads the ones it shows
+        self.store = MonitorStore(file_name, read_only=self.read_only)
+        meta = self.store.load_meta()
+        last_sample = self.store.get_last_sample()
+        # keep counting the time diffs from the first sample of the run
+        self.started_at = None
+        if last_sample is not None:
+            timestamp, time_diff = last_sample
+            self.started_at = datetime.fromtimestamp(timestamp - time_diff)
+        self.annotating_points = meta.get("annotating_points", dict())
+        self.sts_count = meta.get("sts_count", self.sts_count)
+        self.max_pod_starting_time = meta.get("max_pod_starting_time", self.max_pod_starting_time)
+        self.max_pod_crashing_count = meta.get("max_pod_crashing_count", self.max_pod_crashing_count)
+        self.pods_with_valid_starting_time = meta.get("pods_with_valid_starting_time", dict())
+        self.pods_with_invalid_starting_time = meta.get("pods_with_invalid_starting_time", dict())
+
+    def load_data_from_json_file(self, file_name):
+        # data file of older runs, convert it to a store next to it and keep
+        # appending the new samples there, or to a temporary store when only
+        # drawing it
+        if self.read_only:
+            self.store_dir = tempfile.TemporaryDirectory()
+            self.store = MonitorStore(self.store_dir.name)
+        else:
+            self.store = MonitorStore(file_name + ".store")
+        self.store.reset()
         with open(file_name, 'r') as reader:
             in_str = reader.read()
             decoded_input = json.loads(in_str)
-            self.time_diffs = decoded_input["time_diffs"]
-            self.running_pod_metric = decoded_input["running_pod_metric"]
-            self.cpu_metrics = decoded_input["cpu_metrics"]
-            self.ram_metrics = decoded_input["ram_metrics"]
+            time_diffs = decoded_input["time_diffs"]
+            running_pod_metric = decoded_input["running_pod_metric"]
+            cpu_metrics = decoded_input["cpu_metrics"]
+            ram_metrics = decoded_input["ram_metrics"]
             self.annotating_points = decoded_input["annotating_points"]
             self.sts_count = decoded_input["sts_count"]
             self.max_pod_starting_time = decoded_input["max_pod_starting_time"]
@@ -178,50 +257,147 @@ class Monitor:
             self.pods_with_valid_starting_time = decoded_input.get("pods_with_valid_starting_time", dict())
             self.pods_with_invalid_starting_time = decoded_input.get("pods_with_invalid_starting_time", dict())
             timestamps_isoformat = decoded_input["timestamps_isoformat"]
-            self.timestamps = []
+            timestamps = []
             for ts_isoformat in timestamps_isoformat:
-                self.timestamps.append(dateutil.parser.parse(ts_isoformat))
-            
+                timestamps.append(dateutil.parser.parse(ts_isoformat))
+        self.started_at = timestamps[0] if timestamps else None
+        for i, ts in enumerate(timestamps):
+            self.store.append({"timestamp": ts.timestamp(),
+                "time_diff": time_diffs[i],
+                "running_pod_metric": running_pod_metric[i],
+                "cpu_metrics": {node_name: metric[i] for node_name, metric in cpu_metrics.items() if i < len(metric)},
+                "ram_metrics": {node_name: metric[i] for node_name, metric in ram_metrics.items() if i < len(metric)}})
 
+    def get_draw_range(self):
+        # the time diffs of the samples drawn, the whole run if start is None
+        last_sample = self.store.get_last_sample()
+        if self.draw_window is None or last_sample is None:
+            return None, None
+        return last_sample[1] - self.draw_window, None
 
     def clear_axes(self):
         for ax in self.axes:
             ax.clear()
+        self.lines = {"running": None, "cpu": dict(), "ram": dict()}
+        self.annotations = dict()
 
     def draw(self):
+        # update the data of the existing lines instead of plotting again
         ax1, ax2, ax3 = self.axes
 
-        ax1.plot(self.time_diffs, self.running_pod_metric) 
-        informationsinformationsax1.set_ylabel('Number of running pods')
+        with self.lock:
+            # only the segments of the store overlapping the window are read
+            columns = self.store.read(*self.get_draw_range())
+            annotating_points = dict(self.annotating_points)
+        time_diffs = np.asarray(columns["time_diffs"], dtype=float)
+        running_pod_metric = np.asarray(columns["running_pod_metric"], dtype=float)
+        cpu_metrics = {node_name: np.asarray(metric, dtype=float) for node_name, metric in columns["cpu_metrics"].items()}
+        ram_metrics = {node_name: np.asarray(metric, dtype=float) for node_name, metric in columns["ram_metrics"].items()}
+
+        if self.lines["running"] is None:
+            self.lines["running"], = ax1.plot([], [])
+            ax1.set_ylabel('Number of running pods')
+            ax2.set_ylabel('CPU usage in percents')
+            ax3.set_ylabel('RAM usage in percents')
+            ax3.set_xlabel('Time in seconds')
+        self.lines["running"].set_data(*decimate(time_diffs, running_pod_metric))
 
-        for point in self.annotating_points.values():
-            ax1.annotate(point["description"],
+        for name, point in annotating_points.items():
+            if name in self.annotations:
+                continue
+            self.annotations[name] = ax1.annotate(point["description"],
                 xy= point["xy"], xycoords='data',
                 xytext=(0, 20), textcoords='offset points',
                 arrowprops=dict(facecolor=point["color"], shrink=0.05),
                 horizontalalignment='center', verticalalignment='center')
 
-        for node_name in sorted(self.cpu_metrics.keys()):
-            ax2.plot(self.time_diffs, self.cpu_metrics[node_name], label = node_name)
-        ax2.set_ylabel('CPU usage in percents')
-        # ax2.legend(loc="upper left")
+        for ax, lines, metrics in ((ax2, self.lines["cpu"], cpu_metrics), (ax3, self.lines["ram"], ram_metrics)):
+            for node_name in sorted(metrics.keys()):
+                if node_name not in lines:
+                    lines[node_name], = ax.plot([], [], label = node_name)
+                metric = metrics[node_name]
+                length = min(len(time_diffs), len(metric))
+                lines[node_name].set_data(*decimate(time_diffs[:length], metric[:length]))
 
-        for node_name in sorted(self.ram_metrics.keys()):
-            ax3.plot(self.time_diffs, self.ram_metrics[node_name], label = node_name)
-        ax3.set_ylabel('RAM usage in percents')
-        ax3.set_xlabel('Time in seconds')
+        for ax in self.axes:
+            ax.relim()
+            ax.autoscale_view()
+
+    def export(self, file_name):
+        if file_name.endswith(".html"):
+            buf = io.BytesIO()
+            self.fig.savefig(buf, format="png")
+            image = base64.b64encode(buf.getvalue()).decode()
+            refresh = int(self.updating_interval) if self.updating_interval else 0
+            html = "<html><head>"
+            if refresh:
+                html += '<meta http-equiv="refresh" content="{refresh}">'.format(refresh=refresh)
+            html += '</head><body><img src="data:image/png;base64,{image}"></body></html>'.format(image=image)
+            tmp_file_name = file_name + ".tmp"
+            with open(tmp_file_name, 'w') as writer:
+                writer.write(html)
+            os.replace(tmp_file_name, file_name)
+        else:
+            self.fig.savefig(file_name)
+
+    def collect(self):
+        # keep the sampling cadence whatever the time spent drawing
+        while True:
+            started_at = time.time()
+            # an error must not silently stop the sampling while run() keeps
+            # drawing, log it and try again on the next tick
+            try:
+                data = self.fetch_data()
+                if data is not None:
+                    with self.lock:
+                        self.update_data(*data)
+            except Exception as e:
+                print("Exception when collecting monitor data: %s" % e)
+                traceback.print_exc()
+            time.sleep(max(0, self.updating_interval - (time.time() - started_at)))
 
     def run(self):
         print("running monitoring loop ...")
+        if self.export_file_name:
+            print("no display, exporting the graph to {file_name}".format(file_name=self.export_file_name))
+        threading.Thread(target=self.collect, daemon=True).start()
         while True:
-            self.clear_axes()
-            self.update_data()
             self.draw()
             # check the stopping condition and tell the user to check the file for the graph.
-            plt.pause(self.updating_interval)
+            if self.export_file_name:
+                self.export(self.export_file_name)
+                time.sleep(self.updating_interval)
+            else:
+                plt.pause(self.updating_interval)
+
+
+def is_headless():
+    return matplotlib.get_backend().lower() in matplotlib.rcsetup.non_interactive_bk
+
+
+def decimate(xs, ys, max_points = MAX_POINTS_PER_SERIES):
+    # keep the min and the max of buckets of consecutive points, so spikes
+    # stay visible whatever the length of the run
+    if len(xs) <= max_points:
+        return xs, ys
+    buckets = max_points // 2
+    bucket_size = -(-len(ys) // buckets)
+    padded = np.pad(ys, (0, buckets * bucket_size - len(ys)), mode='edge').reshape(buckets, bucket_size)
+    offsets = np.arange(buckets) * bucket_size
+    indexes = np.concatenate((offsets + padded.argmin(axis=1), offsets + padded.argmax(axis=1)))
+    indexes = np.unique(np.clip(indexes, 0, len(ys) - 1))
+    # always keep the latest point
+    if indexes[-1] != len(ys) - 1:
+        indexes = np.append(indexes, len(ys) - 1)
+    return xs[indexes], ys[indexes]
+
 
 def draw_from_data_file(file_name = MONITOR_DATA_FILE_NAME):
-    m = Monitor(None, None, None, None, True, 0, 0, 0, file_name)
+    m = Monitor(None, None, None, None, True, 0, 0, 0, file_name, read_only=True)
     m.draw()
-    plt.show()
+    if m.export_file_name:
+        m.export(m.export_file_name)
+        print("exported the graph to {file_name}".format(file_name=m.export_file_name))
+    else:
+        plt.show()
             
\ No newline at end of file
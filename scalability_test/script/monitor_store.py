@@ -0,0 +1,231 @@
+import collections
+import json
+import os
+
+import numpy as np
+
+# number of samples per compressed segment
+SEGMENT_SIZE = 120
+# number of decoded segments kept in memory, so redrawing a window of a few
+# hours doesn't decompress its segments again
+SEGMENT_CACHE_SIZE = 64
+
+META_FILE_NAME = "meta.json"
+TAIL_FILE_NAME = "tail.jsonl"
+INDEX_FILE_NAME = "segments.jsonl"
+
+SCALAR_COLUMNS = ["timestamps", "time_diffs", "running_pod_metric"]
+NODE_COLUMNS = ["cpu_metrics", "ram_metrics"]
+
+
+class MonitorStore:
+    """
+    Append-only on-disk store of the monitor samples, one sample per tick.
+
+    Inside the data directory:
+    - tail.jsonl: the samples not in a segment yet, one JSON line each
+    - segment-<n>.npz: the compressed columns of SEGMENT_SIZE samples
+    - segments.jsonl: one line per segment with its time range
+    - meta.json: the test settings, annotating points and pod bookkeeping,
+      atomically replaced when they change
+
+    Appending a sample writes one line, and every SEGMENT_SIZE samples the
+    tail is moved into a new segment, so the cost of a tick doesn't depend
+    on the length of the run. A crash can at most lose the line being
+    written.
+    """
+
+    def __init__(self, path, segment_size=SEGMENT_SIZE, read_only=False):
+        self.path = path
+        self.segment_size = segment_size
+        # a read-only store is never created nor written
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self.segment_cache = collections.OrderedDict()  # file -> arrays
+
+        self.segments = []
+        if os.path.exists(self._file(INDEX_FILE_NAME)):
+            with open(self._file(INDEX_FILE_NAME), 'r') as reader:
+                for line in reader:
+                    # skip a line truncated by a crash
+                    try:
+                        self.segments.append(json.loads(line))
+                    except ValueError:
+                        continue
+
+        self.tail = []
+        last_time_diff = self.segments[-1]["end"] if self.segments else None
+        if os.path.exists(self._file(TAIL_FILE_NAME)):
+            with open(self._file(TAIL_FILE_NAME), 'r') as reader:
+                for line in reader:
+                    try:
+                        sample = json.loads(line)
+                    except ValueError:
+                        continue
+                    # already moved to a segment before a crash
+                    if last_time_diff is not None and \
+                            sample["time_diff"] <= last_time_diff:
+                        continue
+                    self.tail.append(sample)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _check_writable(self):
+        assert not self.read_only, "store %s is read-only" % self.path
+
+    def reset(self):
+        self._check_writable()
+        for name in os.listdir(self.path):
+            if name in (META_FILE_NAME, TAIL_FILE_NAME, INDEX_FILE_NAME) or \
+                    (name.startswith("segment-") and name.endswith(".npz")):
+                os.remove(self._file(name))
+        self.segments = []
+        self.tail = []
+        self.segment_cache.clear()
+
+    def append(self, sample):
+        """
+        sample is a dict with timestamp (seconds since the epoch), time_diff,
+        running_pod_metric, and cpu_metrics and ram_metrics, the per node
+        metrics of the tick.
+        """
+        self._check_writable()
+        with open(self._file(TAIL_FILE_NAME), 'a') as writer:
+            writer.write(json.dumps(sample) + "\n")
+        self.tail.append(sample)
+        if len(self.tail) >= self.segment_size:
+            self._flush_segment()
+
+    def _flush_segment(self):
+        columns = self._to_columns(self.tail)
+        arrays = {name: np.asarray(columns[name]) for name in SCALAR_COLUMNS}
+        for name in NODE_COLUMNS:
+            for node_name, values in columns[name].items():
+                arrays[name + "/" + node_name] = np.asarray(values)
+
+        file_name = "segment-%06d.npz" % len(self.segments)
+        tmp_file = self._file(file_name + ".tmp")
+        with open(tmp_file, 'wb') as writer:
+            np.savez_compressed(writer, **arrays)
+        os.replace(tmp_file, self._file(file_name))
+
+        segment = {"file": file_name,
+                   "start": self.tail[0]["time_diff"],
+                   "end": self.tail[-1]["time_diff"],
+                   "count": len(self.tail)}
+        with open(self._file(INDEX_FILE_NAME), 'a') as writer:
+            writer.write(json.dumps(segment) + "\n")
+        self.segments.append(segment)
+
+        # the samples are in the segment now
+        open(self._file(TAIL_FILE_NAME), 'w').close()
+        self.tail = []
+
+    @staticmethod
+    def _to_columns(samples):
+        columns = {"timestamps": [], "time_diffs": [],
+                   "running_pod_metric": [],
+                   "cpu_metrics": {}, "ram_metrics": {}}
+        for i, sample in enumerate(samples):
+            columns["timestamps"].append(sample["timestamp"])
+            columns["time_diffs"].append(sample["time_diff"])
+            columns["running_pod_metric"].append(sample["running_pod_metric"])
+            for name in NODE_COLUMNS:
+                for node_name, value in sample[name].items():
+                    # a node missing in earlier samples has 0 there
+                    metric = columns[name].setdefault(node_name, [0] * i)
+                    metric.append(value)
+                for metric in columns[name].values():
+                    if len(metric) < i + 1:
+                        metric.append(0)
+        return columns
+
+    def read(self, start=None, end=None):
+        """
+        Return the columns of the samples whose time_diff is in
+        [start, end], only loading the segments overlapping the range.
+        Per node metrics are dicts of node name to values.
+        """
+        columns = {"timestamps": [], "time_diffs": [],
+                   "running_pod_metric": [],
+                   "cpu_metrics": {}, "ram_metrics": {}}
+
+        def extend(part, count):
+            length = len(columns["time_diffs"])
+            for name in SCALAR_COLUMNS:
+                columns[name].extend(part[name])
+            for name in NODE_COLUMNS:
+                for node_name, values in part[name].items():
+                    columns[name].setdefault(node_name, [0] * length)
+                    columns[name][node_name].extend(values)
+                for metric in columns[name].values():
+                    if len(metric) < length + count:
+                        metric.extend([0] * (length + count - len(metric)))
+
+        for segment in self.segments:
+            if start is not None and segment["end"] < start:
+                continue
+            if end is not None and segment["start"] > end:
+                continue
+            part = {"cpu_metrics": {}, "ram_metrics": {}}
+            arrays = self._load_segment(segment)
+            time_diffs = arrays["time_diffs"]
+            mask = np.ones(len(time_diffs), dtype=bool)
+            if start is not None:
+                mask &= time_diffs >= start
+            if end is not None:
+                mask &= time_diffs <= end
+            for key, values in arrays.items():
+                name, _, node_name = key.partition("/")
+                if node_name:
+                    part[name][node_name] = values[mask].tolist()
+                else:
+                    part[name] = values[mask].tolist()
+            extend(part, int(mask.sum()))
+
+        tail = [sample for sample in self.tail
+                if (start is None or sample["time_diff"] >= start) and
+                (end is None or sample["time_diff"] <= end)]
+        extend(self._to_columns(tail), len(tail))
+        return columns
+
+    def _load_segment(self, segment):
+        # segments are never modified once written, cache them as decoded
+        arrays = self.segment_cache.get(segment["file"])
+        if arrays is not None:
+            self.segment_cache.move_to_end(segment["file"])
+            return arrays
+        with np.load(self._file(segment["file"])) as data:
+            arrays = {key: data[key] for key in data.files}
+        self.segment_cache[segment["file"]] = arrays
+        if len(self.segment_cache) > SEGMENT_CACHE_SIZE:
+            self.segment_cache.popitem(last=False)
+        return arrays
+
+    def get_last_sample(self):
+        """
+        Return the timestamp and the time_diff of the last sample, or None if
+        the store is empty.
+        """
+        if self.tail:
+            return self.tail[-1]["timestamp"], self.tail[-1]["time_diff"]
+        if self.segments:
+            arrays = self._load_segment(self.segments[-1])
+            return float(arrays["timestamps"][-1]), \
+                float(arrays["time_diffs"][-1])
+        return None
+
+    def save_meta(self, meta):
+        self._check_writable()
+        tmp_file = self._file(META_FILE_NAME + ".tmp")
+        with open(tmp_file, 'w') as writer:
+            json.dump(meta, writer)
+        os.replace(tmp_file, self._file(META_FILE_NAME))
+
+    def load_meta(self):
+        if not os.path.exists(self._file(META_FILE_NAME)):
+            return {}
+        with open(self._file(META_FILE_NAME), 'r') as reader:
+            return json.load(reader)
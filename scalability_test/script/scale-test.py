@@ -4,12 +4,13 @@ from matplotlib.pyplot import get
 import time
 from re import S
 import sys
-import asyncio
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from asyncio.tasks import sleep
-from kubernetes import client, config, watch
+from kubernetes import client, config
 import monitor
+from informer import Informer
 
 NAMESPACE = "default"
 TEMPLATE_FILE = "statefulset.yaml"
@@ -19,6 +20,9 @@ KUBE_CONFIG = None
 KUBE_CONTEXT = None
 MAX_POD_STARTING_TIME = 300 # in seconds
 MAX_POD_CRASHING_COUNT = 0
+# number of StatefulSets created or scaled at the same time
+MAX_STS_WORKERS = 32
+RAMP_PROFILES = ["linear", "step", "burst"]
 
 def get_node_capacities():
     v1 = client.CoreV1Api()
@@ -141,77 +145,76 @@ def create_sts_spec(node_name, workload_type) :
 
     return statefulset
 
+def apply_concurrently(func, sts_objects):
+    # one request per StatefulSet on a bounded pool, so all of them are
+    # created or scaled at about the same time even on large clusters
+    errors = []
+    def apply(sts):
+        try:
+            func(sts)
+        except client.ApiException as e:
+            logging.error("%s: %s" % (sts.metadata.name, e.reason))
+            errors.append(sts.metadata.name)
+    with ThreadPoolExecutor(max_workers=min(MAX_STS_WORKERS, max(len(sts_objects), 1))) as executor:
+        list(executor.map(apply, sts_objects))
+    return errors
+
 def create_statefulsets(api, sts_objects):
-    for sts in sts_objects:
-        api.create_namespaced_stateful_set(namespace="default", body=sts)
+    def create(sts):
+        try:
+            api.create_namespaced_stateful_set(namespace=NAMESPACE, body=sts)
+        except client.ApiException as e:
+            if e.status != 409:
+                raise
+            logging.info("%s already exists" % sts.metadata.name)
+    return apply_concurrently(create, sts_objects)
 
 def scale_statefulsets(api, sts_objects, n):
-    for sts in sts_objects:
-        sts = api.read_namespaced_stateful_set(name=sts.metadata.name, namespace="default")
-        sts.spec.replicas = n
-        api.patch_namespaced_stateful_set(name=sts.metadata.name, namespace="default", body=sts)
-        
-        
-
-async def watch_pods_async():
-    log = logging.getLogger('pod_events')
-    log.setLevel(logging.INFO)
-    v1 = client.CoreV1Api()
-    w = watch.Watch()
-    for event in w.stream(v1.list_namespaced_pod, namespace=NAMESPACE):
-        process_pod_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_pod_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
-
-
-async def watch_pvc_async():
-    log = logging.getLogger('pvc_events')
-    log.setLevel(logging.INFO)
-    v1 = client.CoreV1Api()
-    v1.list_namespaced_pod()
-    w = watch.Watch()
-    for event in w.stream(v1.list_namespaced_persistent_volume_claim, namespace=NAMESPACE):
-        process_pvc_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_pvc_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
-
-
-async def watch_va_async():
-    log = logging.getLogger('va_events')
-    log.setLevel(logging.INFO)
-    storage = client.StorageV1Api()
-    w = watch.Watch()
-    for event in w.stream(storage.list_volume_attachment):
-        process_va_event(log, event)
-        await asyncio.sleep(0)
-
-
-def process_va_event(log, event):
-    log.info("Event: %s %s %s" % (event['type'], event['object'].kind, event['object'].metadata.name))
-    if 'ADDED' in event['type']:
-        pass
-    elif 'DELETED' in event['type']:
-        pass
-    else:
-        pass
+    # patch the scale subresource directly, no need to read the StatefulSet first
+    def scale(sts):
+        api.patch_namespaced_stateful_set_scale(name=sts.metadata.name, namespace=NAMESPACE,
+                                                body={"spec": {"replicas": n}})
+    return apply_concurrently(scale, sts_objects)
+
+def get_ramp_stages(start, n, profile, step=1):
+    # the replica count of every StatefulSet at each stage of the ramp
+    #   linear: one more replica per stage
+    #   step: step more replicas per stage
+    #   burst: straight to n
+    if profile == "burst" or start >= n:
+        return [n]
+    if profile == "linear":
+        step = 1
+    if step <= 0:
+        raise ValueError("the ramp step must be positive, got %d" % step)
+    return list(range(start + step, n, step)) + [n]
+
+def ramp_statefulsets(api, sts_objects, n, profile="burst", step=1, interval=0):
+    start = min([sts.spec.replicas or 0 for sts in sts_objects] or [0])
+    stages = get_ramp_stages(start, n, profile, step)
+    for i, replicas in enumerate(stages):
+        if i > 0:
+            time.sleep(interval)
+        started_at = time.time()
+        errors = scale_statefulsets(api, sts_objects, replicas)
+        logging.info("scaled %d statefulsets to %d replicas in %.1fs (stage %d/%d, %d failed)" % (
+            len(sts_objects), replicas, time.time() - started_at, i + 1, len(stages), len(errors)))
+
+def input_ramp_profile():
+    profile = input("ramp profile (linear, step, burst)? ") or "burst"
+    if profile not in RAMP_PROFILES:
+        print("invalid ramp profile")
+        sys.exit(1)
+    step = 1
+    interval = 0
+    if profile == "step":
+        step = int(input("How many replicas per step? "))
+        if step <= 0:
+            print("invalid number of replicas per step")
+            sys.exit(1)
+    if profile != "burst":
+        interval = float(input("How many seconds between steps? "))
+    return profile, step, interval
 
 
 if __name__ == '__main__':
@@ -239,13 +242,17 @@ if __name__ == '__main__':
     if operation == "scale":
         count =  input("How many replicas per StatefulSet? ")
         count = int(count)
+        profile, step, interval = input_ramp_profile()
         sts_objects = get_sts_objects(apps_v1)
-        scale_statefulsets(apps_v1, sts_objects, count)
+        ramp_statefulsets(apps_v1, sts_objects, count, profile, step, interval)
         print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), count))
     elif operation == "monitor":
         preload = input("preload (yes)? ")   
         sts_objects = get_sts_objects(apps_v1)         
-        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), preload == "yes", len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT)
+        informer = Informer(MAX_POD_STARTING_TIME, NAMESPACE)
+        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), preload == "yes", len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT, informer=informer)
+        informer.start()
+        informer.wait_for_synced()
         m.run()
     elif operation == "all":
         workload_type = input("workload type (non_io, io_1, io_2, io_3) ")
@@ -255,50 +262,36 @@ if __name__ == '__main__':
         
         count =  input("How many replicas per StatefulSet? ")
         count = int(count)
+        profile, step, interval = input_ramp_profile()
 
         node_names = get_node_name_list()
         sts_objects = create_sts_objects(node_names, workload_type)
 
-        create_statefulsets(apps_v1, sts_objects)
+        # watch from before the creation to catch every pod, pvc and volume attachment
+        informer = Informer(MAX_POD_STARTING_TIME, NAMESPACE)
+        informer.start()
+        informer.wait_for_synced()
+
+        errors = create_statefulsets(apps_v1, sts_objects)
+        if errors:
+            print("Failed to create %d statefulsets: %s" % (len(errors), ", ".join(errors)))
+            sys.exit(1)
         print("Created %d statefulsets" % (len(sts_objects)))
 
-        print("sleeping for 15s")
-        time.sleep(15)
-        
-        scale_statefulsets(apps_v1, sts_objects, count)
-        print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), count))
+        # sample from now on, so the whole ramp is graphed; the monitor has
+        # to draw from the main thread, the ramp goes to another one
+        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), False, len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT, informer=informer)
+
+        def ramp():
+            print("sleeping for 15s")
+            time.sleep(15)
+            ramp_statefulsets(apps_v1, sts_objects, count, profile, step, interval)
+            print("Scaled %d statefulsets so that each has %d replicas" % (len(sts_objects), count))
+        threading.Thread(target=ramp, daemon=True, name="ramp").start()
 
-        m = monitor.Monitor(core_api_v1, custom_objects_ppi, 5, get_node_capacities(), False, len(sts_objects), MAX_POD_STARTING_TIME, MAX_POD_CRASHING_COUNT)
         m.run()
     else:
         print(operation + "is an invalid operation")
 
-
-    
     # Make a different command for: cleanup
-    # Make the top value up 
-    
-
-
-
-
-    # logging.info("scale-test started")
-    # datastructures to keep track of the timings
-    # TODO: process events and keep track of the results
-    #       results should be per pod/volume
-    #       information to keep track: pod index per sts
-    #       volume-creation time per pod
-    #       volume-attach time per pod
-    #       volume-detach time per pod
-    # pvc_to_va_map = dict()
-    # pvc_to_pod_map = dict()
-    # results = dict()
-
-    # start async event_loop
-    # event_loop = asyncio.get_event_loop()
-    # event_loop.create_task(watch_pods_async())
-    # event_loop.create_task(watch_pvc_async())
-    # event_loop.create_task(watch_va_async())
-    # event_loop.run_forever()
-    # logging.info("scale-test-finished")
-
+    # Make the top value up